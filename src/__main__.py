@@ -11,8 +11,17 @@ command line in this way: python blade.zip
 
 
 import sys
-import blade.main
+import blade.server
+
+
+def _main():
+    # Try to run in the blade server at first, without importing the heavy modules
+    exit_code = blade.server.run_client(sys.argv[1:])
+    if exit_code is not None:
+        return exit_code
+    from blade import main  # pylint: disable=import-outside-toplevel
+    return main.main(sys.argv[0], sys.argv[1:])
 
 
 if __name__ == '__main__':
-    sys.exit(blade.main.main(sys.argv[0], sys.argv[1:]))
+    sys.exit(_main())
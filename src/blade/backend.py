@@ -22,6 +22,8 @@ import subprocess
 import sys
 import textwrap
 
+from blade import build_times
+from blade import builtin_tools_server
 from blade import config
 from blade import console
 from blade import util
@@ -127,6 +129,14 @@ class _NinjaFileHeaderGenerator(object):
                 pool heavy_pool
                   depth = 1
                 '''))
+        if self.blade.heavy_compile_outputs():
+            # Limit the compiles which are known to use much memory
+            heavy_cc_jobs = self.blade.heavy_compile_jobs_num()
+            console.info('Adjust parallel heavy compile jobs number to %s' % heavy_cc_jobs)
+            self._add_line(textwrap.dedent('''\
+                    pool heavy_cc_pool
+                      depth = %s
+                    ''') % heavy_cc_jobs)
 
     def generate_common_rules(self):
         self.generate_rule(name='copy',
@@ -211,7 +221,11 @@ class _NinjaFileHeaderGenerator(object):
         return filtered_cppflags, filtered_cxxflags, filtered_cflags, cuflags
 
     def generate_cc_rules(self):
-        cc, cxx, ld = self.build_accelerator.get_cc_commands()
+        if self.command == 'dump' and self.options.dump_compdb:
+            # The raw compilers without the accelerator prefix are expected by the tools
+            cc, cxx, ld = self.build_toolchain.get_cc_commands()
+        else:
+            cc, cxx, ld = self.build_accelerator.get_cc_commands()
         cppflags, linkflags = self._get_intrinsic_cc_flags()
         self._generate_cc_compile_rules(cc, cxx, cppflags)
         self._generate_cc_inclusion_check_rule()
@@ -253,7 +267,8 @@ class _NinjaFileHeaderGenerator(object):
 
         cc_command = ('%s -o ${out} -MMD -MF ${out}.d -c -fPIC %s %s ${optimize} '
                       '${c_warnings} ${cppflags} %s ${includes} ${in}') % (
-                              cc, ' '.join(cflags), ' '.join(cppflags), includes)
+                              self._peak_rss_command(cc), ' '.join(cflags), ' '.join(cppflags),
+                              includes)
         self.generate_rule(name='cc',
                            command=template % cc_command,
                            description='CC ${in}',
@@ -262,7 +277,8 @@ class _NinjaFileHeaderGenerator(object):
 
         cxx_command = ('%s -o ${out} -MMD -MF ${out}.d -c -fPIC %s %s ${optimize} '
                        '${cxx_warnings} ${cppflags} %s ${includes} ${in}') % (
-                               cxx, ' '.join(cxxflags), ' '.join(cppflags), includes)
+                               self._peak_rss_command(cxx), ' '.join(cxxflags), ' '.join(cppflags),
+                               includes)
         self.generate_rule(name='cxx',
                            command=template % cxx_command,
                            description='CXX ${in}',
@@ -274,7 +290,24 @@ class _NinjaFileHeaderGenerator(object):
                            description='SECRET CC ${in}',
                            depfile='${out}.d')
 
-        self._generate_cc_hdrs_rule(cc, cxx, cppflags, cflags, cxxflags, includes)
+        # Preprocessing can't be cached by the accelerator, use the raw compilers
+        raw_cc, raw_cxx, _ = self.build_toolchain.get_cc_commands()
+        self._generate_cc_hdrs_rule(raw_cc, raw_cxx, cppflags, cflags, cxxflags, includes)
+
+    def _peak_rss_command(self, cc):
+        """Wrap the compiler to record the peak RSS of the compiles if it is enabled."""
+        if not config.get_item('cc_config', 'compile_memory_profiling'):
+            return cc
+        if self.command == 'dump' and self.options.dump_compdb:
+            return cc
+        python = os.environ.get('BLADE_PYTHON_INTERPRETER') or sys.executable
+        log_file = build_times.peak_rss_log(self.build_dir)
+        if os.path.isdir(self.blade_path):
+            # Run as a script to avoid importing the whole `blade` package
+            return '%s %s %s ${out} %s' % (
+                    python, os.path.join(self.blade_path, 'blade', 'peak_rss.py'), log_file, cc)
+        return 'PYTHONPATH=%s:$$PYTHONPATH %s -m blade.peak_rss %s ${out} %s' % (
+                self.blade_path, python, log_file, cc)
 
     def _generate_cc_hdrs_rule(self, cc, cxx, cppflags, cflags, cxxflags, includes):
         """
@@ -704,7 +737,8 @@ class _NinjaFileHeaderGenerator(object):
 
         template = self._cc_compile_command_wrapper_template('${out}.H', cuda=True)
 
-        _, cxx, _ = self.build_accelerator.get_cc_commands()
+        # The host compiler of nvcc must be a single executable
+        _, cxx, _ = self.build_toolchain.get_cc_commands()
         cu_command = '%s -ccbin %s -o ${out} -MMD -MF ${out}.d ' \
             '-Xcompiler -fPIC %s %s %s ${optimize} ${cu_warnings} ' \
             '%s ${includes} ${cppflags} ${cuflags} -c ${in}' % (
@@ -730,9 +764,18 @@ class _NinjaFileHeaderGenerator(object):
             description='CUDA LINK SHARED ${out}')
 
     def _builtin_command(self, builder, args=''):
-        cmd = ['PYTHONPATH=%s:$$PYTHONPATH' % self.blade_path]
         python = os.environ.get('BLADE_PYTHON_INTERPRETER') or sys.executable
-        cmd.append('%s -m blade.builtin_tools %s' % (python, builder))
+        if not config.get_item('global_config', 'builtin_tools_worker'):
+            cmd = ['PYTHONPATH=%s:$$PYTHONPATH' % self.blade_path]
+            cmd.append('%s -m blade.builtin_tools %s' % (python, builder))
+        elif os.path.isdir(self.blade_path):
+            # Run the client as a script to avoid importing the whole `blade` package
+            cmd = ['%s %s %s %s' % (python, os.path.join(self.blade_path, 'blade', 'builtin_tools_client.py'),
+                                    builtin_tools_server.socket_path(self.build_dir), builder)]
+        else:
+            cmd = ['PYTHONPATH=%s:$$PYTHONPATH' % self.blade_path]
+            cmd.append('%s -m blade.builtin_tools_client %s %s' % (
+                python, builtin_tools_server.socket_path(self.build_dir), builder))
         if args:
             cmd.append(args)
         else:
@@ -789,6 +832,13 @@ class NinjaFileGenerator(object):
     def generate_build_script(self):
         """Generate build script for underlying build system."""
         code = self.generate_build_code()
+        # Keep the unchanged build script untouched, to avoid ninja to stat and reparse it needlessly.
+        fingerprint = util.md5sum(''.join(code))
+        if (self.blade.get_ninja_fingerprint(self.script_path) == fingerprint and
+                os.path.exists(self.script_path)):
+            console.debug('Using cached %s' % self.script_path)
+            return
         script = open(self.script_path, 'w')
         script.writelines(code)
         script.close()
+        self.blade.set_ninja_fingerprint(self.script_path, fingerprint)
@@ -15,13 +15,14 @@ This module executes a binary programs.
 from __future__ import absolute_import
 from __future__ import print_function
 
+import glob
 import os
-import shutil
 import subprocess
 import sys
 
 from blade import config
 from blade import console
+from blade import runfiles
 from blade.util import environ_add_path
 
 
@@ -48,8 +49,10 @@ class BinaryRunner(object):
         """Returns the executable path."""
         return os.path.join(self.build_dir, target.path, target.name)
 
-    def _runfiles_dir(self, target):
-        """Returns runfiles dir."""
+    def _runfiles_dir(self, target, shard_index=None):
+        """Returns runfiles dir, each shard of a sharded test has its own one."""
+        if shard_index is not None:
+            return '%s.shard%d.runfiles' % (self._executable(target), shard_index)
         return '%s.runfiles' % self._executable(target)
 
     def __check_test_data_dest(self, target, dest, dest_list):
@@ -66,16 +69,16 @@ class BinaryRunner(object):
             if long_path.startswith(short_path) and long_path[len(short_path)] == '/':
                 target.error('"%s" could not exist with "%s" in testdata' % (dest, item))
 
-    def _prepare_env(self, target):
+    def _prepare_env(self, target, shard_index=None):
         """Prepare the running environment."""
 
-        # Prepare `<target_name>.runfiles` directory
-        runfiles_dir = self._runfiles_dir(target)
-        shutil.rmtree(runfiles_dir, ignore_errors=True)
-        os.mkdir(runfiles_dir)
-
-        self._prepare_shared_libraries(target, runfiles_dir)
-        self._prepare_test_data(target)
+        # Prepare `<target_name>.runfiles` directory, it is kept between runs and
+        # only the changed entries are updated.
+        runfiles_dir = self._runfiles_dir(target, shard_index)
+        manifest = {}  # dict{dest: (kind, src)}
+        self._prepare_shared_libraries(target, manifest)
+        self._prepare_test_data(target, manifest)
+        runfiles.sync(runfiles_dir, manifest)
 
         # Prepare environments
         run_env = dict(os.environ)
@@ -94,7 +97,7 @@ class BinaryRunner(object):
 
         return run_env
 
-    def _prepare_shared_libraries(self, target, runfiles_dir):
+    def _prepare_shared_libraries(self, target, manifest):
         """Prepare correct shared libraries for running target"""
 
         # Make symbolic links for shared libraries of the executable.
@@ -103,8 +106,7 @@ class BinaryRunner(object):
         # For example, `build64_release/common/crypto/hash/libhash.so`, we need put a symbolic
         # link `build64_release` to the it's full path.
         build_dir_name = os.path.basename(self.build_dir)
-        os.symlink(os.path.abspath(self.build_dir),
-                   os.path.join(runfiles_dir, build_dir_name))
+        manifest[build_dir_name] = ('link', os.path.abspath(self.build_dir))
 
         # For shared libraries with `soname`, their path were not been writen into the executable,
         # they are always been searched from some given paths.
@@ -112,16 +114,15 @@ class BinaryRunner(object):
         # libcrypto.so.1.0.0 => /lib64/libcrypto.so.1.0.0 (0x00007f0705d9f000)
         for soname, full_path in self._get_shared_libraries_with_soname(target):
             src = os.path.abspath(full_path)
-            dst = os.path.join(runfiles_dir, soname)
-            if os.path.lexists(dst):
+            if soname in manifest:
                 console.warning('Trying to make duplicate symlink for shared library:\n'
                                 '%s -> %s\n'
                                 '%s -> %s already exists\n'
                                 'skipped, should check duplicate prebuilt '
                                 'libraries'
-                                % (dst, src, dst, os.path.realpath(dst)))
+                                % (soname, src, soname, manifest[soname][1]))
                 continue
-            os.symlink(src, dst)
+            manifest[soname] = ('link', src)
 
     def _get_shared_libraries_with_soname(self, target):
         """Get shared libraries with soname for one target that it depends."""
@@ -134,10 +135,9 @@ class BinaryRunner(object):
                     file_list.append(value)
         return file_list
 
-    def _prepare_test_data(self, target):
+    def _prepare_test_data(self, target, manifest):
         if 'testdata' not in target.attr:
             return
-        runfiles_dir = self._runfiles_dir(target)
         dest_list = []
         for i in target.attr['testdata']:
             if isinstance(i, tuple):
@@ -156,46 +156,41 @@ class BinaryRunner(object):
             dest = os.path.normpath(dest)
             self.__check_test_data_dest(target, dest, dest_list)
             dest_list.append(dest)
-            dest_path = os.path.join(runfiles_dir, dest)
-            if os.path.exists(dest_path):
+            if dest in manifest:
                 target.warning('"%s" already existed, could not prepare testdata.' % dest)
                 continue
-            try:
-                os.makedirs(os.path.dirname(dest_path))
-            except OSError:
-                pass
 
             if os.path.isfile(src):
-                shutil.copy2(src, dest_path)
+                manifest[dest] = ('copy', src)
             elif os.path.isdir(src):
-                shutil.copytree(src, dest_path)
+                manifest.update(runfiles.expand_dir(src, dest))
 
-        self._prepare_extra_test_data(target)
+        self._prepare_extra_test_data(target, manifest)
 
-    def _prepare_extra_test_data(self, target):
+    def _prepare_extra_test_data(self, target, manifest):
         """Prepare extra test data specified in the .testdata file if it exists."""
         testdata = os.path.join(self.build_dir, target.path,
                                 '%s.testdata' % target.name)
         if os.path.isfile(testdata):
-            runfiles_dir = self._runfiles_dir(target)
             for line in open(testdata):
                 data = line.strip().split()
                 if len(data) == 1:
                     src, dst = data[0], ''
                 else:
                     src, dst = data[0], data[1]
-                dst = os.path.join(runfiles_dir, dst)
-                dst_dir = os.path.dirname(dst)
-                if not os.path.isdir(dst_dir):
-                    os.makedirs(dst_dir)
-                shutil.copy2(src, dst)
+                if not dst or dst.endswith('/'):
+                    dst = os.path.join(dst, os.path.basename(src))
+                manifest[os.path.normpath(dst)] = ('copy', src)
 
     def _clean_target(self, target):
         """Clean the executive environment."""
         build_dir_name = os.path.basename(self.build_dir)
-        link_path = os.path.join(self._runfiles_dir(target), build_dir_name)
-        if os.path.exists(link_path):
-            os.remove(link_path)
+        runfiles_dirs = [self._runfiles_dir(target)]
+        runfiles_dirs += glob.glob('%s.shard*.runfiles' % self._executable(target))
+        for runfiles_dir in runfiles_dirs:
+            link_path = os.path.join(runfiles_dir, build_dir_name)
+            if os.path.exists(link_path):
+                os.remove(link_path)
 
     def _clean_for_coverage(self):
         """Clean executive environment for coverage generating."""
@@ -11,12 +11,42 @@ Build accelerator (ccache, distcc, etc.) manage module.
 from __future__ import absolute_import
 from __future__ import print_function
 
+import os
+
+from blade import config
+from blade import console
+from blade import util
+
+
+# The counters of the cache hits and misses in `ccache --print-stats`, the names are changed
+# in ccache 4.0
+_CCACHE_DIRECT_HITS = ('direct_cache_hit', 'cache_hit_direct')
+_CCACHE_PREPROCESSED_HITS = ('preprocessed_cache_hit', 'cache_hit_preprocessed')
+_CCACHE_MISSES = ('cache_miss',)
+
+
+def _is_ccache(command):
+    return os.path.basename(command.split()[0]) == 'ccache'
+
 
 class BuildAccelerator(object):
     """Describe a build accelerator."""
 
     def __init__(self, toolchain):
         self.__toolchain = toolchain
+        self.__ccache_enabled = None
+        self.__ccache_stats = None  # The ccache counters before the build
+
+    def _ccache_enabled(self):
+        if self.__ccache_enabled is None:
+            self.__ccache_enabled = False
+            if config.get_item('cc_config', 'ccache'):
+                if util.which('ccache'):
+                    self.__ccache_enabled = True
+                else:
+                    console.warning('"cc_config.ccache" is enabled but ccache is not found, '
+                                    'compile without it')
+        return self.__ccache_enabled
 
     def get_cc_commands(self):
         """Get correct c/c++ commands with proper build accelerator prefix
@@ -24,11 +54,115 @@ class BuildAccelerator(object):
             cc, cxx, linker
         """
         cc, cxx, ld = self.__toolchain.get_cc_commands()
+        # The linker is not prefixed because linking can't be cached
+        if self._ccache_enabled():
+            if not _is_ccache(cc):
+                cc = 'ccache ' + cc
+            if not _is_ccache(cxx):
+                cxx = 'ccache ' + cxx
         return cc, cxx, ld
     
     def get_ar_command(self):
         return self.__toolchain.get_ar()
 
-    def adjust_jobs_num(self, cpu_core_num):
-        # Calculate job numbers smartly
-        return cpu_core_num
+    def adjust_jobs_num(self, cpu_core_num, job_memory=0):
+        """Calculate the number of build jobs by the current load and the available memory.
+
+        Args:
+            job_memory: int, the typical peak RSS in bytes of a build job, 0 if it is unknown.
+        """
+        # The cores busy with other processes are not used, but not less than the half, in
+        # case of a transient high load
+        jobs_num = max(cpu_core_num - util.running_processes(), cpu_core_num // 2, 1)
+        if job_memory > 0:
+            jobs_num = min(jobs_num, self._memory_jobs_num(job_memory))
+        return jobs_num
+
+    def heavy_jobs_num(self, cpu_core_num, job_memory):
+        """Calculate the number of the memory heavy build jobs which can run simultaneously.
+
+        It is written into the build.ninja, so it is calculated from the physical memory rather
+        than the available memory, which changes on every run and would make the build.ninja
+        be regenerated each time.
+
+        Args:
+            job_memory: int, the peak RSS in bytes of the heaviest build job.
+        """
+        return min(cpu_core_num, max(util.physical_memory() // job_memory, 1))
+
+    def _memory_jobs_num(self, job_memory):
+        return max(util.available_memory() // job_memory, 1)
+
+    def setup(self):
+        """Setup the build accelerator before the build."""
+        if not self._ccache_enabled():
+            return
+        self._setup_ccache()
+        self.__ccache_stats = self._ccache_stats()
+
+    def _setup_ccache(self):
+        """Setup the cache dir and its size limit in the environment of the build."""
+        cc_config = config.get_section('cc_config')
+        # Make the absolute paths under the workspace relative in the hash, so the cache can be
+        # shared by different workspaces
+        os.environ.setdefault('CCACHE_BASEDIR', os.getcwd())
+        cache_dir = cc_config['ccache_dir']
+        if cache_dir:
+            cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+            if not os.path.isdir(cache_dir):
+                self._make_shared_cache_dir(cache_dir)
+            os.environ['CCACHE_DIR'] = cache_dir
+        max_size = cc_config['ccache_max_size']
+        if max_size:
+            returncode, _, stderr = util.run_command(['ccache', '--max-size=%s' % max_size])
+            if returncode != 0:
+                console.warning('Failed to set the max size of ccache: %s' % stderr.strip())
+
+    def _make_shared_cache_dir(self, cache_dir):
+        """Make a cache dir which can be shared by the users, like `tool/setup-shared-ccache.py`."""
+        old_umask = os.umask(0)
+        try:
+            os.makedirs(cache_dir, 0o2777)
+            with open(os.path.join(cache_dir, 'ccache.conf'), 'w') as f:
+                f.write('umask = 000\n')
+        except (IOError, OSError) as e:
+            console.warning('Failed to create the ccache dir "%s": %s' % (cache_dir, e))
+            return
+        finally:
+            os.umask(old_umask)
+        console.info('Created shared ccache dir "%s"' % cache_dir)
+
+    def _ccache_stats(self):
+        """Return the counters of ccache, dict{name: count}, or None if they are unavailable."""
+        returncode, stdout, stderr = util.run_command(['ccache', '--print-stats'])
+        if returncode != 0:  # Before ccache 3.7
+            console.debug('Failed to get the ccache stats: %s' % stderr.strip())
+            return None
+        stats = {}
+        for line in stdout.splitlines():
+            fields = line.split('\t')
+            if len(fields) == 2 and fields[1].isdigit():
+                stats[fields[0]] = int(fields[1])
+        return stats
+
+    def report(self):
+        """Report the stats of the build accelerator in the build."""
+        if not self.__ccache_stats:
+            return
+        stats = self._ccache_stats()
+        if not stats:
+            return
+
+        def delta(names):
+            return sum(stats.get(name, 0) - self.__ccache_stats.get(name, 0) for name in names)
+
+        direct_hits = delta(_CCACHE_DIRECT_HITS)
+        preprocessed_hits = delta(_CCACHE_PREPROCESSED_HITS)
+        misses = delta(_CCACHE_MISSES)
+        self.__ccache_stats = None
+        total = direct_hits + preprocessed_hits + misses
+        if total <= 0:
+            return
+        console.info('ccache: %d hits (%d direct, %d preprocessed), %d misses, hit rate %.1f%%' % (
+            direct_hits + preprocessed_hits, direct_hits, preprocessed_hits, misses,
+            (direct_hits + preprocessed_hits) * 100.0 / total))
@@ -15,21 +15,30 @@ from __future__ import print_function
 
 import json
 import os
+import sqlite3
 import subprocess
 import sys
 import time
 
+from blade import builtin_tools_server
 from blade import config
 from blade import console
+from blade import critical_path
+from blade import inclusion_check
+from blade import load_build_files
 from blade import maven
 from blade import ninja_runner
 from blade import target_pattern
+from blade import trace
 from blade.binary_runner import BinaryRunner
+from blade.builtin_tools_server import BuiltinToolsWorker
 from blade.toolchain import ToolChain
 from blade.build_accelerator import BuildAccelerator
+from blade.build_times import BuildTimes
 from blade.dependency_analyzer import analyze_deps
 from blade.load_build_files import load_targets
 from blade.backend import NinjaFileGenerator
+from blade.test_impact import TestImpactAnalyzer, changed_files_since
 from blade.test_runner import TestRunner
 from blade.util import (cpu_count, md5sum_file, pickle)
 
@@ -40,6 +49,12 @@ instance = None
 # Start of fingerprint line in each per-target ninja file
 _NINJA_FILE_FINGERPRINT_START = '#Fingerprint='
 
+# Index file of the fingerprints of all generated ninja files
+_NINJA_FINGERPRINTS_FILE = '.ninja_fingerprints.data'
+
+# Increase this number if the format of the fingerprints index file is changed.
+_NINJA_FINGERPRINTS_VERSION = 1
+
 _ALL_COMMAND_TARGETS = '__ALL_COMMAND_TARGETS__'
 
 class Blade(object):
@@ -101,14 +116,23 @@ class Blade(object):
         # Indicate whether the deps list is expanded by expander or not
         self.__targets_expanded = False
 
-        self.__build_toolchain = ToolChain()
+        self.__build_toolchain = ToolChain(self.__build_dir)
         self.build_accelerator = BuildAccelerator(self.__build_toolchain)
         self.__build_jobs_num = 0
+        self.__peak_rss = None
+        self.__heavy_compile_outputs = None
 
         self.__build_script = os.path.join(self.__build_dir, 'build.ninja')
 
+        # Fingerprints of the generated ninja files, dict{path: fingerprint}
+        self.__ninja_fingerprints = {}
+        self.__ninja_fingerprints_changed = False
+
         self.__all_rule_names = []
 
+        # Result of the test impact analysis, None if it is not enabled
+        self.__test_impact = None
+
     def load_targets(self):
         """Load the targets."""
         console.info('Loading BUILD files...')
@@ -137,10 +161,38 @@ class Blade(object):
         console.info('Analyzing dependency graph...')
         self.__sorted_targets_keys = analyze_deps(self.__build_targets)
         self.__targets_expanded = True
+        if self.__command == 'test':
+            self._analyze_test_impact()
 
         console.info('Analyzing done.')
         return self.__build_targets  # For test
 
+    def _analyze_test_impact(self):
+        """Only build and run the tests affected by the changed files if they are specified."""
+        changed_files = None
+        if self.__options.changed_files:
+            changed_files = [os.path.normpath(os.path.join(self.__working_dir, f.strip()))
+                             for f in self.__options.changed_files.split(',') if f.strip()]
+        if self.__options.changed_since:
+            changed_files = (changed_files or []) + changed_files_since(self.__options.changed_since)
+        if changed_files is None:
+            return
+        tests = [key for key in self.__expanded_command_targets
+                 if self.__build_targets[key].type.endswith('_test')]
+        global_files = [os.path.relpath(os.path.abspath(f))
+                        for f in config.input_files() + list(load_build_files.loaded_extra_files())]
+        self.__test_impact = TestImpactAnalyzer(self.__build_targets, global_files).analyze(
+                changed_files, tests)
+        unowned_files = self.__test_impact['unowned_files']
+        if unowned_files:
+            console.warning('%d changed files are not owned by any target, such as "%s", '
+                            'all tests are affected' % (len(unowned_files), unowned_files[0]))
+        selected = self.__test_impact['selected']
+        console.info('Test impact analysis: %d changed files, %d of %d tests are affected' % (
+            len(self.__test_impact['changed_files']), len(selected), len(tests)))
+        # Only the affected tests need to be built
+        self.__expanded_command_targets = set(selected)
+
     def build_script(self):
         """Return build script file name"""
         return self.__build_script
@@ -148,9 +200,11 @@ class Blade(object):
     def generate_build_code(self):
         """Generate the backend build code."""
         console.info('Generating backend build code...')
+        self._load_ninja_fingerprints()
         generator = NinjaFileGenerator(self.__build_script, self.__blade_path, self)
         generator.generate_build_script()
         self.__all_rule_names = generator.get_all_rule_names()
+        self._save_ninja_fingerprints()
         console.info('Generating done.')
 
     def generate(self):
@@ -158,22 +212,24 @@ class Blade(object):
         if self.__command == 'query':
             return
         maven_cache = maven.MavenCache.instance(self.__build_dir)
-        maven_cache.download_all()
+        with trace.span('maven download', 'maven'):
+            maven_cache.download_all()
         self._write_inclusion_declaration_file()
         self.generate_build_code()
 
     def _write_inclusion_declaration_file(self):
         from blade import cc_targets  # pylint: disable=import-outside-toplevel
         inclusion_declaration_file = os.path.join(self.__build_dir, 'inclusion_declaration.data')
-        with open(inclusion_declaration_file, 'wb') as f:
-            pickle.dump(cc_targets.inclusion_declaration(), f)
+        inclusion_check.write_global_declaration(inclusion_declaration_file,
+                                                 cc_targets.inclusion_declaration())
 
-    def _write_build_stamp_fime(self, start_time, exit_code):
+    def _write_build_stamp_fime(self, start_time, exit_code, ninja_log_range):
         """Record some useful data for other tools."""
         stamp_data = {
             'start_time': start_time,
             'end_time': time.time(),
             'exit_code': exit_code,
+            'ninja_log_range': ninja_log_range,
             'direct_targets': list(self.__direct_targets),
             'command_targets': list(self.__expanded_command_targets),
             'build_targets': list(self.__build_targets.keys()),
@@ -183,6 +239,87 @@ class Blade(object):
         with open(stamp_file, 'w') as f:
             json.dump(stamp_data, f, indent=4)
 
+    def _targets_of_outputs(self, outputs):
+        """Map the outputs to the keys of the build targets which generate them."""
+        dirs = set()
+        for output in outputs:
+            parent = os.path.dirname(output)
+            while parent and parent not in dirs:
+                dirs.add(parent)
+                parent = os.path.dirname(parent)
+        owners = {}  # dict{path in the clean lists: target key}
+        for key, target in self.__build_targets.items():
+            if target.target_dir not in dirs:
+                continue
+            target.get_build_code()  # Ensure the clean list is generated
+            for path in target.get_clean_list():
+                owners[path] = key
+        result = {}
+        for output in outputs:
+            # Some outputs are cleaned by their dirs, such as the objects dir
+            path = output
+            while path and path not in owners:
+                path = os.path.dirname(path)
+            if path:
+                result[output] = owners[path]
+        return result
+
+    def _update_build_times(self):
+        """Ingest the ninja log of the build into the build time history."""
+        build_times = BuildTimes(self.__build_dir)
+        try:
+            build_times.load()
+            items = build_times.ingest(os.path.join(self.__build_dir, '.ninja_log'),
+                                       self._targets_of_outputs)
+            # The peak RSS of the cache hits are much lower than the real compiles
+            build_times.ingest_peak_rss(keep_max=config.get_item('cc_config', 'ccache'))
+        except sqlite3.Error as e:
+            console.warning('Failed to update the build time history: %s' % e)
+            return
+        finally:
+            build_times.close()
+        if self.__options.show_builds_slower_than is not None:
+            self._show_slow_builds(items, self.__options.show_builds_slower_than)
+
+    def _show_slow_builds(self, items, threshold):
+        """Show the outputs which are slow to build, with their average build times before."""
+        slow_items = sorted((item for item in items if item.durations[-1] > threshold),
+                            key=lambda item: item.durations[-1])
+        if not slow_items:
+            return
+        console.notice('Slow build targets:')
+        for item in slow_items:
+            duration = item.durations[-1]
+            history = item.durations[:-1]
+            if history:
+                average = sum(history) / len(history)
+                trend = 'avg %.4gs, %+.0f%%' % (average, (duration - average) * 100 / average
+                                                 if average else 0)
+            else:
+                trend = 'first build'
+            console.notice('%.4gs\t(%s)\t%s' % (duration, trend, item.output), prefix=False)
+
+    def _analyze_critical_path(self, log_range):
+        """Analyze the critical path of the build whose entries are in the range of the ninja log.
+
+        Returns:
+            The result of `critical_path.analyze`, or None if the entries of the build
+            can't be distinguished because the ninja log is rewritten.
+        """
+        entries, _, rewritten = ninja_runner.read_ninja_log(
+                os.path.join(self.__build_dir, '.ninja_log'), log_range[0], log_range[1])
+        if rewritten:
+            return None
+        graph = critical_path.parse_ninja_graph(self.build_script())
+        return critical_path.analyze(entries, graph, self.build_jobs_num(), self._targets_of_outputs)
+
+    def _show_critical_path(self, log_range):
+        result = self._analyze_critical_path(log_range)
+        if result is None:
+            console.warning('Critical path is unavailable because the ninja log is rewritten')
+            return
+        critical_path.show(result)
+
     def revision(self):
         """Blade revision to identify changes"""
         if self.__blade_revision is None:
@@ -199,13 +336,32 @@ class Blade(object):
         console.info('Building...')
         console.flush()
         start_time = time.time()
-        returncode = ninja_runner.build(
-            self.get_build_dir(),
-            self.build_script(),
-            self.build_jobs_num(),
-            targets='',  # FIXME: because not all targets has a targets
-            options=self.__options)
-        self._write_build_stamp_fime(start_time, returncode)
+        ninja_log = os.path.join(self.__build_dir, '.ninja_log')
+        log_position = ninja_runner.ninja_log_position(ninja_log)
+        if not self.__options.dry_run:
+            self.build_accelerator.setup()
+        worker = None
+        if config.get_item('global_config', 'builtin_tools_worker'):
+            worker = BuiltinToolsWorker(self.__blade_path, self.__build_dir)
+            worker.start()
+        try:
+            returncode = ninja_runner.build(
+                self.get_build_dir(),
+                self.build_script(),
+                self.build_jobs_num(),
+                targets=_ALL_COMMAND_TARGETS,
+                options=self.__options)
+        finally:
+            if worker:
+                builtin_tools_server.report_stats(worker.stop())
+        if not self.__options.dry_run:
+            self.build_accelerator.report()
+        log_range = [log_position, ninja_runner.ninja_log_position(ninja_log)]
+        if not self.__options.dry_run:
+            self._update_build_times()
+        if self.__options.critical_path:
+            self._show_critical_path(log_range)
+        self._write_build_stamp_fime(start_time, returncode, log_range)
         if returncode != 0:
             console.error('Build failure.')
         else:
@@ -245,7 +401,8 @@ class Blade(object):
                 self.__expanded_command_targets,
                 self.__build_targets,
                 exclude_tests,
-                self.test_jobs_num())
+                self.test_jobs_num(),
+                self.__test_impact)
         return test_runner.run()
 
     @staticmethod
@@ -400,6 +557,10 @@ class Blade(object):
             return self._dump_targets(output_file_name)
         if self.__options.dump_all_tags:
             return self._dump_all_tags(output_file_name)
+        if self.__options.dump_build_times:
+            return self._dump_build_times(output_file_name)
+        if self.__options.dump_critical_path:
+            return self._dump_critical_path(output_file_name)
         # The "--config" is already handled before this
         raise AssertionError("Invalid dump option")
 
@@ -421,6 +582,51 @@ class Blade(object):
             print(file=f)
         return 0
 
+    def _dump_build_times(self, output_file_name):
+        """Implement the "dump --build-times" subcommand."""
+        build_times = BuildTimes(self.__build_dir)
+        try:
+            build_times.load()
+            items = build_times.items()
+        finally:
+            build_times.close()
+        result = []
+        for item in sorted(items, key=lambda item: (-item.average, item.output)):
+            if item.target not in self.__expanded_command_targets:
+                continue
+            result.append({
+                'output': item.output,
+                'target': item.target,
+                'last': item.durations[-1],
+                'average': item.average,
+                'durations': item.durations,
+                'build_time': item.build_time,
+                'peak_rss': item.peak_rss,
+            })
+        with open(output_file_name, 'w') as f:
+            json.dump(result, fp=f, indent=2)
+            print(file=f)
+        return 0
+
+    def _dump_critical_path(self, output_file_name):
+        """Implement the "dump --critical-path" subcommand."""
+        stamp_file = os.path.join(self.__build_dir, 'blade_build_stamp.json')
+        try:
+            with open(stamp_file) as f:
+                log_range = json.load(f)['ninja_log_range']
+        except (IOError, OSError, ValueError, KeyError):
+            console.error('No build is found, please build at first')
+            return 1
+        result = self._analyze_critical_path(log_range)
+        if result is None:
+            console.error('Critical path of the last build is unavailable because the ninja log '
+                          'is rewritten')
+            return 1
+        with open(output_file_name, 'w') as f:
+            json.dump(result, fp=f, indent=2)
+            print(file=f)
+        return 0
+
     def _dump_all_tags(self, output_file_name):
         """Implement the "dump --targets" subcommand."""
         with open(output_file_name, 'w') as f:
@@ -489,6 +695,48 @@ class Blade(object):
             console.fatal('Target %s is duplicate in //%s/BUILD' % (target.name, target.path))
         self.__target_database[key] = target
 
+    def _load_ninja_fingerprints(self):
+        """Load the fingerprints index of the generated ninja files."""
+        path = os.path.join(self.__build_dir, _NINJA_FINGERPRINTS_FILE)
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('version') == _NINJA_FINGERPRINTS_VERSION:
+                self.__ninja_fingerprints = data['fingerprints']
+        except Exception:  # pylint: disable=broad-except
+            # Missing or corrupted index file, fallback to read the fingerprints from the ninja files.
+            pass
+
+    def _save_ninja_fingerprints(self):
+        """Save the fingerprints index of the generated ninja files if it is changed."""
+        if not self.__ninja_fingerprints_changed:
+            return
+        path = os.path.join(self.__build_dir, _NINJA_FINGERPRINTS_FILE)
+        data = {
+            'version': _NINJA_FINGERPRINTS_VERSION,
+            'fingerprints': self.__ninja_fingerprints,
+        }
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(path + '.tmp', path)
+        except (IOError, OSError) as e:
+            console.warning('Failed to save ninja fingerprints: %s' % e)
+        self.__ninja_fingerprints_changed = False
+
+    def get_ninja_fingerprint(self, ninja_file):
+        """Return the fingerprint of the ninja file when it was generated."""
+        return self.__ninja_fingerprints.get(ninja_file)
+
+    def set_ninja_fingerprint(self, ninja_file, fingerprint):
+        """Record the fingerprint of the generated ninja file, None to remove it."""
+        if fingerprint is None:
+            if self.__ninja_fingerprints.pop(ninja_file, None) is not None:
+                self.__ninja_fingerprints_changed = True
+        elif self.__ninja_fingerprints.get(ninja_file) != fingerprint:
+            self.__ninja_fingerprints[ninja_file] = fingerprint
+            self.__ninja_fingerprints_changed = True
+
     def _read_fingerprint(self, ninja_file):
         """Read fingerprint from per-target ninja file"""
         try:
@@ -514,7 +762,10 @@ class Blade(object):
         # same name as the main build.ninja file (when target.name == 'build')
         target_ninja = target._target_file_path('%s.build.ninja' % target.name)
 
-        old_fingerprint = self._read_fingerprint(target_ninja)
+        old_fingerprint = self.get_ninja_fingerprint(target_ninja)
+        if old_fingerprint is None or not os.path.exists(target_ninja):
+            # The recorded fingerprint is unusable if the file is removed
+            old_fingerprint = self._read_fingerprint(target_ninja)
         fingerprint = target.fingerprint()
 
         if fingerprint == old_fingerprint:
@@ -522,14 +773,21 @@ class Blade(object):
             # If the command is "clean", we still need to generate rules to obtain the clean list
             if self.__command == 'clean':
                 target.get_build_code()
+                # The ninja file will be removed by the clean
+                self.set_ninja_fingerprint(target_ninja, None)
+            else:
+                self.set_ninja_fingerprint(target_ninja, fingerprint)
             return target_ninja
 
         code = target.get_build_code()
         if code:
             console.debug('Generating %s' % target_ninja)
             self._write_target_ninja_file(target, target_ninja, code, fingerprint)
+            self.set_ninja_fingerprint(
+                target_ninja, fingerprint if self.__command != 'clean' else None)
             return target_ninja
 
+        self.set_ninja_fingerprint(target_ninja, None)
         return None
 
     def generate_targets_build_code(self):
@@ -544,16 +802,19 @@ class Blade(object):
                 continue
             if skip_package and target.type == 'package' and k not in self.__direct_targets:
                 continue
-            target.before_generate()
-            target_ninja = self._find_or_generate_target_ninja_file(target)
+            with trace.span(k, 'generate'):
+                target.before_generate()
+                target_ninja = self._find_or_generate_target_ninja_file(target)
             if target_ninja:
                 target._remove_on_clean(target_ninja)
-                code += 'include %s\n' % target_ninja
+                code.append('include %s\n' % target_ninja)
                 if k in self.__expanded_command_targets:
                     command_target_outputs.append(target.get_outputs_goal())
-        # TODO: reland this feature
-        # code.append('build %s: phony %s\n' % (_ALL_COMMAND_TARGETS, ' '.join(command_target_outputs)))
-        # code.append('default %s\n' % (_ALL_COMMAND_TARGETS))
+        # The order of includes doesn't matter, sort them to keep the build script stable
+        code.sort()
+        # Only the command targets and their dependencies need to be built
+        code.append('build %s: phony %s\n' % (_ALL_COMMAND_TARGETS, ' '.join(sorted(command_target_outputs))))
+        code.append('default %s\n' % (_ALL_COMMAND_TARGETS))
         return code
 
     def get_build_toolchain(self):
@@ -577,7 +838,11 @@ class Blade(object):
         jobs_num = config.get_item('global_config', 'build_jobs')
         if jobs_num > 0:
             return jobs_num
-        jobs_num = self.build_accelerator.adjust_jobs_num(cpu_count())
+        # Use the median peak RSS as the typical memory of a job, the heavy ones are limited
+        # by the `heavy_cc_pool`
+        peak_rss = sorted(self._load_peak_rss().values())
+        job_memory = peak_rss[len(peak_rss) // 2] if peak_rss else 0
+        jobs_num = self.build_accelerator.adjust_jobs_num(cpu_count(), job_memory)
         console.info('Adjust build jobs number(-j N) to be %d' % jobs_num)
         return jobs_num
 
@@ -587,6 +852,38 @@ class Blade(object):
             self.__build_jobs_num = self._build_jobs_num()
         return self.__build_jobs_num
 
+    def _load_peak_rss(self):
+        """Load the peak RSS of the compiles from the build time history, dict{output: bytes}."""
+        if self.__peak_rss is None:
+            self.__peak_rss = {}
+            if (config.get_item('cc_config', 'compile_memory_profiling') and
+                    os.path.isdir(self.__build_dir)):
+                build_times = BuildTimes(self.__build_dir)
+                try:
+                    build_times.load()
+                    self.__peak_rss = build_times.peak_rss()
+                except sqlite3.Error as e:
+                    console.debug('Failed to load the peak RSS of the compiles: %s' % e)
+                finally:
+                    build_times.close()
+        return self.__peak_rss
+
+    def heavy_compile_outputs(self):
+        """The compile outputs which are known to use much memory, dict{output: peak RSS}."""
+        if self.__heavy_compile_outputs is None:
+            threshold = config.get_item('cc_config', 'heavy_compile_memory')
+            self.__heavy_compile_outputs = dict(
+                    (output, peak_rss) for output, peak_rss in self._load_peak_rss().items()
+                    if peak_rss >= threshold)
+        return self.__heavy_compile_outputs
+
+    def heavy_compile_jobs_num(self):
+        """The number of the heavy compiles which can run simultaneously."""
+        heavy_outputs = self.heavy_compile_outputs()
+        if not heavy_outputs:
+            return self.build_jobs_num()
+        return self.build_accelerator.heavy_jobs_num(cpu_count(), max(heavy_outputs.values()))
+
     def test_jobs_num(self):
         """Calculate the number of test jobs"""
         # User has the highest priority
@@ -0,0 +1,233 @@
+# Copyright (c) 2021 Tencent Inc.
+# All rights reserved.
+#
+# Author: chen3feng <chen3feng@gmail.com>
+# Date:   2021-08-21
+
+"""
+The persistent build time history.
+
+The new entries of the `.ninja_log` are ingested after each build, the recent durations and
+the moving average of building each output are kept in a SQLite database in the build dir,
+so the slow outputs and the regressions of their build times can be found across builds.
+
+The peak RSS of the compiles recorded by `peak_rss.py` are also kept, to size the build jobs
+by the memory they use.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import sqlite3
+import time
+from collections import namedtuple
+
+from blade import console
+from blade import ninja_runner
+
+
+_BUILD_TIMES_FILE = '.blade.build.times.db'
+
+# The log of the peak RSS of the compiles, written by `peak_rss.py`
+_PEAK_RSS_LOG_FILE = '.blade.peak.rss.log'
+
+# Increase this number if the schema of the database is changed.
+_VERSION = 2
+
+# Number of the recent durations to be kept for each output
+_MAX_DURATIONS = 20
+
+# The weight of the latest duration in the exponential moving average
+_AVERAGE_WEIGHT = 0.2
+
+# Outputs not built in this period are dropped, such as the removed ones
+_RETENTION_TIME = 90 * 86400
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS outputs (
+    output TEXT PRIMARY KEY,
+    target TEXT,
+    mtime TEXT,
+    build_time REAL,
+    average REAL,
+    durations TEXT,
+    peak_rss INTEGER
+);
+'''
+
+# Statements to upgrade the database from the previous versions, dict{version: script}
+_UPGRADES = {
+    1: '''
+ALTER TABLE outputs ADD COLUMN peak_rss INTEGER;
+''',
+}
+
+# Max number of the variables in a SQL statement
+_MAX_SQL_VARIABLES = 500
+
+
+BuildTimeItem = namedtuple('BuildTimeItem', [
+    'output',
+    'target',  # Key of the target which generates the output, or None if it is unknown
+    'mtime',  # The mtime of the output in the last ingested ninja log entry
+    'build_time',  # When the last entry was ingested
+    'average',  # The moving average of the durations in seconds
+    'durations',  # The recent durations in seconds, the latest is the last
+    'peak_rss',  # The peak RSS in bytes when it was built last time, or None if it is unknown
+])
+
+
+def peak_rss_log(build_dir):
+    """The path of the log file into which the peak RSS of the compiles are written."""
+    return os.path.join(build_dir, _PEAK_RSS_LOG_FILE)
+
+
+class BuildTimes(object):
+    """The build time history stored in the build dir."""
+
+    def __init__(self, build_dir):
+        self.__path = os.path.join(build_dir, _BUILD_TIMES_FILE)
+        self.__peak_rss_log = peak_rss_log(build_dir)
+        self.__db = None
+
+    def load(self):
+        """Open the database, the history will be empty if it is invalid."""
+        try:
+            self.__db = self._open()
+        except sqlite3.Error as e:
+            console.debug('Exception when loading build times: %s' % e)
+            if os.path.exists(self.__path):
+                os.remove(self.__path)
+            self.__db = self._open()
+
+    def _open(self):
+        db = sqlite3.connect(self.__path)
+        version = db.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, _VERSION) and version not in _UPGRADES:
+            db.close()
+            raise sqlite3.DatabaseError('Unknown build times version %s' % version)
+        if version in _UPGRADES:
+            db.executescript(_UPGRADES[version])
+        db.executescript(_SCHEMA)
+        db.execute('PRAGMA user_version = %d' % _VERSION)
+        return db
+
+    def _get_items(self, outputs):
+        """Return the existing items of the outputs, dict{output: BuildTimeItem}."""
+        items = {}
+        outputs = list(outputs)
+        for i in range(0, len(outputs), _MAX_SQL_VARIABLES):
+            batch = outputs[i:i + _MAX_SQL_VARIABLES]
+            rows = self.__db.execute(
+                    'SELECT * FROM outputs WHERE output IN (%s)' % ', '.join('?' * len(batch)),
+                    batch)
+            for row in rows:
+                items[row[0]] = _item_from_row(row)
+        return items
+
+    def ingest(self, ninja_log, targets_of):
+        """Ingest the entries appended to the ninja log since the last ingestion.
+
+        Args:
+            targets_of: function(outputs) -> dict{output: target key}, map the outputs which
+                are not known yet to the targets.
+
+        Returns:
+            list of BuildTimeItem of the outputs which are built since the last ingestion.
+        """
+        row = self.__db.execute("SELECT value FROM meta WHERE name = 'ninja_log'").fetchone()
+        position = json.loads(row[0]) if row else None
+        entries, position, rewritten = ninja_runner.read_ninja_log(ninja_log, position)
+        if rewritten:
+            console.debug('The ninja log is rewritten, skip the ingested entries')
+        items = self._get_items(set(entry.output for entry in entries))
+        unknown_outputs = set(entry.output for entry in entries if entry.output not in items)
+        targets = targets_of(unknown_outputs) if unknown_outputs else {}
+        now = time.time()
+        updated = {}
+        for entry in entries:
+            item = items.get(entry.output)
+            if item is not None and rewritten and entry.mtime == item.mtime:
+                continue  # Ingested before the log was rewritten
+            duration = (entry.end_ms - entry.start_ms) / 1000.0
+            if item is None:
+                item = BuildTimeItem(output=entry.output, target=targets.get(entry.output),
+                                     mtime=entry.mtime, build_time=now, average=duration,
+                                     durations=[duration], peak_rss=None)
+            else:
+                item = item._replace(
+                        mtime=entry.mtime, build_time=now,
+                        average=item.average + (duration - item.average) * _AVERAGE_WEIGHT,
+                        durations=(item.durations + [duration])[-_MAX_DURATIONS:])
+            items[entry.output] = item
+            updated[entry.output] = item
+        with self.__db:
+            for item in updated.values():
+                self.__db.execute(
+                        'INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (item.output, item.target, item.mtime, item.build_time, item.average,
+                         json.dumps(item.durations), item.peak_rss))
+            if position is not None:
+                self.__db.execute("INSERT OR REPLACE INTO meta VALUES ('ninja_log', ?)",
+                                  (json.dumps(position),))
+            self.__db.execute('DELETE FROM outputs WHERE build_time < ?',
+                              (now - _RETENTION_TIME,))
+        console.debug('Ingested %d ninja log entries, %d outputs are updated' % (
+                len(entries), len(updated)))
+        return list(updated.values())
+
+    def ingest_peak_rss(self, keep_max=False):
+        """Ingest the peak RSS log written during the build, and truncate it.
+
+        It should be called after `ingest`, the outputs which are not in the history are ignored.
+
+        Args:
+            keep_max: bool, keep the larger one of the new and the existing peak RSS, such as
+                when the compiles may be cache hits.
+
+        Returns:
+            int, the number of the ingested records.
+        """
+        try:
+            with open(self.__peak_rss_log) as f:
+                lines = f.readlines()
+        except (IOError, OSError):
+            return 0
+        records = []
+        for line in lines:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) == 2 and fields[1].isdigit():  # Skip the truncated lines
+                records.append((int(fields[1]), fields[0]))
+        with self.__db:
+            if keep_max:
+                self.__db.executemany(
+                        'UPDATE outputs SET peak_rss = MAX(?, IFNULL(peak_rss, 0)) WHERE output = ?',
+                        records)
+            else:
+                self.__db.executemany('UPDATE outputs SET peak_rss = ? WHERE output = ?', records)
+        open(self.__peak_rss_log, 'w').close()
+        console.debug('Ingested %d peak RSS records' % len(records))
+        return len(records)
+
+    def peak_rss(self):
+        """Return the known peak RSS of the outputs, dict{output: bytes}."""
+        return dict(self.__db.execute(
+                'SELECT output, peak_rss FROM outputs WHERE peak_rss IS NOT NULL'))
+
+    def items(self):
+        """Return all items in the history."""
+        return [_item_from_row(row) for row in self.__db.execute('SELECT * FROM outputs')]
+
+    def close(self):
+        if self.__db:
+            self.__db.close()
+            self.__db = None
+
+
+def _item_from_row(row):
+    return BuildTimeItem(output=row[0], target=row[1], mtime=row[2], build_time=row[3],
+                         average=row[4], durations=json.loads(row[5]), peak_rss=row[6])
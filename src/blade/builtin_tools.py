@@ -591,11 +591,11 @@ _BUILTIN_TOOLS = {
 }
 
 
-def main():
-    name = sys.argv[1]
+def run_tool(name, argv):
+    """Run the builtin tool with the command line arguments, return the exit code."""
     exit_code = 0
     try:
-        options, args = util.parse_command_line(sys.argv[2:])
+        options, args = util.parse_command_line(argv)
         exit_code = _BUILTIN_TOOLS[name](args=args, **options)
         if not exit_code:
             _verify_outputs()
@@ -605,7 +605,11 @@ def main():
     finally:
         if exit_code:
             _cleanup_outputs()
-        sys.exit(exit_code or 0)
+    return exit_code or 0
+
+
+def main():
+    sys.exit(run_tool(sys.argv[1], sys.argv[2:]))
 
 
 if __name__ == '__main__':
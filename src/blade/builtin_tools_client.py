@@ -0,0 +1,94 @@
+# Copyright (c) 2021 Tencent Inc.
+# All rights reserved.
+#
+# Author: chen3feng <chen3feng@gmail.com>
+# Date:   2021-06-26
+
+"""
+The client of the builtin tools worker.
+
+It is called in the ninja command lines to send the builtin tool request to the worker
+started by blade, and runs the tool in process if the worker is unavailable.
+
+To reduce the startup time, it only imports the necessary standard modules and can
+be run as a standalone script without importing the `blade` package.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import json
+import os
+import socket
+import sys
+
+
+def _request(socket_path, tool, argv):
+    """Send the request to the worker.
+
+    Returns:
+        (exit_code, output), or None if the worker is unavailable.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except (IOError, OSError):
+        sock.close()
+        return None
+    # Once the request is sent, the tool may have been run by the worker, it must not be run
+    # again in process, which may overwrite the outputs of a partially finished run.
+    try:
+        request = {
+            'cwd': os.getcwd(),
+            'env': dict(os.environ),
+            'tool': tool,
+            'argv': argv,
+        }
+        sock.sendall(json.dumps(request).encode('utf-8'))
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    except (IOError, OSError) as e:
+        return 1, ('Failed to communicate with the builtin tools worker: %s\n' % e).encode('utf-8')
+    finally:
+        sock.close()
+    response = b''.join(chunks)
+    # The response is the exit code line followed by the output of the tool
+    pos = response.find(b'\n')
+    if pos == -1:
+        return 1, b'The builtin tools worker exited without response\n'
+    return int(response[:pos]), response[pos + 1:]
+
+
+def _run_in_process(tool, argv):
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    # When run as a script, the dir of it is the first one in `sys.path`, it must be removed
+    # to avoid the modules in it overriding the standard ones, such as `pathlib`.
+    if sys.path and os.path.abspath(sys.path[0] or '.') == module_dir:
+        del sys.path[0]
+    blade_path = os.path.dirname(module_dir)
+    if blade_path not in sys.path:
+        sys.path.insert(0, blade_path)
+    from blade import builtin_tools  # pylint: disable=import-outside-toplevel
+    return builtin_tools.run_tool(tool, argv)
+
+
+def main():
+    socket_path, tool, argv = sys.argv[1], sys.argv[2], sys.argv[3:]
+    result = _request(socket_path, tool, argv)
+    if result is None:
+        sys.exit(_run_in_process(tool, argv))
+    exit_code, output = result
+    if output:
+        out = getattr(sys.stdout, 'buffer', sys.stdout)
+        out.write(output)
+        out.flush()
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+# Copyright (c) 2021 Tencent Inc.
+# All rights reserved.
+#
+# Author: chen3feng <chen3feng@gmail.com>
+# Date:   2021-06-26
+
+"""
+The builtin tools worker.
+
+Running each builtin tool action in a new python process pays the interpreter startup and
+the modules importing every time. During the build, blade starts a worker process which
+imports the builtin tools once, and forks a child process to run each request from the
+`builtin_tools_client` in the ninja command lines.
+
+Forking keeps each action isolated as before, such as the current dir, the environment
+variables and the global states of the tools.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+from blade import console
+
+
+# Path of the socket in the build dir
+_SOCKET_FILE = '.builtin_tools.sock'
+
+
+def socket_path(build_dir):
+    return os.path.join(build_dir, _SOCKET_FILE)
+
+
+def _recv_all(conn):
+    chunks = []
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def _handle_request(conn, request, stats_fd):
+    """Run the tool in the forked child process and send the result to the client."""
+    # pylint: disable=import-outside-toplevel
+    from blade import builtin_tools
+    start_time = time.time()
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+    # Collect the output of the tool, both stdout and stderr, as what ninja does.
+    output = tempfile.TemporaryFile()
+    os.dup2(output.fileno(), 1)
+    os.dup2(output.fileno(), 2)
+    exit_code = builtin_tools.run_tool(request['tool'], request['argv'])
+    sys.stdout.flush()
+    sys.stderr.flush()
+    # Less than PIPE_BUF, so it is written atomically.
+    # Write it before responding, to be received before the worker is stopped.
+    os.write(stats_fd, ('%s %f\n' % (request['tool'], time.time() - start_time)).encode('utf-8'))
+    output.seek(0)
+    conn.sendall(b'%d\n' % exit_code + output.read())
+
+
+def _send_error(conn, request, error):
+    """Respond the failure of the forked child, so the client doesn't wait or run it again."""
+    message = 'Builtin tools worker failed to run %s: %s\n%s' % (
+            request.get('tool'), error, traceback.format_exc())
+    try:
+        conn.sendall(b'1\n' + message.encode('utf-8'))
+    except (IOError, OSError):
+        pass  # The client exited
+
+
+def _serve_forever(sock, stats_r, stats_w, parent_pid):
+    """Main loop of the worker, return the stats when it is stopped."""
+    stats = {}  # {tool: [count, total_time, max_time]}
+    pending = b''
+    while True:
+        readable = select.select([sock, stats_r], [], [], 1.0)[0]
+        if stats_r in readable:
+            pending += os.read(stats_r, 65536)
+            lines = pending.split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                tool, cost_time = line.decode('utf-8').split()
+                stat = stats.setdefault(tool, [0, 0.0, 0.0])
+                stat[0] += 1
+                stat[1] += float(cost_time)
+                stat[2] = max(stat[2], float(cost_time))
+        if os.getppid() != parent_pid:
+            # The blade exited abnormally
+            return None
+        if sock not in readable:
+            continue
+        conn = sock.accept()[0]
+        request = json.loads(_recv_all(conn).decode('utf-8'))
+        if request.get('command') == 'stop':
+            conn.sendall(json.dumps(stats).encode('utf-8'))
+            conn.close()
+            return stats
+        pid = os.fork()
+        if pid == 0:
+            try:
+                # The tools may run and wait for their own subprocesses
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                sock.close()
+                os.close(stats_r)
+                _handle_request(conn, request, stats_w)
+            except BaseException as e:  # pylint: disable=broad-except
+                _send_error(conn, request, e)
+            finally:
+                os._exit(0)
+        conn.close()
+
+
+def _main():
+    """Entry of the worker process."""
+    # pylint: disable=import-outside-toplevel,unused-import,unused-variable
+    # Import the tools and their heavy dependencies before forking.
+    from blade import builtin_tools, inclusion_check
+    path = sys.argv[1]
+    parent_pid = os.getppid()
+    if os.path.exists(path):
+        os.remove(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+    try:
+        sock.bind(path)
+    finally:
+        os.umask(old_umask)
+    sock.listen(128)
+    # Reap the children automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    stats_r, stats_w = os.pipe()
+    try:
+        _serve_forever(sock, stats_r, stats_w, parent_pid)
+    finally:
+        sock.close()
+        os.remove(path)
+
+
+class BuiltinToolsWorker(object):
+    """Manage the builtin tools worker process in blade."""
+
+    def __init__(self, blade_path, build_dir):
+        self.__blade_path = blade_path
+        self.__socket_path = socket_path(build_dir)
+        self.__process = None
+
+    def start(self):
+        """Start the worker process in background.
+
+        It doesn't wait for the worker to be ready, the early requests before it are run
+        in process by the client.
+        """
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [self.__blade_path, env.get('PYTHONPATH')]))
+        devnull = open(os.devnull, 'w')
+        try:
+            self.__process = subprocess.Popen(
+                    [sys.executable, '-m', 'blade.builtin_tools_server', self.__socket_path],
+                    env=env, stdout=devnull, stderr=devnull, close_fds=True)
+        except OSError as e:
+            console.debug('Failed to start the builtin tools worker: %s' % e)
+        finally:
+            devnull.close()
+
+    def stop(self):
+        """Stop the worker process and return the stats of the requests."""
+        if not self.__process:
+            return None
+        stats = None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.__socket_path)
+            sock.sendall(json.dumps({'command': 'stop'}).encode('utf-8'))
+            sock.shutdown(socket.SHUT_WR)
+            stats = json.loads(_recv_all(sock).decode('utf-8'))
+        except (IOError, OSError, ValueError) as e:
+            console.debug('Failed to stop the builtin tools worker: %s' % e)
+            self.__process.kill()
+        finally:
+            sock.close()
+        self.__process.wait()
+        self.__process = None
+        return stats
+
+
+def report_stats(stats):
+    """Report the stats of the requests to the builtin tools worker."""
+    if not stats:
+        return
+    console.info('Builtin tools requests:')
+    for tool, (count, total_time, max_time) in sorted(stats.items()):
+        console.info('  %-20s %6d requests, avg %.1fms, max %.1fms' % (
+            tool, count, total_time * 1000 / count, max_time * 1000), prefix=False)
+
+
+if __name__ == '__main__':
+    _main()
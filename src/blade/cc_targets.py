@@ -529,6 +529,19 @@ class CcTarget(Target):
 
         return list(result)
 
+    def _heavy_objects(self):
+        """The objects of this target whose compiles are known to use much memory."""
+        objs_dir = self._target_file_path(self.name + '.objs') + os.sep
+        return sorted(obj for obj in self.blade.heavy_compile_outputs() if obj.startswith(objs_dir))
+
+    def _fingerprint_entropy(self):
+        entropy = super(CcTarget, self)._fingerprint_entropy()
+        heavy_objs = self._heavy_objects()
+        if heavy_objs:
+            # The pool of the compiles is changed
+            entropy = dict(entropy, heavy_objs=heavy_objs)
+        return entropy
+
     def _cc_objects(self, expanded_srcs, generated_headers=None):
         """Generate cc objects build rules in ninja."""
         vars = self._get_cc_vars()
@@ -546,6 +559,7 @@ class CcTarget(Target):
             implicit_deps.append(self._source_file_path(self.attr['secret_revision_file']))
 
         objs_dir = self._target_file_path(self.name + '.objs')
+        heavy_objs = set(self._heavy_objects())
         objs = []
         for src, full_src in expanded_srcs:
             # secret source is not really exist and is not target of any build, declare it as phony
@@ -554,10 +568,13 @@ class CcTarget(Target):
                 self.generate_build('phony', full_src, inputs=[], clean=[])
             obj = os.path.join(objs_dir, src + '.o')
             rule = self._get_rule_from_suffix(src, secret)
+            obj_vars = vars
+            if obj in heavy_objs:
+                obj_vars = dict(vars, pool='heavy_cc_pool')
             self.generate_build(rule, obj, inputs=full_src,
                                 implicit_deps=implicit_deps,
                                 order_only_deps=order_only_deps,
-                                variables=vars, clean=[])
+                                variables=obj_vars, clean=[])
             objs.append(obj)
         self._remove_on_clean(objs_dir)
 
@@ -1376,7 +1393,8 @@ class CcBinary(CcTarget):
                       implicit_deps=implicit_deps,
                       order_only_deps=order_only_deps)
         self._add_default_target_file('bin', output)
-        self._remove_on_clean(self._target_file_path(self.name + '.runfiles'))
+        self._remove_on_clean(self._target_file_path(self.name + '.runfiles'),
+                              self._target_file_path(self.name + '.runfiles.manifest'))
 
     def _before_generate(self):  # override
         """Override"""
@@ -1601,6 +1619,9 @@ class CcTest(CcBinary):
             optimize,
             dynamic_link,
             testdata,
+            cpu,
+            memory,
+            flaky,
             linkflags,
             extra_cppflags,
             extra_linkflags,
@@ -1609,6 +1630,7 @@ class CcTest(CcBinary):
             exclusive,
             heap_check,
             heap_check_debug,
+            shard_count,
             kwargs):
         """Init method."""
         # pylint: disable=too-many-locals
@@ -1640,6 +1662,9 @@ class CcTest(CcBinary):
         self.attr['always_run'] = always_run
         self.attr['exclusive'] = exclusive
         self._add_tags('lang:cc', 'type:test')
+        self._set_test_resources(cpu, memory)
+        self.attr['flaky'] = flaky
+        self._set_shard_count(shard_count)
 
         gtest_lib = var_to_list(cc_test_config['gtest_libs'])
         gtest_main_lib = var_to_list(cc_test_config['gtest_main_libs'])
@@ -1667,6 +1692,15 @@ class CcTest(CcBinary):
 
             self._add_implicit_library(perftools_lib_list)
 
+    def _set_shard_count(self, shard_count):
+        """Set the number of gtest shards to run the test in parallel."""
+        if shard_count is None or shard_count == 1:
+            return
+        if shard_count != 'auto' and (not isinstance(shard_count, int) or shard_count < 1):
+            self.error('shard_count can only be a positive integer or "auto"')
+            return
+        self.attr['shard_count'] = shard_count
+
 
 def cc_test(name=None,
             srcs=[],
@@ -1680,6 +1714,9 @@ def cc_test(name=None,
             optimize=None,
             dynamic_link=None,
             testdata=[],
+            cpu=1,
+            memory=None,
+            flaky=False,
             linkflags=None,
             extra_cppflags=[],
             extra_linkflags=[],
@@ -1688,6 +1725,7 @@ def cc_test(name=None,
             exclusive=False,
             heap_check=None,
             heap_check_debug=False,
+            shard_count=None,
             **kwargs):
     """cc_test target."""
     # pylint: disable=too-many-locals
@@ -1704,6 +1742,9 @@ def cc_test(name=None,
             optimize=optimize,
             dynamic_link=dynamic_link,
             testdata=testdata,
+            cpu=cpu,
+            memory=memory,
+            flaky=flaky,
             linkflags=linkflags,
             extra_cppflags=extra_cppflags,
             extra_linkflags=extra_linkflags,
@@ -1712,6 +1753,7 @@ def cc_test(name=None,
             exclusive=exclusive,
             heap_check=heap_check,
             heap_check_debug=heap_check_debug,
+            shard_count=shard_count,
             kwargs=kwargs)
     build_manager.instance.register_target(cc_test_target)
 
@@ -82,6 +82,7 @@ class CommandLineParser(object):
             'dump': self._check_dump_command,
             'query': self._check_query_command,
             'run': self._check_run_command,
+            'server': self._check_server_command,
             'test': self._check_test_command,
         }
         actions[command](options, targets)
@@ -149,6 +150,11 @@ class CommandLineParser(object):
         """check clean options."""
         self._check_clean_options(options, targets)
 
+    def _check_server_command(self, options, targets):
+        """check server options."""
+        if targets:
+            console.fatal('The server command does not accept any target')
+
     def _check_query_command(self, options, targets):
         """check query options."""
         self._check_plat_and_profile_options(options, targets)
@@ -246,7 +252,8 @@ class CommandLineParser(object):
 
         parser.add_argument(
             '--show-builds-slower-than', dest='show_builds_slower_than', metavar='SECONDS', type=float,
-            help='Show build commands which are slower than specified seconds')
+            help='Show build commands which are slower than specified seconds, '
+                 'and their average build times before')
 
     def __add_coverage_arguments(self, parser):
         """Add coverage arguments."""
@@ -339,10 +346,23 @@ class CommandLineParser(object):
             '--exclude-tests', dest='exclude_tests', default='', metavar='TARGET_LIST',
             help='Exclude tests which matches this comma seperated target pattern list')
 
+        parser.add_argument(
+            '--changed-files', dest='changed_files', default='', metavar='FILE_LIST',
+            help='Only run the tests affected by these comma separated changed files')
+
+        parser.add_argument(
+            '--changed-since', dest='changed_since', default='', metavar='REVISION',
+            help='Only run the tests affected by the files changed since this git revision')
+
         parser.add_argument(
             '--run-unrepaired-tests', dest='run_unrepaired_tests', action='store_true',
             help=constants.HELP.run_unrepaired_tests)
 
+        parser.add_argument(
+            '--retry-failed', dest='retry_failed', type=int, default=0, metavar='N',
+            help='Run the failed tests again at most N times in the same run, '
+                 'the tests passed after retrying are reported as flaky')
+
     def _add_run_arguments(self, parser):
         """Add run command arguments."""
 
@@ -355,11 +375,23 @@ class CommandLineParser(object):
             self.__add_coverage_arguments(parser)
             self.__add_pgo_arguments(parser)
 
+    def _add_critical_path_arguments(self, *parsers):
+        """Add the critical path argument, the dump command has its own one."""
+        for parser in parsers:
+            parser.add_argument(
+                '--critical-path', dest='critical_path', action='store_true', default=False,
+                help='Show the critical path of the build, the longest chain of the dependent '
+                     'actions, and the achieved parallelism')
+
     def _add_common_arguments(self, *parsers):
         for parser in parsers:
             parser.add_argument(
                 '--profiling', dest='profiling', action='store_true',
                 help='Blade performance profiling, for blade developing')
+            parser.add_argument(
+                '--trace', dest='trace', type=str, default='', metavar='FILE',
+                help='Write a Chrome trace event file of the blade phases, the build actions '
+                     'and the tests, which can be viewed in chrome://tracing or Perfetto')
             parser.add_argument(
                 '--stop-after', dest='stop_after', type=str,
                 choices=['load', 'analyze', 'generate', 'build', 'all'], default='all',
@@ -381,6 +413,9 @@ class CommandLineParser(object):
             parser.add_argument(
                 '--quiet', dest='verbosity', action='store_const', const='quiet',
                 help='Only show warnings and errors')
+            parser.add_argument(
+                '--load-jobs', dest='load_jobs', type=int,
+                help=constants.HELP.load_jobs)
             parser.add_argument(
                 '--exclude-targets', dest='exclude_targets', type=str, default='',
                 help='Comma separated target patterns to be excluded from loading')
@@ -395,6 +430,19 @@ class CommandLineParser(object):
                 '--tags-filter', dest='tags_filter', type=str,
                 help='Tags filter expression, see documents for details')
 
+    def _add_server_arguments(self, parser):
+        """Add server arguments for parser."""
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument(
+            '--stop', dest='server_action', action='store_const', const='stop', default='start',
+            help='Stop the running server')
+        group.add_argument(
+            '--status', dest='server_action', action='store_const', const='status',
+            help='Show the status of the server')
+        parser.add_argument(
+            '--foreground', dest='foreground', action='store_true', default=False,
+            help='Run the server in the foreground rather than as a daemon')
+
     def _add_dump_arguments(self, parser):
         """Add dump arguments for parser."""
         parser.add_argument(
@@ -414,6 +462,12 @@ class CommandLineParser(object):
         group.add_argument(
             '--all-tags', dest='dump_all_tags', default=False, action='store_true',
             help='Dump all tags of targets in json format')
+        group.add_argument(
+            '--build-times', dest='dump_build_times', default=False, action='store_true',
+            help='Dump the build time history of the outputs of targets in json format')
+        group.add_argument(
+            '--critical-path', dest='dump_critical_path', default=False, action='store_true',
+            help='Dump the critical path of the last build in json format')
     def _build_arg_parser(self):
         """Add command options, add options whthin this method."""
         blade_cmd_help = 'blade <subcommand> [options...] [targets...]'
@@ -449,14 +503,20 @@ class CommandLineParser(object):
             'dump',
             help='Dump specified internal information')
 
+        server_parser = sub_parser.add_parser(
+            'server',
+            help='Start the resident server which keeps the loaded targets between commands')
+
         self._add_common_arguments(build_parser, run_parser, test_parser,
-                                   clean_parser, query_parser, dump_parser)
+                                   clean_parser, query_parser, dump_parser, server_parser)
         self._add_build_arguments(build_parser, run_parser, test_parser, dump_parser)
+        self._add_critical_path_arguments(build_parser, run_parser, test_parser)
         self._add_run_arguments(run_parser)
         self._add_test_arguments(test_parser)
         self._add_clean_arguments(clean_parser)
         self._add_query_arguments(query_parser)
         self._add_dump_arguments(dump_parser)
+        self._add_server_arguments(server_parser)
 
         return arg_parser
 
@@ -23,6 +23,7 @@ from blade import build_attributes
 from blade import console
 from blade import constants
 from blade.util import var_to_list, iteritems, eval_file, exec_file_content, source_location
+from blade.util import parse_memory_size
 
 
 _MAVEN_SNAPSHOT_UPDATE_POLICY_VALUES = ['always', 'daily', 'interval', 'never']
@@ -42,6 +43,8 @@ class BladeConfig(object):
     def __init__(self):
         self.current_file_name = ''  # For error reporting
         self.__md5 = hashlib.md5()
+        # All files tried to be loaded, include the nonexistent ones
+        self.input_files = []
 
         # Support generate comments when dump the config by the special '__help__' convention.
         # __help__ field is for section
@@ -64,8 +67,15 @@ class BladeConfig(object):
                 'build_jobs__help__': constants.HELP.build_jobs,
                 'test_jobs': 0,
                 'test_jobs__help__': 'The number of test jobs to run simultaneously',
+                'load_jobs': 0,
+                'load_jobs__help__': constants.HELP.load_jobs,
                 'run_unrepaired_tests': False,
                 'run_unrepaired_tests__help__': constants.HELP.run_unrepaired_tests,
+                'flaky_test_retries': 2,
+                'flaky_test_retries__help__': 'Max times to run the failed flaky tests again in the same run',
+                'test_result_cache_dir': '~/.cache/blade/test_results',
+                'test_result_cache_dir__help__':
+                    'Dir of the local test result cache shared by all workspaces, empty to disable it',
                 'glob_error_severity': 'error',
                 'glob_error_severity__help__': 'The severity of glob error, can be %s' % constants.SEVERITIES,
                 'default_visibility': set(),
@@ -77,6 +87,16 @@ class BladeConfig(object):
                 'restricted_dsl__help__': 'Whether use the restricted SDL in BUILD languages',
                 'unrestricted_dsl_dirs': set(),
                 'unrestricted_dsl_dirs__help__': 'Dirs in which allow unrestrict python DSL',
+                'build_file_cache': True,
+                'build_file_cache__help__': 'Whether cache the evaluation results of the unchanged BUILD files',
+                'builtin_tools_worker': True,
+                'builtin_tools_worker__help__':
+                    'Whether run the builtin build tools in a worker process started by blade, '
+                    'to avoid starting a new python process for each of them',
+                'deps_expansion': 'lazy',
+                'deps_expansion__help__':
+                    "Can be 'lazy' or 'eager'. 'lazy' expands the transitive deps of a target only "
+                    "when they are used, which takes much less memory for large dependency graphs",
 
             },
 
@@ -107,6 +127,20 @@ class BladeConfig(object):
                 'hdr_dep_missing_suppress__help__': 'Header deps missing suppress control, see docs for details',
                 'allowed_undeclared_hdrs': set(),
                 'allowed_undeclared_hdrs__help__': 'Allowed undeclared header files',
+                'compile_memory_profiling': False,
+                'compile_memory_profiling__help__': 'Record the peak RSS of each compile, to size '
+                    'the build jobs and throttle the memory heavy compiles in later builds',
+                'heavy_compile_memory': 2 << 30,
+                'heavy_compile_memory__help__': 'The compiles whose peak RSS are not less than '
+                    'this size, such as "4G", are run in the "heavy_cc_pool"',
+                'ccache': False,
+                'ccache__help__': 'Compile with ccache',
+                'ccache_dir': '',
+                'ccache_dir__help__': 'The cache dir of ccache, it is created to be shared by '
+                    'the users if it does not exist, empty means the default of ccache',
+                'ccache_max_size': '',
+                'ccache_max_size__help__': 'The max size of the ccache cache dir, such as "20G", '
+                    'empty means unchanged',
             },
 
             'cc_library_config': {
@@ -137,6 +171,9 @@ class BladeConfig(object):
                 'gtest_libs': [],
                 'gtest_main_libs': [],
                 'pprof_path': '',
+                'auto_shard_time': 60,
+                'auto_shard_time__help__':
+                    'Expected running time in seconds of each shard of the cc_test with shard_count="auto"',
             },
 
             'link_config': {
@@ -283,6 +320,7 @@ class BladeConfig(object):
         """load the configuration file and parse."""
         try:
             self.current_file_name = filename
+            self.input_files.append(filename)
             if os.path.exists(filename):
                 console.info('Loading config file "%s"' % filename)
                 with open(filename, 'rb') as f:
@@ -434,6 +472,11 @@ def load_files(blade_root_dir, load_local_config):
         _blade_config.try_parse_file(os.path.join(blade_root_dir, 'BLADE_ROOT.local'))
 
 
+def input_files():
+    """All files which may affect the config, include the nonexistent ones"""
+    return _blade_config.input_files
+
+
 def digest():
     """Hex md5 digest of all loaded config files"""
     # Used in fingerprint entropy
@@ -480,11 +523,13 @@ def _check_default_visibility(kwargs):
 
 
 _DUPLICATED_SOURCE_ACTION_VALUES = {'warning', 'error', 'none', None}
+_DEPS_EXPANSION_VALUES = {'lazy', 'eager'}
 
 
 @config_rule
 def load_value(filepath):
     """Safely evaluate containing literal from file."""
+    _blade_config.input_files.append(filepath)
     return eval_file(filepath)
 
 
@@ -500,6 +545,7 @@ def config_items(**kwargs):
 def global_config(append=None, **kwargs):
     """global_config section."""
     _check_kwarg_enum_value(kwargs, 'duplicated_source_action', _DUPLICATED_SOURCE_ACTION_VALUES)
+    _check_kwarg_enum_value(kwargs, 'deps_expansion', _DEPS_EXPANSION_VALUES)
     debug_info_levels = _blade_config.get_section('cc_config')['debug_info_levels'].keys()
     _check_kwarg_enum_value(kwargs, 'debug_info_level', debug_info_levels)
     _check_test_related_envs(kwargs)
@@ -535,6 +581,15 @@ def cc_config(append=None, **kwargs):
         if isinstance(extra_incs, str) and ' ' in extra_incs:
             _blade_config.warning('"cc_config.extra_incs" has been changed to list')
             kwargs['extra_incs'] = extra_incs.split()
+    if 'heavy_compile_memory' in kwargs:
+        size = parse_memory_size(kwargs['heavy_compile_memory'])
+        if size is None:
+            _blade_config.error('Invalid "heavy_compile_memory" value "%s", it should be an integer '
+                                'in bytes or a string with a "K", "M", "G" or "T" suffix' %
+                                kwargs['heavy_compile_memory'])
+            del kwargs['heavy_compile_memory']
+        else:
+            kwargs['heavy_compile_memory'] = size
     _blade_config.update_config('cc_config', append, kwargs)
 
 
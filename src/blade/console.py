@@ -25,9 +25,13 @@ import time
 ##############################################################################
 
 
+def auto_color_enabled():
+    """Whether the color should be enabled in the auto mode"""
+    return sys.stdout.isatty() and os.environ.get('TERM') not in ('emacs', 'dumb')
+
+
 # Global color enabled or not
-_color_enabled = (sys.stdout.isatty() and
-                  os.environ.get('TERM') not in ('emacs', 'dumb'))
+_color_enabled = auto_color_enabled()
 
 # See http://en.wikipedia.org/wiki/ANSI_escape_code
 # colors
@@ -93,8 +97,28 @@ def get_log_file():
     return _log.name
 
 
+# Whether all outputs are muted, and the number of muted messages
+_muted = False
+_muted_count = 0
+
+
+def mute():
+    """Mute all outputs, used in the worker processes whose results are reported by the main process."""
+    global _muted
+    _muted = True
+
+
+def muted_count():
+    """Return the number of muted messages"""
+    return _muted_count
+
+
 def log(msg):
     """Dump message into log file."""
+    if _muted:
+        global _muted_count
+        _muted_count += 1
+        return
     if _log:
         timestamp = datetime.datetime.now().strftime('%F %T.%f')
         print(timestamp, msg, file=_log)
@@ -170,6 +194,11 @@ def _need_refresh_pgogress_bar(progress, current, now):
             _last_progress_value != current)
 
 
+def progress_refresh_interval():
+    """The min interval in seconds between the refreshes of the progress bar."""
+    return _PROGRESS_REFRESH_INTERVAL
+
+
 def show_progress_bar(current, total):
     global _need_clear_line, _last_progress_value, _last_progress_time
     progress = current * 100 // total
@@ -201,6 +230,8 @@ def clear_progress_bar():
 
 
 def _do_print(msg, file=sys.stdout):
+    if _muted:
+        return
     clear_progress_bar()
     print(msg, file=file)
 
@@ -218,6 +249,7 @@ def output(msg):
 
 # Global Error Counter
 _error_count = 0
+_warning_count = 0
 
 
 def error_count():
@@ -225,6 +257,11 @@ def error_count():
     return _error_count
 
 
+def warning_count():
+    """Return warning log count"""
+    return _warning_count
+
+
 def error(msg, prefix=True):
     """dump error message."""
     if prefix:
@@ -248,6 +285,8 @@ def warning(msg, prefix=True):
     log(msg)
     msg = colored(msg, 'yellow')
     _do_print(msg, file=sys.stderr)
+    global _warning_count
+    _warning_count += 1
 
 
 def notice(msg, prefix=True):
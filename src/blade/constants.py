@@ -21,6 +21,7 @@ ALL_COMMAND_TARGETS = '__all_command_targets__'
 class HELP(object):
     build_jobs = 'Specifies the number of build jobs (commands) to run simultaneously'
     test_jobs = 'The number of tests to run simultaneously'
+    load_jobs = 'The number of processes to load BUILD files in parallel, 0 means decided by blade, 1 means serial'
     run_unrepaired_tests = 'Whether run unrepaired(no changw after previous failure) tests during incremental test'
     jar_compression_level = 'Jar compress level. Due to the limitation of the jar command, only 0 (no compression) or empty (default) are allowed'
     fat_jar_compression_level = 'Fat jar compress level, must between 0 (store only) and 9 (max but slow)'
@@ -0,0 +1,228 @@
+# Copyright (c) 2021 Tencent Inc.
+# All rights reserved.
+#
+# Author: chen3feng <chen3feng@gmail.com>
+# Date:   2021-08-28
+
+"""
+Critical path analysis of the build.
+
+The actions executed in a build are read from the `.ninja_log`, and their dependencies are read
+from the generated ninja files. The longest chain of the dependent actions, weighted by their
+durations, is the critical path, which bounds the wall time of the build no matter how many
+jobs are used.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+from blade import console
+
+
+def _unescape_ninja_path(token):
+    return token.replace('$ ', ' ').replace('$:', ':').replace('$$', '$')
+
+
+def _split_ninja_paths(text):
+    """Split the space separated paths, the escaped spaces (`$ `) are kept."""
+    paths = []
+    current = ''
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == '$' and i + 1 < len(text):
+            current += text[i:i + 2]
+            i += 2
+            continue
+        if c == ' ':
+            if current:
+                paths.append(_unescape_ninja_path(current))
+            current = ''
+        else:
+            current += c
+        i += 1
+    if current:
+        paths.append(_unescape_ninja_path(current))
+    return paths
+
+
+def _find_unescaped(text, char):
+    """Find the first char which is not escaped by `$`."""
+    i = 0
+    while i < len(text):
+        if text[i] == '$':
+            i += 2
+            continue
+        if text[i] == char:
+            return i
+        i += 1
+    return -1
+
+
+def _read_ninja_lines(path):
+    """Read the lines of the ninja file, with the continued lines (end with `$`) joined."""
+    with open(path) as f:
+        continued = ''
+        for line in f:
+            line = line.rstrip('\r\n')
+            if line.endswith('$') and not line.endswith('$$'):
+                continued += line[:-1]
+                continue
+            yield continued + line
+            continued = ''
+        if continued:
+            yield continued
+
+
+def parse_ninja_graph(build_script):
+    """Parse the build statements in the ninja file and the files included by it.
+
+    Returns:
+        dict{output: (rule, inputs)}, the inputs include the implicit and order-only ones.
+    """
+    graph = {}
+    pending = [build_script]
+    while pending:
+        path = pending.pop()
+        if not os.path.isfile(path):
+            continue
+        for line in _read_ninja_lines(path):
+            if line.startswith('build '):
+                colon = _find_unescaped(line, ':')
+                if colon < 0:
+                    continue
+                outputs = [o for o in _split_ninja_paths(line[len('build '):colon]) if o != '|']
+                rest = _split_ninja_paths(line[colon + 1:])
+                if not rest:
+                    continue
+                inputs = [i for i in rest[1:] if i not in ('|', '||')]
+                for output in outputs:
+                    graph[output] = (rest[0], inputs)
+            elif line.startswith('include ') or line.startswith('subninja '):
+                pending.append(_unescape_ninja_path(line.split(' ', 1)[1].strip()))
+    return graph
+
+
+def _group_actions(entries):
+    """Group the ninja log entries of the same action, which has multiple outputs.
+
+    Returns:
+        list of (start_ms, end_ms, outputs), sorted by the start time.
+    """
+    actions = {}
+    for entry in entries:
+        actions.setdefault((entry.start_ms, entry.end_ms, entry.cmdhash), []).append(entry.output)
+    return sorted((start, end, outputs) for (start, end, _), outputs in actions.items())
+
+
+def analyze(entries, graph, jobs_num, targets_of):
+    """Find the critical path of the executed actions.
+
+    Args:
+        entries: list of ninja_runner.NinjaLogEntry of the build.
+        graph: the result of `parse_ninja_graph`.
+        jobs_num: int, the number of the build jobs.
+        targets_of: function(outputs) -> dict{output: target key}.
+
+    Returns:
+        dict, see the `steps` for the steps on the critical path.
+    """
+    actions = _group_actions(entries)
+    producers = {}  # dict{output: index of the executed action}
+    for index, (_, _, outputs) in enumerate(actions):
+        for output in outputs:
+            producers[output] = index
+
+    phony_deps = {}  # Cache of the executed actions which the phony outputs depend on
+
+    def executed_deps(path):
+        """Return the indexes of the executed actions which generate the path."""
+        if path in producers:
+            return set([producers[path]])
+        node = graph.get(path)
+        if node is None or node[0] != 'phony':
+            # Source files, or outputs which are up to date
+            return set()
+        if path not in phony_deps:
+            phony_deps[path] = set()  # Avoid endless recursion
+            result = set()
+            for input_path in node[1]:
+                result.update(executed_deps(input_path))
+            phony_deps[path] = result
+        return phony_deps[path]
+
+    # The dependent actions always start after their deps end, so the actions sorted by the
+    # start time are in topological order.
+    longest = []  # The (length, previous action) of the longest path ending at each action
+    for start, end, outputs in actions:
+        deps = set()
+        for output in outputs:
+            for input_path in graph.get(output, (None, []))[1]:
+                deps.update(executed_deps(input_path))
+        best = None  # The (length, index) of the longest path of the deps
+        for dep in deps:
+            if dep < len(longest) and (best is None or longest[dep][0] > best[0]):
+                best = (longest[dep][0], dep)
+        duration = end - start
+        if best is None:
+            longest.append((duration, None))
+        else:
+            longest.append((best[0] + duration, best[1]))
+
+    result = {
+        'actions': len(actions),
+        'jobs': jobs_num,
+        'wall_time': 0.0,
+        'total_time': 0.0,
+        'parallelism': 0.0,
+        'length': 0.0,
+        'steps': [],
+    }
+    if not actions:
+        return result
+    wall_time = (max(end for _, end, _ in actions) - min(start for start, _, _ in actions)) / 1000.0
+    total_time = sum(end - start for start, end, _ in actions) / 1000.0
+    result.update({
+        'wall_time': wall_time,
+        'total_time': total_time,
+        'parallelism': total_time / wall_time if wall_time else 0.0,
+    })
+
+    last = max(range(len(actions)), key=lambda index: longest[index][0])
+    result['length'] = longest[last][0] / 1000.0
+    path = []
+    index = last
+    while index is not None:
+        path.append(index)
+        index = longest[index][1]
+    path.reverse()
+    targets = targets_of(set(actions[index][2][0] for index in path))
+    for index in path:
+        start, end, outputs = actions[index]
+        result['steps'].append({
+            'outputs': outputs,
+            'rule': graph.get(outputs[0], (None, []))[0],
+            'target': targets.get(outputs[0]),
+            'start': start / 1000.0,
+            'duration': (end - start) / 1000.0,
+        })
+    return result
+
+
+def show(result):
+    """Show the critical path on the console."""
+    if not result['actions']:
+        console.notice('Critical path: No action was executed')
+        return
+    console.notice('Critical path: %d of %d actions, %.3gs of the %.3gs build, '
+                   'parallelism %.2g of %d jobs' % (
+                       len(result['steps']), result['actions'], result['length'],
+                       result['wall_time'], result['parallelism'], result['jobs']))
+    for step in result['steps']:
+        target = step['target']
+        console.notice('%8.3gs  %-14s %-40s %s' % (
+                step['duration'], step['rule'], '//' + target if target else '',
+                step['outputs'][0]), prefix=False)
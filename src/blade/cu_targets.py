@@ -342,7 +342,8 @@ class CuBinary(CuTarget):
                       order_only_deps=order_only_deps,
                       cmd=self.cmd)
         self._add_default_target_file('bin', output)
-        self._remove_on_clean(self._target_file_path(self.name + '.runfiles'))
+        self._remove_on_clean(self._target_file_path(self.name + '.runfiles'),
+                              self._target_file_path(self.name + '.runfiles.manifest'))
 
     def _before_generate(self):  # override
         """Override"""
@@ -402,6 +403,9 @@ class CuTest(CuBinary):
                  extra_cuflags,
                  extra_linkflags,
                  testdata,
+                 cpu,
+                 memory,
+                 flaky,
                  always_run,
                  exclusive,
                  kwargs):
@@ -425,6 +429,8 @@ class CuTest(CuBinary):
         self.attr['testdata'] = var_to_list(testdata)
         self.attr['always_run'] = always_run
         self.attr['exclusive'] = exclusive
+        self._set_test_resources(cpu, memory)
+        self.attr['flaky'] = flaky
 
         cc_test_config = config.get_section('cc_test_config')
         gtest_lib = var_to_list(cc_test_config['gtest_libs'])
@@ -449,6 +455,9 @@ def cu_test(
         extra_cuflags=[],
         extra_linkflags=[],
         testdata=[],
+        cpu=1,
+        memory=None,
+        flaky=False,
         always_run=False,
         exclusive=False,
         **kwargs):
@@ -466,6 +475,9 @@ def cu_test(
             extra_cuflags=extra_cuflags,
             extra_linkflags=extra_linkflags,
             testdata=testdata,
+            cpu=cpu,
+            memory=memory,
+            flaky=flaky,
             always_run=always_run,
             exclusive=exclusive,
             kwargs=kwargs)
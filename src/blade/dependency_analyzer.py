@@ -17,6 +17,7 @@ add extra options according to different target types.
 from __future__ import absolute_import
 from __future__ import print_function
 
+from blade import config
 from blade import console
 from blade.util import iteritems, itervalues
 
@@ -42,14 +43,23 @@ def analyze_deps(related_targets):
         2. the keys sorted
             [all the targets keys] - sorted
     """
-    _expand_deps(related_targets)
-    _expand_dependents(related_targets)
-    for target in itervalues(related_targets):
-        target.check_visibility()
+    lazy = config.get_item('global_config', 'deps_expansion') == 'lazy'
+    if lazy:
+        # The expanded deps and dependents are expanded when they are accessed.
+        _build_dependents(related_targets)
+    else:
+        _expand_deps(related_targets)
+        _expand_dependents(related_targets)
     # The topological sort is very important because even if ninja doesn't require the order of build statements,
     # but when generating code, dependents may access dependency's generated file information, which requires generation
     # of dependency ran firstly.
-    return _topological_sort(related_targets)
+    sorted_target_keys = _topological_sort(related_targets)
+    if lazy:
+        for target in itervalues(related_targets):
+            target._expand_deps_generation()
+    for target in itervalues(related_targets):
+        target.check_visibility()
+    return sorted_target_keys
 
 
 def _expand_deps(targets):
@@ -59,9 +69,10 @@ def _expand_deps(targets):
     Fill the related options according to different targets.
 
     """
+    expanded_deps = {}
     for target_id in targets:
         target = targets[target_id]
-        _expand_target_deps(target_id, targets)
+        target.expanded_deps = _expand_target_deps(target_id, targets, expanded_deps)
         target._expand_deps_generation()
 
 
@@ -76,17 +87,17 @@ def _unique_deps(new_deps_list):
     return list(reversed(result))
 
 
-def _expand_target_deps(target_id, targets, root_targets=None):
+def _expand_target_deps(target_id, targets, expanded_deps, root_targets=None):
     """_expand_target_deps.
 
     Return all targets depended by target_id directly and/or indirectly.
     We need the parameter root_target_id to check loopy dependency.
 
     """
-    target = targets[target_id]
-    if target.expanded_deps is not None:
-        return target.expanded_deps
+    if target_id in expanded_deps:
+        return expanded_deps[target_id]
 
+    target = targets[target_id]
     if root_targets is None:
         root_targets = set()
 
@@ -101,10 +112,10 @@ def _expand_target_deps(target_id, targets, root_targets=None):
                 err_msg += '//%s --> ' % t
             console.fatal('Loop dependency found: //%s --> [%s]' % (d, err_msg))
         new_deps_list.append(d)
-        new_deps_list += _expand_target_deps(d, targets, root_targets)
+        new_deps_list += _expand_target_deps(d, targets, expanded_deps, root_targets)
 
     new_deps_list = _unique_deps(new_deps_list)
-    target.expanded_deps = new_deps_list
+    expanded_deps[target_id] = new_deps_list
     root_targets.remove(target_id)
 
     return new_deps_list
@@ -115,6 +126,8 @@ def _expand_dependents(related_targets):
     Args:
         related_targets: dict{target_key, target} to be built
     """
+    for target in itervalues(related_targets):
+        target.expanded_dependents = set()
     for target_key, target in iteritems(related_targets):
         for depkey in target.deps:
             related_targets[depkey].dependents.add(target_key)
@@ -122,6 +135,54 @@ def _expand_dependents(related_targets):
             related_targets[depkey].expanded_dependents.add(target_key)
 
 
+def _build_dependents(related_targets):
+    """Build the direct dependents for every targets."""
+    for target_key, target in iteritems(related_targets):
+        for depkey in target.deps:
+            related_targets[depkey].dependents.add(target_key)
+
+
+def expand_target_deps(target_id, targets):
+    """Return all targets depended by target_id directly and/or indirectly.
+
+    The result is the same as `_expand_target_deps`, i.e., for duplicated deps only
+    the later ones are kept, but the expanded deps of other targets are not built.
+
+    That order is just the reversed post order of a depth first traversal which visits
+    the deps in reversed order, because when a target is visited at the first time in
+    such traversal, it is the last occurrence in the unique list.
+    """
+    result = []
+    entered = set()
+    finished = set()
+    # The deps are pushed in the original order to be popped in the reversed order.
+    # An entered target is pushed again before its deps, to be finished after them.
+    stack = list(targets[target_id].deps)
+    while stack:
+        key = stack.pop()
+        if key not in entered:
+            entered.add(key)
+            stack.append(key)
+            stack += targets[key].deps
+        elif key not in finished:
+            finished.add(key)
+            result.append(key)
+    result.reverse()
+    return result
+
+
+def expand_target_dependents(target_id, targets):
+    """Return all targets depend on target_id directly and/or indirectly."""
+    result = set()
+    stack = [target_id]
+    while stack:
+        for dependent in targets[stack.pop()].dependents:
+            if dependent not in result:
+                result.add(dependent)
+                stack.append(dependent)
+    return result
+
+
 def _topological_sort(related_targets):
     """Sort the target keys according to their dependency relationship.
     Every dependents before their dependencies, because the dependents should be built earlier.
@@ -146,5 +207,23 @@ def _topological_sort(related_targets):
             numpreds[depkey] -= 1
             if numpreds[depkey] == 0:
                 q.append(depkey)
-    assert len(sorted_target_keys) == len(related_targets)
+    if len(sorted_target_keys) != len(related_targets):
+        _report_loop_dependency(related_targets, numpreds)
     return sorted_target_keys
+
+
+def _report_loop_dependency(related_targets, numpreds):
+    """Report a loop in the targets which are not sorted.
+
+    Each of such targets is in or depends on a loop, so it has at least one unsorted dep.
+    Start from any of them and go down along such deps, a loop must be found.
+    """
+    path = [min(key for key, num in iteritems(numpreds) if num)]
+    indexes = {path[0]: 0}
+    while True:
+        key = next(dep for dep in related_targets[path[-1]].deps if numpreds[dep])
+        if key in indexes:
+            loop = path[indexes[key]:] + [key]
+            console.fatal('Loop dependency found: %s' % ' --> '.join('//' + k for k in loop))
+        indexes[key] = len(path)
+        path.append(key)
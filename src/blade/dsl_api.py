@@ -42,11 +42,27 @@ def _safe_config_module():
     return module
 
 
+# Called before a message is reported by the `blade.console` module
+__console_hook = None
+
+
+def set_console_hook(hook):
+    """Set the function to be called before a message is reported by the `blade.console` module.
+
+    The hook is called by the reporting function directly rather than wrapping it, so the
+    source location of the message is not affected.
+    """
+    global __console_hook
+    __console_hook = hook
+
+
 def _safe_console_module():
     """Make the safe blade.console module."""
     module = _new_module('console')
     def make_wrapper(severity):
         def wrapper(message):
+            if __console_hook:
+                __console_hook()
             console.diagnose(util.calling_source_location(1), severity, message)
         return wrapper
     for severity in ['debug', 'info', 'notice', 'warning', 'error']:
@@ -183,7 +183,8 @@ class GoBinary(GoTarget):
 class GoTest(GoTarget):
     """GoTest generates build rules for a go test binary."""
 
-    def __init__(self, name, srcs, deps, visibility, tags, testdata, extra_goflags, kwargs):
+    def __init__(self, name, srcs, deps, visibility, tags, testdata, cpu, memory, flaky,
+                 extra_goflags, kwargs):
         super(GoTest, self).__init__(
                 name=name,
                 type='go_test',
@@ -196,6 +197,8 @@ class GoTest(GoTarget):
         self.attr['go_rule'] = 'gotest'
         self.attr['testdata'] = var_to_list(testdata)
         self._add_tags('type:test')
+        self._set_test_resources(cpu, memory)
+        self.attr['flaky'] = flaky
 
 
 def go_library(
@@ -241,6 +244,9 @@ def go_test(
         visibility=None,
         tags=[],
         testdata=[],
+        cpu=1,
+        memory=None,
+        flaky=False,
         extra_goflags=None,
         **kwargs):
     build_manager.instance.register_target(GoTest(
@@ -250,6 +256,9 @@ def go_test(
             visibility=visibility,
             tags=tags,
             testdata=testdata,
+            cpu=cpu,
+            memory=memory,
+            flaky=flaky,
             extra_goflags=extra_goflags,
             kwargs=kwargs))
 
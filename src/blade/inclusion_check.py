@@ -9,6 +9,7 @@
 import os
 
 from blade import console
+from blade import string_table
 from blade import util
 from blade.util import pickle
 
@@ -29,8 +30,43 @@ def find_libs_by_header(hdr, hdr_targets_map, hdr_dir_targets_map):
             return set()
 
 
+# Tables in the global declaration file, see `write_global_declaration`.
+_PUBLIC_HDRS, _PUBLIC_INCS, _PRIVATE_HDRS, _ALLOWED_UNDECLARED_HDRS = range(4)
+
+
+def write_global_declaration(declaration_file, declaration):
+    """Write the global declaration into an indexed file which can be queried by `GlobalDeclaration`.
+
+    Each table maps a path to the space separated target keys of it, which are sorted to keep
+    the file content stable, so it is untouched if the declaration is unchanged.
+    """
+    def targets_table(targets_map):
+        return dict((path, ' '.join(sorted(keys))) for path, keys in targets_map.items())
+    tables = [None] * 4
+    tables[_PUBLIC_HDRS] = targets_table(declaration['public_hdrs'])
+    tables[_PUBLIC_INCS] = targets_table(declaration['public_incs'])
+    tables[_PRIVATE_HDRS] = targets_table(declaration['private_hdrs'])
+    tables[_ALLOWED_UNDECLARED_HDRS] = dict.fromkeys(declaration['allowed_undeclared_hdrs'], '')
+    return string_table.write_file(declaration_file, tables)
+
+
+class _TargetsTable(object):
+    """Adapt a string table to the {path: set(target keys)} dict interface."""
+    def __init__(self, table):
+        self._table = table
+
+    def get(self, path, default=None):
+        value = self._table.get(path)
+        if not value:
+            return default
+        return set(value.split(' '))
+
+
 class GlobalDeclaration(object):
-    """Global inclusion dependenct relationship declaration."""
+    """Global inclusion dependenct relationship declaration.
+
+    The declaration file is memory mapped and only the queried entries are read.
+    """
     def __init__(self, declaration_file):
         self._declaration_file = declaration_file
         self._initialized = False
@@ -39,12 +75,12 @@ class GlobalDeclaration(object):
         if self._initialized:
             return
         console.debug("Load global declaration file, " + reason)
-        declaration = pickle.load(open(self._declaration_file, 'rb'))
+        declaration = string_table.StringTableFile(self._declaration_file)
         # pylint: disable=attribute-defined-outside-init
-        self._hdr_targets_map = declaration['public_hdrs']
-        self._hdr_dir_targets_map = declaration['public_incs']
-        self._private_hdrs_target_map = declaration['private_hdrs']
-        self._allowed_undeclared_hdrs = declaration['allowed_undeclared_hdrs']
+        self._hdr_targets_map = _TargetsTable(declaration.table(_PUBLIC_HDRS))
+        self._hdr_dir_targets_map = _TargetsTable(declaration.table(_PUBLIC_INCS))
+        self._private_hdrs_target_map = _TargetsTable(declaration.table(_PRIVATE_HDRS))
+        self._allowed_undeclared_hdrs = declaration.table(_ALLOWED_UNDECLARED_HDRS)
         self._initialized = True
 
     def find_libs_by_header(self, hdr):
@@ -850,6 +850,9 @@ class JavaTest(JavaBinary):
             main_class,
             exclusions,
             testdata,
+            cpu,
+            memory,
+            flaky,
             target_under_test,
             kwargs):
         super(JavaTest, self).__init__(
@@ -869,6 +872,8 @@ class JavaTest(JavaBinary):
         self.type = 'java_test'
         self.attr['testdata'] = var_to_list(testdata)
         self._add_tags('type:test')
+        self._set_test_resources(cpu, memory)
+        self.attr['flaky'] = flaky
 
     def _java_test_vars(self):
         vars = {
@@ -969,6 +974,9 @@ def java_test(name=None,
               main_class='org.junit.runner.JUnitCore',
               exclusions=[],
               testdata=[],
+              cpu=1,
+              memory=None,
+              flaky=False,
               target_under_test=None,
               **kwargs):
     """Build a java test target"""
@@ -984,6 +992,9 @@ def java_test(name=None,
             main_class=main_class,
             exclusions=exclusions,
             testdata=testdata,
+            cpu=cpu,
+            memory=memory,
+            flaky=flaky,
             target_under_test=target_under_test,
             kwargs=kwargs)
     build_manager.instance.register_target(target)
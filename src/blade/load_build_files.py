@@ -17,7 +17,9 @@ input and provides hint for users.
 from __future__ import absolute_import
 from __future__ import print_function
 
+import multiprocessing
 import os
+import sys
 import traceback
 import types
 
@@ -26,11 +28,13 @@ from blade import build_rules
 from blade import config
 from blade import console
 from blade import dsl_api
+from blade import load_cache
 from blade import restricted
 from blade import target_tags
+from blade import trace
 
 from blade.pathlib import Path
-from blade.util import path_under_dir, var_to_list, exec_file, source_location
+from blade.util import path_under_dir, var_to_list, exec_file, pickle, source_location
 
 
 # import these modules make build functions registered into build_rules
@@ -56,8 +60,132 @@ def _load_build_rules():
     import blade.fbthrift_library
 
     build_rules.register_variable('build_target', build_attributes.attributes)
+    _wrap_build_rules()
 
 
+# Functions which are not build rules, their calls are not recorded into the BUILD files cache.
+_NON_RULE_FUNCTIONS = frozenset(['enable_if', 'glob', 'include', 'load'])
+
+# The original build rule functions, dict{name: function}
+__build_rules = {}
+
+# The recorder of the BUILD file under executing, used by the BUILD files cache.
+__recorder = None
+
+# The BUILD files cache, None if it is disabled.
+__build_file_cache = None
+
+
+def _current_recorder():
+    return __recorder
+
+
+def _make_recording_rule(name, function):
+    """Make a wrapper of the build rule to record its calls in the BUILD file."""
+    def rule(*args, **kwargs):
+        recorder = __recorder
+        if recorder is None or recorder.depth > 0:
+            return function(*args, **kwargs)
+        recorder.record_call(name, args, kwargs)
+        if recorder.dry_run:
+            return None
+        diagnostics = console.warning_count() + console.error_count()
+        recorder.depth += 1
+        try:
+            return function(*args, **kwargs)
+        finally:
+            recorder.depth -= 1
+            recorder.rule_diagnostics += console.warning_count() + console.error_count() - diagnostics
+    rule.__name__ = name
+    rule.__doc__ = function.__doc__
+    return rule
+
+
+def _wrap_build_rules():
+    """Wrap all build rules to make their calls can be recorded."""
+    if __build_rules:
+        return
+    for name, value in build_rules.get_all().items():
+        if name in _NON_RULE_FUNCTIONS or not callable(value):
+            continue
+        __build_rules[name] = value
+        build_rules.register_variable(name, _make_recording_rule(name, value))
+
+
+def _install_recording_hooks():
+    """Track the external states which can be accessed by BUILD files through the `blade` module."""
+    module = dsl_api.get_blade_module()
+    if isinstance(module.environ, load_cache.RecordingEnviron):
+        return
+    module.environ = load_cache.RecordingEnviron(_current_recorder)
+
+    path_exists = module.path.exists
+
+    def exists(path):
+        result = path_exists(path)
+        if __recorder:
+            __recorder.record_exists(path, result)
+        return result
+
+    module.path.exists = exists
+
+    # Messages reported by BUILD files can't be reproduced by replaying rule calls.
+    def on_console_message():
+        if __recorder and __recorder.depth == 0:
+            __recorder.cacheable = False
+
+    dsl_api.set_console_hook(on_console_message)
+
+
+def _init_build_file_cache(blade):
+    """Initialize the BUILD files cache if it is enabled."""
+    global __build_file_cache
+    if not config.get_item('global_config', 'build_file_cache'):
+        return
+    options = blade.get_options()
+    # Global states which may affect all BUILD files
+    key = (config.digest(), blade.revision(),
+           getattr(options, 'bits', None), getattr(options, 'arch', None),
+           getattr(options, 'profile', None))
+    __build_file_cache = load_cache.BuildFileCache(blade.get_build_dir(), key)
+    __build_file_cache.load()
+
+
+# Dirs walked to expand the target patterns and their mtimes, dict{dir: mtime}
+__walked_dirs = {}
+
+# Source dirs of the loaded BUILD files
+__loaded_dirs = []
+
+
+def _dir_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def build_files_unchanged():
+    """Whether all the loaded BUILD files and their inputs are unchanged since loaded.
+
+    Used by the blade server to reuse the loaded targets. Only the BUILD files recorded in
+    the cache can be checked.
+    """
+    if __build_file_cache is None:
+        return False
+    for path, mtime in __walked_dirs.items():
+        if _dir_mtime(path) != mtime:
+            return False
+    return __build_file_cache.check(__loaded_dirs, _glob_files)
+
+
+def _finish_build_file_cache():
+    """Save the BUILD files cache and report its statistics."""
+    if __build_file_cache is None:
+        return
+    __build_file_cache.save()
+    console.info(__build_file_cache.summary())
+
 def _find_dependent(dkey, blade):
     """Find which target depends on the target with dkey."""
     target_database = blade.get_target_database()
@@ -104,30 +232,14 @@ def _current_source_location():
     return source_location(os.path.join(str(source_dir), 'BUILD'))
 
 
-def glob(include, exclude=None, excludes=None, allow_empty=False):
-    """This function can be called in BUILD to specify a set of files using patterns.
-    Args:
-        include:List[str], file patterns to be matched.
-        exclude:Optional[List[str]], file patterns to be removed from the result.
-        allow_empty:bool: Whether a empty result is a error.
-
-    Patterns may contain shell-like wildcards, such as * , ? , or [charset].
-    Additionally, the path element '**' matches any subpath.
-    """
-    from blade import build_manager  # pylint: disable=import-outside-toplevel
-    source_dir = Path(build_manager.instance.get_current_source_path())
-    source_loc = _current_source_location()
-    include = var_to_list(include)
-    severity = config.get_item('global_config', 'glob_error_severity')
-    if excludes:
-        console.diagnose(source_loc, severity, '"excludes" is deprecated, use "exclude" instead')
-    exclude = var_to_list(exclude) + var_to_list(excludes)
+def _glob_files(source_dir, include, exclude):
+    """Return the sorted relative paths of files under the source_dir which match the patterns."""
+    source_dir = Path(source_dir)
 
     def includes_iterator():
         results = []
         for pattern in include:
             if not pattern:
-                console.diagnose(source_loc, 'error', '"glob": Empty pattern is not allowed')
                 continue
             for path in source_dir.glob(pattern):
                 if path.is_file() and not path.name.startswith('.'):
@@ -155,7 +267,35 @@ def glob(include, exclude=None, excludes=None, allow_empty=False):
                 return True
         return False
 
-    result = sorted({str(p) for p in includes_iterator() if not exclusion(p)})
+    return sorted({str(p) for p in includes_iterator() if not exclusion(p)})
+
+
+def glob(include, exclude=None, excludes=None, allow_empty=False):
+    """This function can be called in BUILD to specify a set of files using patterns.
+    Args:
+        include:List[str], file patterns to be matched.
+        exclude:Optional[List[str]], file patterns to be removed from the result.
+        allow_empty:bool: Whether a empty result is a error.
+
+    Patterns may contain shell-like wildcards, such as * , ? , or [charset].
+    Additionally, the path element '**' matches any subpath.
+    """
+    from blade import build_manager  # pylint: disable=import-outside-toplevel
+    source_dir = build_manager.instance.get_current_source_path()
+    source_loc = _current_source_location()
+    include = var_to_list(include)
+    severity = config.get_item('global_config', 'glob_error_severity')
+    if excludes:
+        console.diagnose(source_loc, severity, '"excludes" is deprecated, use "exclude" instead')
+    exclude = var_to_list(exclude) + var_to_list(excludes)
+
+    for pattern in include:
+        if not pattern:
+            console.diagnose(source_loc, 'error', '"glob": Empty pattern is not allowed')
+
+    result = _glob_files(source_dir, include, exclude)
+    if __recorder:
+        __recorder.record_glob(include, exclude, result)
     if not result and not allow_empty:
         args = repr(include)
         if exclude:
@@ -167,11 +307,16 @@ def glob(include, exclude=None, excludes=None, allow_empty=False):
     return result
 
 
+def _is_restricted_dsl_dir(source_dir):
+    """Whether the BUILD file in the source_dir is restricted to use the safe DSL."""
+    global_config = config.get_section('global_config')
+    return global_config.get('restricted_dsl') and source_dir not in global_config.get('unrestricted_dsl_dirs')
+
+
 def _get_globals_for_build_file(source_dir):
     """Get global variables for BUILD files."""
     result = build_rules.get_all()
-    global_config = config.get_section('global_config')
-    if global_config.get('restricted_dsl') and source_dir not in global_config.get('unrestricted_dsl_dirs'):
+    if _is_restricted_dsl_dir(source_dir):
         result['__builtins__'] = restricted.safe_builtins
     result['blade'] = dsl_api.get_blade_module()
     return result
@@ -201,12 +346,18 @@ def _expand_include_path(name):
     return os.path.join(dir, name)
 
 
+# Files included by the BUILD files and the extensions
+__included_files = set()
+
+
 def include(name):
     """Include another file into current BUILD file"""
     full_path = _expand_include_path(name)
     if not os.path.isfile(full_path):
         console.diagnose(_current_source_location(), 'error', 'File "%s" does not exist' % name)
         return
+    __included_files.add(full_path)
+    _add_file_dependencies([full_path])
     exec_file(full_path, __current_globals, None)
 
 
@@ -214,11 +365,31 @@ def include(name):
 # dict{full_path: dict{symbol_name: value}}
 __loaded_extension_info = {}
 
+# Files which each loaded extension depends on, include itself
+# dict{full_path: set(full_path)}
+__extension_file_deps = {}
+
+# Stack of the file dependencies sets being collected
+__file_deps_stack = []
+
+
+def loaded_extra_files():
+    """Return the files loaded by the BUILD files besides themselves, the extensions and the
+    included files, which may affect any target."""
+    return set(__loaded_extension_info) | __included_files
+
+
+def _add_file_dependencies(paths):
+    """Add files to the dependencies of all the BUILD file and extensions being executed."""
+    for deps in __file_deps_stack:
+        deps.update(paths)
+
 
 def _load_extension(name):
     """Load symbols from file or obtain from loaded cache."""
     full_path = _expand_include_path(name)
     if full_path in __loaded_extension_info:
+        _add_file_dependencies(__extension_file_deps[full_path])
         return __loaded_extension_info[full_path]
 
     if not os.path.isfile(full_path):
@@ -229,7 +400,14 @@ def _load_extension(name):
     # make an isolated symbol set to implement this approach.
     origin_globals = _get_globals_for_extension()
     extension_globals = origin_globals.copy()
-    exec_file(full_path, extension_globals, None)
+    file_deps = {full_path}
+    __file_deps_stack.append(file_deps)
+    try:
+        exec_file(full_path, extension_globals, None)
+    finally:
+        __file_deps_stack.pop()
+    __extension_file_deps[full_path] = file_deps
+    _add_file_dependencies(file_deps)
     # Extract new symbols
     result = {}
     for symbol, value in extension_globals.items():
@@ -289,12 +467,15 @@ build_rules.register_function(include)
 build_rules.register_function(load)
 
 
-def __load_build_file(source_dir, blade):
+def __load_build_file(source_dir, blade, calls=None):
     """
     Load and execute the BUILD file, which is a Python script, in source_dir.
     Statements in BUILD depends on global variable current_source_dir, and will
     register build target/rules into global variables target_database.
     Report error and exit if path/BUILD does NOT exist.
+
+    If calls is not None, they are the recorded rule calls of the BUILD file and are
+    replayed instead of executing it.
     """
 
     if not os.path.isdir(source_dir):
@@ -307,11 +488,11 @@ def __load_build_file(source_dir, blade):
         build_file = os.path.join(source_dir, 'BUILD')
         if os.path.isfile(build_file):
             try:
-                # The magic here is that a BUILD file is a Python script,
-                # which can be loaded and executed by execfile().
-                global __current_globals
-                __current_globals = _get_globals_for_build_file(source_dir)
-                exec_file(build_file, __current_globals, None)
+                with trace.span(build_file, 'load'):
+                    if calls is not None:
+                        _replay_calls(build_file, calls)
+                    elif not _replay_build_file(source_dir, build_file):
+                        _exec_build_file(source_dir, build_file)
                 return True
             except SystemExit:
                 console.fatal('%s: Fatal error' % build_file)
@@ -326,6 +507,50 @@ def __load_build_file(source_dir, blade):
     return False
 
 
+def _exec_build_file(source_dir, build_file):
+    """Execute the BUILD file, and record it into the cache if possible."""
+    # The magic here is that a BUILD file is a Python script,
+    # which can be loaded and executed by execfile().
+    global __current_globals, __recorder
+    __current_globals = _get_globals_for_build_file(source_dir)
+    if __build_file_cache is None or not _is_restricted_dsl_dir(source_dir):
+        exec_file(build_file, __current_globals, None)
+        return
+
+    recorder = load_cache.Recorder(source_dir, build_file)
+    diagnostics = console.warning_count() + console.error_count()
+    __recorder = recorder
+    __file_deps_stack.append(recorder.files)
+    try:
+        exec_file(build_file, __current_globals, None)
+    finally:
+        __file_deps_stack.pop()
+        __recorder = None
+    diagnostics = console.warning_count() + console.error_count() - diagnostics
+    if diagnostics > recorder.rule_diagnostics:
+        # Diagnostics reported out of the rules, such as by `glob`, can't be reproduced by replaying.
+        recorder.cacheable = False
+    __build_file_cache.update(recorder)
+
+
+def _replay_build_file(source_dir, build_file):
+    """Replay the rule calls of the BUILD file from the cache, return False if it is not cached."""
+    if __build_file_cache is None or not _is_restricted_dsl_dir(source_dir):
+        return False
+    calls = __build_file_cache.lookup(source_dir, _glob_files)
+    if calls is None:
+        return False
+    _replay_calls(build_file, calls)
+    return True
+
+
+def _replay_calls(build_file, calls):
+    """Replay the recorded rule calls of the BUILD file."""
+    for name, lineno, data in calls:
+        args, kwargs = pickle.loads(data)
+        load_cache.replay_call(build_file, lineno, __build_rules[name], args, kwargs)
+
+
 def _load_build_file(source_dir, processed_dirs, blade):
     """
     Load the BUILD and place the targets into database.
@@ -340,6 +565,122 @@ def _load_build_file(source_dir, processed_dirs, blade):
     return result
 
 
+# In the auto jobs mode, the parallel loading is only used when there are enough BUILD files
+# to be loaded, to avoid the overhead of the worker processes in small workspaces.
+_PARALLEL_LOADING_THRESHOLD = 16
+
+# The worker processes pool for the parallel loading, created on demand.
+__load_pool = None
+
+# Source dirs which have been tried to be loaded in parallel.
+__attempted_dirs = set()
+
+
+def _load_jobs():
+    """The number of worker processes of the parallel loading, and whether it is explicitly specified."""
+    jobs = config.get_item('global_config', 'load_jobs')
+    if jobs > 0:
+        return jobs, True
+    return multiprocessing.cpu_count(), False
+
+
+def _get_load_pool(count):
+    """Return the worker processes pool if it worths to load count BUILD files in parallel."""
+    global __load_pool
+    jobs, explicit = _load_jobs()
+    if count < (2 if explicit else _PARALLEL_LOADING_THRESHOLD):
+        return None
+    if __load_pool is None:
+        # Workers must be forked to inherit the loaded config and build rules.
+        if sys.version_info[0] == 3:
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing
+        __load_pool = context.Pool(jobs, initializer=console.mute)
+        console.debug('Loading BUILD files with %d worker processes' % jobs)
+    return __load_pool
+
+
+def _finish_parallel_loading():
+    """Stop the worker processes."""
+    global __load_pool
+    if __load_pool is not None:
+        __load_pool.close()
+        __load_pool.join()
+        __load_pool = None
+    __attempted_dirs.clear()
+
+
+def _record_build_file(source_dir):
+    """Execute the BUILD file in the worker process and record its rule calls.
+
+    Returns:
+        The recorder, or None if the BUILD file should be loaded in the main process, such as
+        it reports some diagnostics, which can't be reproduced by replaying.
+    """
+    global __current_globals, __recorder
+    from blade import build_manager  # pylint: disable=import-outside-toplevel
+    build_file = os.path.join(source_dir, 'BUILD')
+    recorder = load_cache.Recorder(source_dir, build_file, dry_run=True)
+    messages = console.muted_count()
+    build_manager.instance.set_current_source_path(source_dir)
+    __current_globals = _get_globals_for_build_file(source_dir)
+    __recorder = recorder
+    __file_deps_stack.append(recorder.files)
+    try:
+        exec_file(build_file, __current_globals, None)
+    except BaseException:  # pylint: disable=broad-except
+        # Including SystemExit from console.fatal, let the main process report it.
+        return None
+    finally:
+        __file_deps_stack.pop()
+        __recorder = None
+    if not recorder.cacheable or console.muted_count() != messages:
+        return None
+    return recorder
+
+
+def _load_build_files_in_parallel(source_dirs, processed_dirs, blade):
+    """Load BUILD files in the worker processes if it worths.
+
+    The BUILD files are executed by the workers in the dry run mode, and their rule calls are
+    replayed in the main process in the sorted order of the source dirs, so the diagnostics and
+    target registering are deterministic. BUILD files which can't be loaded by workers are left
+    to be loaded serially.
+    """
+    if _load_jobs()[0] <= 1:
+        return
+    source_dirs = {os.path.normpath(d) for d in source_dirs}
+    source_dirs -= __attempted_dirs
+    __attempted_dirs.update(source_dirs)
+    source_dirs = sorted(d for d in source_dirs if d not in processed_dirs and
+                         _is_restricted_dsl_dir(d) and os.path.isfile(os.path.join(d, 'BUILD')))
+    cached_calls = {}
+    if __build_file_cache is not None:
+        for source_dir in source_dirs:
+            calls = __build_file_cache.lookup(source_dir, _glob_files)
+            if calls is not None:
+                cached_calls[source_dir] = calls
+    missed_dirs = [d for d in source_dirs if d not in cached_calls]
+    pool = _get_load_pool(len(missed_dirs))
+    recorders = None
+    if pool is not None:
+        chunksize = max(1, min(16, len(missed_dirs) // (4 * _load_jobs()[0])))
+        recorders = pool.imap(_record_build_file, missed_dirs, chunksize)
+    for source_dir in source_dirs:
+        calls = cached_calls.get(source_dir)
+        if calls is None:
+            if recorders is None:
+                continue
+            recorder = next(recorders)
+            if recorder is None:
+                continue
+            calls = recorder.calls
+            if __build_file_cache is not None:
+                __build_file_cache.update(recorder)
+        processed_dirs[source_dir] = __load_build_file(source_dir, blade, calls)
+
+
 _BLADE_SKIP_FILE = '.bladeskip'
 
 # File names should be skipped
@@ -410,6 +751,8 @@ def load_targets(target_ids, excluded_targets, blade):
     files.  Returns a map which contains all these targets.
     """
     _load_build_rules()
+    _init_build_file_cache(blade)
+    _install_recording_hooks()
 
     filter_function = _compile_filter(blade)
 
@@ -429,6 +772,10 @@ def load_targets(target_ids, excluded_targets, blade):
     # load all their dependencies
     related_targets = _load_related_build_files(blade, command_targets, processed_dirs)
 
+    _finish_parallel_loading()
+    _finish_build_file_cache()
+    __loaded_dirs[:] = sorted(processed_dirs)
+
     return direct_targets, command_targets, related_targets
 
 
@@ -496,6 +843,7 @@ def _expand_target_patterns(blade, target_ids, excluded_trees):
 
         if target_name == '...':
             for root, dirs, files in os.walk(source_dir):
+                __walked_dirs[root] = _dir_mtime(root)
                 # Note the dirs[:] = slice assignment; we are replacing the
                 # elements in dirs (and not the list referred to by dirs) so
                 # that os.walk() will not process deleted directories.
@@ -520,6 +868,7 @@ def _load_starting_build_files(blade, starting_dirs, processed_dirs, filter_func
     # Together with above step, we can ensure that all targets mentioned in the
     # command line are now loaded.
 
+    _load_build_files_in_parallel(starting_dirs, processed_dirs, blade)
     for source_dir in starting_dirs:
         _load_build_file(source_dir, processed_dirs, blade)
     target_database = blade.get_target_database()
@@ -528,6 +877,16 @@ def _load_starting_build_files(blade, starting_dirs, processed_dirs, filter_func
     return {key for key, target in target_database.items() if filter_function(target)}
 
 
+def _frontier_dirs(target_ids):
+    """Return source dirs of the targets to be loaded."""
+    result = set()
+    for target_id in target_ids:
+        source_dir = target_id.split(':')[0]
+        if source_dir != '#' and not _check_under_skipped_dir(source_dir):
+            result.add(source_dir)
+    return result
+
+
 def _load_related_build_files(blade, command_targets, processed_dirs):
     """Load all related build files referenced by command line targets."""
 
@@ -539,6 +898,7 @@ def _load_related_build_files(blade, command_targets, processed_dirs):
     target_database = blade.get_target_database()
     related_targets = {}
     cited_targets = set(command_targets)
+    parallel = _load_jobs()[0] > 1
 
     while cited_targets:
         target_id = cited_targets.pop()
@@ -557,6 +917,11 @@ def _load_related_build_files(blade, command_targets, processed_dirs):
             dependent.error('"%s" is under skipped directory due to "%s"' % (target_id, skip_file))
             continue
 
+        if parallel and os.path.normpath(source_dir) not in __attempted_dirs:
+            # Load all the BUILD files in current frontier together.
+            _load_build_files_in_parallel(_frontier_dirs(cited_targets | {target_id}),
+                                          processed_dirs, blade)
+
         if not _load_build_file(source_dir, processed_dirs, blade):
             continue
 
@@ -0,0 +1,282 @@
+# Copyright (c) 2021 Tencent Inc.
+# All rights reserved.
+#
+# Author: chen3feng <chen3feng@gmail.com>
+# Date:   2021-06-05
+
+"""
+Persistent cache of the BUILD files evaluation.
+
+Executing a BUILD file is essentially calling the build rules in it with some arguments.
+For each BUILD file, we record the rule calls and all the inputs which may affect them,
+such as the included and loaded files, the glob results and the environment variables.
+If none of the inputs changed in the later run, the rule calls are replayed directly
+without executing the BUILD file again.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+
+from blade import console
+from blade.util import md5sum_file, pickle, source_location
+
+
+# Increase this number if the format of the cache file is changed.
+_VERSION = 1
+
+_CACHE_FILE = '.build_files_cache.data'
+
+
+def _file_stamp(path):
+    """Return the quick check stamp of a file."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+class Recorder(object):
+    """Records the inputs and rule calls during the execution of a BUILD file."""
+
+    def __init__(self, source_dir, build_file, dry_run=False):
+        """Init method.
+
+        Args:
+            dry_run: bool, only record the rule calls without executing them. Used in the worker
+                processes of the parallel loading, the calls are replayed by the main process.
+        """
+        self.source_dir = source_dir
+        self.build_file = build_file
+        self.dry_run = dry_run
+        self.cacheable = True
+        # Depth of the nested rule calls, only the outmost calls are recorded.
+        self.depth = 0
+        # Number of warnings and errors reported inside rule calls, they will be reported
+        # again when the calls are replayed.
+        self.rule_diagnostics = 0
+        self.files = set()
+        self.environ = {}
+        self.exists = {}
+        self.globs = []
+        self.calls = []
+
+    def record_call(self, name, args, kwargs):
+        """Record a rule call, with its line number in the BUILD file."""
+        location = source_location(self.build_file)
+        lineno = int(location.rsplit(':', 1)[1])
+        try:
+            # Serialize the arguments before calling, because they may be modified by the rule.
+            data = pickle.dumps((args, kwargs), pickle.HIGHEST_PROTOCOL)
+        except Exception:  # pylint: disable=broad-except
+            # Some arguments are not serializable, such as functions.
+            self.cacheable = False
+            return
+        self.calls.append((name, lineno, data))
+
+    def record_glob(self, include, exclude, result):
+        self.globs.append((include, exclude, result))
+
+    def record_env(self, name, value):
+        self.environ[name] = value
+
+    def record_exists(self, path, value):
+        self.exists[path] = value
+
+
+class RecordingEnviron(object):
+    """A readonly proxy to `os.environ` which records accessed variables into the current recorder."""
+
+    def __init__(self, get_recorder):
+        self.__get_recorder = get_recorder
+
+    def __record(self, name):
+        value = os.environ.get(name)
+        recorder = self.__get_recorder()
+        if recorder:
+            recorder.record_env(name, value)
+        return value
+
+    def __whole(self):
+        # Enumerating the whole environment can't be tracked precisely.
+        recorder = self.__get_recorder()
+        if recorder:
+            recorder.cacheable = False
+        return os.environ
+
+    def __getitem__(self, name):
+        value = self.__record(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name):
+        return self.__record(name) is not None
+
+    def get(self, name, default=None):
+        value = self.__record(name)
+        return default if value is None else value
+
+    def __iter__(self):
+        return iter(self.__whole())
+
+    def __len__(self):
+        return len(self.__whole())
+
+    def keys(self):
+        return self.__whole().keys()
+
+    def values(self):
+        return self.__whole().values()
+
+    def items(self):
+        return self.__whole().items()
+
+
+class BuildFileCache(object):
+    """The persistent BUILD files evaluation cache."""
+
+    def __init__(self, build_dir, key):
+        """Init method.
+
+        Args:
+            build_dir: str, the build dir to store the cache file.
+            key: any comparable object, the global state which may affect all BUILD files,
+                such as the config and the blade itself. The cache is dropped if it changes.
+        """
+        self.__path = os.path.join(build_dir, _CACHE_FILE)
+        self.__key = key
+        # dict{source_dir: entry}
+        self.__entries = {}
+        self.__dirty = False
+        # Checked files in this run, dict{path: [stamp, md5]}
+        self.__checked_files = {}
+        # Source dirs of looked up BUILD files
+        self.__hits = set()
+        self.__misses = set()
+
+    def load(self):
+        """Load the cache file."""
+        try:
+            with open(self.__path, 'rb') as f:
+                data = pickle.load(f)
+        except Exception:  # pylint: disable=broad-except
+            # Missing or corrupted cache file, start from empty.
+            return
+        if data.get('version') != _VERSION or data.get('key') != self.__key:
+            console.debug('BUILD files cache is outdated, drop it')
+            return
+        self.__entries = data['entries']
+
+    def save(self):
+        """Save the cache file if it is changed."""
+        if not self.__dirty:
+            return
+        data = {
+            'version': _VERSION,
+            'key': self.__key,
+            'entries': self.__entries,
+        }
+        tmp_path = self.__path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, self.__path)
+        except (IOError, OSError) as e:
+            console.warning('Failed to save BUILD files cache: %s' % e)
+        self.__dirty = False
+
+    def lookup(self, source_dir, glob_function):
+        """Return the recorded rule calls of the BUILD file if it is still valid, otherwise None.
+
+        Args:
+            glob_function: Callable(source_dir, include, exclude), to evaluate the recorded globs again.
+        """
+        entry = self.__entries.get(source_dir)
+        if entry is not None and self._is_valid(source_dir, entry, glob_function):
+            self.__hits.add(source_dir)
+            return entry['calls']
+        self.__misses.add(source_dir)
+        return None
+
+    def check(self, source_dirs, glob_function):
+        """Check whether all the BUILD files in source_dirs are cached and still valid now."""
+        self.__checked_files.clear()
+        for source_dir in source_dirs:
+            entry = self.__entries.get(source_dir)
+            if entry is None or not self._is_valid(source_dir, entry, glob_function):
+                return False
+        return True
+
+    def update(self, recorder):
+        """Update the cache entry from the recorder."""
+        if not recorder.cacheable:
+            if self.__entries.pop(recorder.source_dir, None) is not None:
+                self.__dirty = True
+            return
+        files = {}
+        for path in recorder.files | {recorder.build_file}:
+            files[path] = (_file_stamp(path), md5sum_file(path))
+        self.__entries[recorder.source_dir] = {
+            'files': files,
+            'environ': recorder.environ,
+            'exists': recorder.exists,
+            'globs': recorder.globs,
+            'calls': recorder.calls,
+        }
+        self.__dirty = True
+
+    def _is_valid(self, source_dir, entry, glob_function):
+        files = entry['files']
+        for path, (stamp, md5) in list(files.items()):
+            new_stamp = self._check_file(path, stamp, md5)
+            if new_stamp is None:
+                return False
+            if new_stamp != stamp:
+                # Touched but not modified, update the stamp to avoid checksum it again.
+                files[path] = (new_stamp, md5)
+                self.__dirty = True
+        for name, value in entry['environ'].items():
+            if os.environ.get(name) != value:
+                return False
+        for path, value in entry['exists'].items():
+            if os.path.exists(path) != value:
+                return False
+        for include, exclude, result in entry['globs']:
+            if glob_function(source_dir, include, exclude) != result:
+                return False
+        return True
+
+    def _check_file(self, path, stamp, md5):
+        """Return the current stamp of the file if its content is unchanged, otherwise None."""
+        state = self.__checked_files.get(path)
+        if state is None:
+            state = [_file_stamp(path), None]
+            self.__checked_files[path] = state
+        new_stamp = state[0]
+        if new_stamp is None:
+            return None
+        if new_stamp == stamp:
+            return new_stamp
+        if state[1] is None:
+            state[1] = md5sum_file(path)
+        return new_stamp if state[1] == md5 else None
+
+    def summary(self):
+        """Return a brief summary of the cache hits."""
+        hits, misses = len(self.__hits), len(self.__misses)
+        rate = 100.0 * hits / (hits + misses) if hits + misses else 0.0
+        return 'BUILD files cache: %d hits, %d misses (%.1f%% hit rate)' % (hits, misses, rate)
+
+
+def replay_call(build_file, lineno, function, args, kwargs):
+    """Call the rule function as if it is called in the `lineno` line of the `build_file`.
+
+    The rules look up the source location from the call stack, make a tiny code object
+    in which the call is at the expected location to keep it.
+    """
+    code = compile('\n' * (lineno - 1) + '__function(*__args, **__kwargs)', build_file, 'eval')
+    # pylint: disable=eval-used
+    return eval(code, {'__function': function, '__args': args, '__kwargs': kwargs})
@@ -24,7 +24,9 @@ from blade import build_manager
 from blade import command_line
 from blade import config
 from blade import console
+from blade import server
 from blade import target_pattern
+from blade import trace
 from blade import workspace
 
 
@@ -44,7 +46,8 @@ def setup_console(options):
 def adjust_config_by_options(config, options):
     # Shared options between config and command line
     shared_options = {
-        'global_config': ['debug_info_level', 'backend_builder', 'build_jobs', 'test_jobs', 'run_unrepaired_tests'],
+        'global_config': ['debug_info_level', 'backend_builder', 'build_jobs', 'test_jobs', 'load_jobs',
+                          'run_unrepaired_tests'],
         'java_config': ['jar_compression_level', 'fat_jar_compression_level'],
     }
     for section, names in shared_options.items():
@@ -74,20 +77,34 @@ def run_subcommand(blade_path, command, options, ws, targets):
     builder = build_manager.initialize(blade_path, command, options, ws, targets)
 
     # Prepare the targets
-    stages = [
-        ('load', builder.load_targets),
-        ('analyze', builder.analyze_targets),
-        ('generate', builder.generate),
-    ]
-    for stage, action in stages:
-        action()
+    returncode = run_stages(builder, options, ['load', 'analyze', 'generate'])
+    if returncode is not None:
+        return returncode
+
+    return run_command(builder, command)
+
+
+def run_stages(builder, options, stages):
+    """Run the preparing stages, return the exit code if it should stop."""
+    actions = {
+        'load': builder.load_targets,
+        'analyze': builder.analyze_targets,
+        'generate': builder.generate,
+    }
+    for stage in stages:
+        with trace.span(stage, 'stage'):
+            actions[stage]()
         if _check_error_log(stage):
             return 1
         if options.stop_after == stage:
             return 0
+    return None
+
 
-    # Run sub command
-    returncode = getattr(builder, command)()
+def run_command(builder, command):
+    """Run sub command."""
+    with trace.span(command, 'command'):
+        returncode = getattr(builder, command)()
     if returncode != 0:
         return returncode
     return _check_error_log(command)
@@ -113,8 +130,12 @@ def run_subcommand_profile(blade_path, command, options, ws, targets):
     return exit_code[0]
 
 
-def _main(blade_path, argv):
-    """The main entry of blade."""
+def initialize(argv):
+    """Parse the command line, initialize the workspace and the config.
+
+    Returns:
+        (command, options, workspace, targets), or None if failed.
+    """
     command, options, targets = command_line.parse(argv)
     setup_console(options)
 
@@ -124,22 +145,43 @@ def _main(blade_path, argv):
 
     adjust_config_by_options(config, options)
     if _check_error_log('config'):
-        return 1
+        return None
 
     if not targets:
         targets = ['.']
     targets = target_pattern.normalize_list(targets, ws.working_dir())
 
     ws.setup_build_dir()
+    return command, options, ws, targets
 
+
+def run(blade_path, command, options, ws, targets):
+    """Run the command in the locked workspace."""
     lock_id = ws.lock()
+    if options.trace:
+        trace.start(os.path.join(ws.working_dir(), options.trace))
     try:
         run_fn = run_subcommand_profile if options.profiling else run_subcommand
         return run_fn(blade_path, command, options, ws, targets)
     finally:
+        trace.save()
         ws.unlock(lock_id)
 
 
+def _main(blade_path, argv):
+    """The main entry of blade."""
+    if argv and argv[0] == 'server':
+        command, options, _ = command_line.parse(argv)
+        setup_console(options)
+        return server.run_server(blade_path, options)
+
+    initialized = initialize(argv)
+    if initialized is None:
+        return 1
+    command, options, ws, targets = initialized
+    return run(blade_path, command, options, ws, targets)
+
+
 def format_timedelta(seconds):
     """
     Format the time delta as human readable format such as '1h20m5s' or '5s' if it is short.
@@ -161,10 +203,21 @@ def format_timedelta(seconds):
 
 
 def main(blade_path, argv):
+    return run_main(lambda: _main(blade_path, argv), time.time())
+
+
+def run_main(function, start_time):
+    """Run the function with the common error handling.
+
+    Returns:
+        The exit code, or None if the function returns None, which means the command is not finished
+        and will be continued by the blade server.
+    """
     exit_code = 0
     try:
-        start_time = time.time()
-        exit_code = _main(blade_path, argv)
+        exit_code = function()
+        if exit_code is None:
+            return None
         cost_time = time.time() - start_time
         console.info('Cost time %s' % format_timedelta(cost_time))
     except SystemExit as e:
@@ -13,10 +13,27 @@ from __future__ import print_function
 
 import os
 import re
+import select
 import subprocess
 import time
+from collections import namedtuple
 
 from blade import console
+from blade import trace
+
+
+# The format of the entries is same since v5: "start_ms end_ms mtime output cmdhash"
+_NINJA_LOG_HEADER_RE = re.compile(r'^# ninja log v(\d+)')
+_NINJA_LOG_MIN_VERSION = 5
+
+# The times are in milliseconds since the start of ninja, the mtime is of the output
+NinjaLogEntry = namedtuple('NinjaLogEntry', ['start_ms', 'end_ms', 'mtime', 'output', 'cmdhash'])
+
+# The status line of ninja in the format of `NINJA_STATUS`, such as '[1/123] CC xxx.cc'
+_NINJA_STATUS_RE = re.compile(br'^\[(\d+)/(\d+)\]\s+')
+
+# Max size of the ninja output to be read at once
+_OUTPUT_CHUNK_SIZE = 64 * 1024
 
 
 def build(build_dir, build_script, jobs_num, targets, options):
@@ -30,10 +47,12 @@ def build(build_dir, build_script, jobs_num, targets, options):
         cmd.append('-v')
     if targets:
         cmd.append(targets)
+    ninja_log = os.path.join(build_dir, '.ninja_log')
+    log_position = ninja_log_position(ninja_log)
     build_start_time = time.time()
     ret = _run_ninja_build(cmd, options)
-    if options.show_builds_slower_than is not None:
-        _show_slow_builds(build_dir, build_start_time, options.show_builds_slower_than)
+    if trace.enabled():
+        _trace_ninja_actions(ninja_log, log_position, build_start_time)
     return ret
 
 
@@ -62,12 +81,16 @@ def _run_ninja_build(cmd, options):
     cmdstr = ' '.join(cmd)
     if console.verbosity_compare(options.verbosity, 'quiet') > 0:
         return _run_ninja_command(cmdstr)
-    # In quiet mode, redirect ninja output to the file
+    # In quiet mode, the ninja output is converted into the progress bar, and written to the file
     ninja_output = 'blade-bin/ninja_output.log'
-    with open(ninja_output, 'w', buffering=1) as wf, open(ninja_output, 'r', buffering=1) as rf:
+    with open(ninja_output, 'wb', 0) as output_file:
         os.environ['NINJA_STATUS'] = '[%f/%t] '  # The progress depends on this format
-        p = subprocess.Popen(cmdstr, shell=True, stdout=wf, stderr=subprocess.STDOUT)
-        _show_progress(p, rf)
+        p = subprocess.Popen(cmdstr, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        try:
+            _show_progress(p.stdout.fileno(), output_file)
+        finally:
+            p.stdout.close()
+            p.wait()
     return p.returncode
 
 
@@ -83,46 +106,144 @@ def _run_ninja_command(cmdstr):
         return 1
 
 
-def _show_progress(process, file_reader):
+def _show_progress(fd, output_file):
     """
     Convert description message such as '[1/123] CC xxx.cc' into progress bar.
     """
-    progress_re = re.compile(r'^\[(\d+)/(\d+)\]\s+')
     try:
-        while True:
-            process.poll()
-            line = file_reader.readline().strip()
-            if line:
-                m = progress_re.match(line)
-                if m:
-                    console.show_progress_bar(int(m.group(1)), int(m.group(2)))
-                else:
-                    console.clear_progress_bar()
-                    console.output(line)
-            elif process.returncode is not None:
-                break
-            else:
-                # Avoid cost too much cpu
-                time.sleep(0.1)
+        _stream_output(fd, output_file, console.show_progress_bar, console.output,
+                       console.progress_refresh_interval())
     finally:
         console.clear_progress_bar()
 
 
-def _show_slow_builds(build_dir, build_start_time, show_builds_slower_than):
-    """Show slow build targets."""
-    with open(os.path.join(build_dir, '.ninja_log')) as f:
-        head = f.readline()
-        if '# ninja log v5' not in head:
-            console.warning('Unknown ninja log version: %s' % head)
-            return
-        build_times = []
-        for line in f.readlines():
-            start_time, end_time, timestamp, target, cmdhash = line.split()
-            cost_time = (int(end_time) - int(start_time)) / 1000.0  # ms -> s
-            timestamp = int(timestamp)
-            if timestamp >= build_start_time and cost_time > show_builds_slower_than:
-                build_times.append((cost_time, target))
-        if build_times:
-            console.notice('Slow build targets:')
-            for cost_time, target in sorted(build_times):
-                console.notice('%.4gs\t%s' % (cost_time, target), prefix=False)
+def _stream_output(fd, output_file, show_progress, show_line, refresh_interval):
+    """Process the ninja output from the pipe until it is closed.
+
+    The output is read as soon as it is available, and written into the output file as is.
+    Other lines than the status lines are shown immediately. The progress is refreshed with
+    the latest status at most once per the refresh interval, and is still refreshed when ninja
+    becomes quiet for a while, such as when running a long action.
+
+    Args:
+        fd: int, the read end of the pipe.
+        show_progress: function(current, total) to show the progress.
+        show_line: function(str) to show a line which is not the status.
+        refresh_interval: float, the min interval in seconds between the progress refreshes.
+    """
+    partial_line = b''
+    status = None  # The match of the latest status line which has not been shown
+    last_refresh_time = 0.0
+    while True:
+        timeout = None
+        if status is not None:
+            timeout = max(last_refresh_time + refresh_interval - time.time(), 0)
+        if select.select([fd], [], [], timeout)[0]:
+            data = os.read(fd, _OUTPUT_CHUNK_SIZE)
+            if not data:
+                break
+            output_file.write(data)
+            lines = (partial_line + data).split(b'\n')
+            partial_line = lines.pop()
+            for line in lines:
+                if line.startswith(b'['):
+                    m = _NINJA_STATUS_RE.match(line)
+                    if m:
+                        status = m
+                        continue
+                _show_line(line, show_line)
+        if status is not None:
+            now = time.time()
+            if now - last_refresh_time >= refresh_interval:
+                show_progress(int(status.group(1)), int(status.group(2)))
+                status = None
+                last_refresh_time = now
+    if partial_line:
+        _show_line(partial_line, show_line)
+    if status is not None:
+        show_progress(int(status.group(1)), int(status.group(2)))
+
+
+def _show_line(line, show_line):
+    line = line.strip()
+    if line:
+        show_line(line.decode('utf-8', 'replace'))
+
+
+def _check_ninja_log_header(head):
+    """Check whether the format of the ninja log is supported."""
+    m = _NINJA_LOG_HEADER_RE.match(head)
+    if not m or int(m.group(1)) < _NINJA_LOG_MIN_VERSION:
+        console.warning('Unknown ninja log version: %s' % head)
+        return False
+    return True
+
+
+def ninja_log_position(ninja_log):
+    """Return the position of the end of the ninja log, or None if it doesn't exist."""
+    try:
+        st = os.stat(ninja_log)
+        return st.st_ino, st.st_size
+    except OSError:
+        return None
+
+
+def read_ninja_log(ninja_log, position=None, end_position=None):
+    """Read the entries appended to the ninja log after the position.
+
+    Args:
+        position: the position returned by the last reading or `ninja_log_position`,
+            or None to read all entries.
+        end_position: the position to stop reading at, or None to read to the end.
+
+    Returns:
+        (entries, position, rewritten), the entries are a list of NinjaLogEntry in the order
+        of finishing, the position is of the end of the entries, and the rewritten is whether
+        the log was rewritten after the position, such as recompacted by ninja, in which case
+        all entries in the log are returned.
+    """
+    end = ninja_log_position(ninja_log)
+    if end is None:
+        return [], None, False
+    rewritten = position is not None and (end[0] != position[0] or end[1] < position[1])
+    offset = position[1] if position is not None and not rewritten else 0
+    with open(ninja_log, 'rb') as f:
+        f.seek(offset)
+        if end_position is not None and end_position[0] == end[0]:
+            data = f.read(max(end_position[1] - offset, 0))
+        else:
+            data = f.read()
+    # Ignore the incomplete last line
+    data = data[:data.rfind(b'\n') + 1]
+    position = (end[0], offset + len(data))
+    lines = data.decode('utf-8', 'replace').splitlines()
+    if offset == 0 and lines:
+        if not _check_ninja_log_header(lines[0]):
+            return [], position, rewritten
+        del lines[0]
+    entries = []
+    for line in lines:
+        fields = line.split('\t')
+        if len(fields) != 5 or line.startswith('#'):
+            continue
+        start_ms, end_ms, mtime, output, cmdhash = fields
+        entries.append(NinjaLogEntry(int(start_ms), int(end_ms), mtime, output, cmdhash))
+    return entries, position, rewritten
+
+
+def _trace_ninja_actions(ninja_log, position, build_start_time):
+    """Add the ninja actions of the last build into the trace."""
+    entries, _, rewritten = read_ninja_log(ninja_log, position)
+    if rewritten:
+        console.debug('Actions of the last build are not traced because the ninja log is rewritten')
+        return
+    actions = {}  # dict{(start, end, cmdhash): outputs}, an action may have multiple outputs
+    for entry in entries:
+        actions.setdefault((entry.start_ms, entry.end_ms, entry.cmdhash), []).append(entry.output)
+    events = []
+    for (start_ms, end_ms, _), outputs in actions.items():
+        # The times in the ninja log are relative to the start of ninja
+        events.append((outputs[0], 'ninja',
+                       build_start_time + start_ms / 1000.0, build_start_time + end_ms / 1000.0,
+                       {'outputs': outputs} if len(outputs) > 1 else None))
+    trace.add_lane_events('ninja', events)
@@ -0,0 +1,54 @@
+# Copyright (c) 2021 Tencent Inc.
+# All rights reserved.
+#
+# Author: chen3feng <chen3feng@gmail.com>
+# Date:   2021-09-04
+
+"""
+Run a command and record its peak RSS.
+
+It wraps the compiler in the compile rules when `cc_config.compile_memory_profiling` is
+enabled. The peak RSS of the command is appended to the log file as a line of
+"output<TAB>bytes", which is ingested into the build time history after the build.
+
+To reduce the startup time, it only imports the necessary standard modules and can
+be run as a standalone script without importing the `blade` package.
+
+Usage:
+    peak_rss.py <log file> <output> <command> [args...]
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import resource
+import sys
+
+
+def _peak_rss():
+    """The peak RSS in bytes of the largest waited child process."""
+    peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # It is in bytes on macOS and in kilobytes on Linux
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def main():
+    log_file, output, command = sys.argv[1], sys.argv[2], sys.argv[3:]
+    returncode = os.spawnvp(os.P_WAIT, command[0], command)
+    if returncode < 0:  # Killed by a signal
+        returncode = 128 - returncode
+    try:
+        # A short line written in the append mode by one `write` is not interleaved with others
+        fd = os.open(log_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, ('%s\t%d\n' % (output, _peak_rss())).encode('utf-8'))
+        finally:
+            os.close(fd)
+    except (IOError, OSError):
+        pass  # Profiling is optional, never fail the compile
+    sys.exit(returncode)
+
+
+if __name__ == '__main__':
+    main()
@@ -283,6 +283,9 @@ class PythonTest(PythonBinary):
                  main,
                  base,
                  testdata,
+                 cpu,
+                 memory,
+                 flaky,
                  kwargs):
         """Init method."""
         super(PythonTest, self).__init__(
@@ -298,6 +301,8 @@ class PythonTest(PythonBinary):
         self.type = 'py_test'
         self.attr['testdata'] = testdata
         self._add_tags('type:test')
+        self._set_test_resources(cpu, memory)
+        self.attr['flaky'] = flaky
 
 
 def py_test(name=None,
@@ -308,6 +313,9 @@ def py_test(name=None,
             main=None,
             base=None,
             testdata=[],
+            cpu=1,
+            memory=None,
+            flaky=False,
             **kwargs):
     """python test."""
     target = PythonTest(
@@ -319,6 +327,9 @@ def py_test(name=None,
             main=main,
             base=base,
             testdata=testdata,
+            cpu=cpu,
+            memory=memory,
+            flaky=flaky,
             kwargs=kwargs)
     build_manager.instance.register_target(target)
 
@@ -0,0 +1,167 @@
+# Copyright (c) 2021 Tencent Inc.
+# All rights reserved.
+#
+# Author: chen3feng <chen3feng@gmail.com>
+# Date:   2021-07-31
+
+"""
+Incremental runfiles tree.
+
+The runfiles dir of a binary or test is kept between runs. Before each run, it is synchronized
+with the manifest of the expected entries, only the entries whose sources changed are copied
+again, and the files not in the manifest, such as the ones written by the last run, are removed.
+
+The state of the last synchronization is stored in the `<runfiles dir>.manifest` file beside
+the runfiles dir, so it is not visible to the running program.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import json
+import os
+import shutil
+
+from blade import console
+
+
+# Increase this number if the format of the state file is changed.
+_VERSION = 1
+
+
+def _state_file(runfiles_dir):
+    return runfiles_dir + '.manifest'
+
+
+def _load_state(runfiles_dir):
+    try:
+        with open(_state_file(runfiles_dir)) as f:
+            state = json.load(f)
+        if state.get('version') == _VERSION:
+            return state['entries']
+    except (IOError, OSError, ValueError):
+        pass
+    return {}
+
+
+def _save_state(runfiles_dir, entries):
+    path = _state_file(runfiles_dir)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': _VERSION, 'entries': entries}, f)
+    os.rename(tmp_path, path)
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _file_signature(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime]
+
+
+def expand_dir(src, dest):
+    """Expand a source dir into the entries of the manifest.
+
+    The symbolic links to dirs are followed, as `shutil.copytree` does, except the ones
+    point to the dir itself or its ancestors, which would be expanded endlessly.
+
+    Returns:
+        list of (dest path, (kind, src path)) of the dir itself and all dirs and files under it.
+    """
+    result = []
+    for root, dirs, files in os.walk(src, followlinks=True):
+        real_root = os.path.realpath(root)
+        for name in list(dirs):
+            real_dir = os.path.realpath(os.path.join(root, name))
+            if real_root == real_dir or real_root.startswith(real_dir + os.sep):
+                console.warning('Symbolic link loop "%s" in testdata is ignored' %
+                                os.path.join(root, name))
+                dirs.remove(name)
+        dirs.sort()
+        dest_root = os.path.normpath(os.path.join(dest, os.path.relpath(root, src)))
+        result.append((dest_root, ('dir', root)))
+        for name in sorted(files):
+            result.append((os.path.join(dest_root, name), ('copy', os.path.join(root, name))))
+    return result
+
+
+def _remove_unexpected(runfiles_dir, manifest):
+    """Remove the files and dirs which are not in the manifest."""
+    expected_dirs = set()
+    for dest in manifest:
+        parent = os.path.dirname(dest)
+        while parent and parent not in expected_dirs:
+            expected_dirs.add(parent)
+            parent = os.path.dirname(parent)
+    expected_dirs.update(dest for dest, (kind, _) in manifest.items() if kind == 'dir')
+    for root, dirs, files in os.walk(runfiles_dir):
+        rel_root = os.path.relpath(root, runfiles_dir)
+        for name in list(dirs):
+            rel_path = os.path.normpath(os.path.join(rel_root, name))
+            path = os.path.join(root, name)
+            if rel_path in expected_dirs and not os.path.islink(path):
+                continue
+            dirs.remove(name)  # Don't walk into it
+            if rel_path not in manifest:
+                _remove(path)
+        for name in files:
+            rel_path = os.path.normpath(os.path.join(rel_root, name))
+            if rel_path not in manifest or manifest[rel_path][0] == 'dir':
+                os.remove(os.path.join(root, name))
+
+
+def _sync_entry(path, kind, src, old_entry):
+    """Synchronize an entry, return whether it is updated."""
+    if kind == 'link':
+        if os.path.islink(path) and os.readlink(path) == src:
+            return False
+        _remove(path)
+        os.symlink(src, path)
+        return True
+    if kind == 'dir':
+        if os.path.isdir(path) and not os.path.islink(path):
+            return False
+        _remove(path)
+        os.mkdir(path)
+        return True
+    signature = _file_signature(src)
+    if (old_entry == [kind, src, signature] and not os.path.islink(path) and
+            os.path.isfile(path) and _file_signature(path) == signature):
+        return False
+    _remove(path)
+    shutil.copy2(src, path)
+    return True
+
+
+def sync(runfiles_dir, manifest):
+    """Synchronize the runfiles dir with the manifest.
+
+    Args:
+        manifest: dict{dest: (kind, src)}, dest is the relative path in the runfiles dir,
+            kind can be 'link' for a symbolic link to src, 'copy' for a copy of the file src,
+            or 'dir' for a dir.
+    """
+    old_entries = _load_state(runfiles_dir)
+    if not os.path.isdir(runfiles_dir):
+        _remove(runfiles_dir)
+        os.makedirs(runfiles_dir)
+        old_entries = {}
+    _remove_unexpected(runfiles_dir, manifest)
+    entries = {}
+    updated = 0
+    for dest in sorted(manifest):
+        kind, src = manifest[dest]
+        path = os.path.join(runfiles_dir, dest)
+        parent = os.path.dirname(path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        if _sync_entry(path, kind, src, old_entries.get(dest)):
+            updated += 1
+        entries[dest] = [kind, src, _file_signature(src) if kind == 'copy' else None]
+    _save_state(runfiles_dir, entries)
+    console.debug('Runfiles %s: %d of %d entries updated' % (runfiles_dir, updated, len(manifest)))
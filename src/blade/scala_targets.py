@@ -197,6 +197,9 @@ class ScalaTest(ScalaFatLibrary):
             warnings,
             exclusions,
             testdata,
+            cpu,
+            memory,
+            flaky,
             kwargs):
         super(ScalaTest, self).__init__(
                 name=name,
@@ -212,6 +215,8 @@ class ScalaTest(ScalaFatLibrary):
         self.type = 'scala_test'
         self.attr['testdata'] = var_to_list(testdata)
         self._add_tags('type:test')
+        self._set_test_resources(cpu, memory)
+        self.attr['flaky'] = flaky
 
         if not self.srcs:
             self.warning('Empty scala test sources.')
@@ -298,6 +303,9 @@ def scala_test(name=None,
                warnings=None,
                exclusions=[],
                testdata=[],
+               cpu=1,
+               memory=None,
+               flaky=False,
                **kwargs):
     """Build a scala test target
     Args:
@@ -313,6 +321,9 @@ def scala_test(name=None,
                        warnings=warnings,
                        exclusions=exclusions,
                        testdata=testdata,
+                       cpu=cpu,
+                       memory=memory,
+                       flaky=flaky,
                        kwargs=kwargs)
     build_manager.instance.register_target(target)
 
@@ -0,0 +1,669 @@
+# Copyright (c) 2021 Tencent Inc.
+# All rights reserved.
+#
+# Author: chen3feng <chen3feng@gmail.com>
+# Date:   2021-06-12
+
+"""
+The resident blade server.
+
+Loading BUILD files and analyzing the dependency graph are the most expensive part of a no-op
+build. The blade server keeps them hot between commands:
+
+* The server process listens on a UNIX socket in the workspace. It never loads any BUILD files,
+  so it can be forked as clean processes.
+* For each distinct request (working dir, command line and environment), a warm process is forked,
+  which loads and analyzes the targets once, then keeps them in memory.
+* For each request, the warm process checks whether the BUILD files, the extensions, the glob results
+  and the config files are changed. If not, it forks a child with the hot states to run the rest of
+  the command, with the stdio of the client, otherwise the warm process is dropped and a new one is
+  forked.
+
+The `blade` command sends the request to the server if it is running in the workspace, otherwise
+runs it locally.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import array
+import errno
+import json
+import os
+import signal
+import socket
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from blade import util
+
+
+# Commands can be served by the server. `run` is excluded because the program may read the
+# terminal, which is not allowed in the background process group.
+_SERVED_COMMANDS = frozenset(['build', 'test', 'query', 'dump', 'clean'])
+
+# Max number of warm processes, the least recently used one is dropped if exceeded.
+_MAX_WARM_PROCESSES = 4
+
+# Environment variables which change frequently but don't affect the building.
+_VOLATILE_ENVS = frozenset(['_', 'OLDPWD', 'SHLVL'])
+
+_MESSAGE_HEADER = struct.Struct('!I')
+
+# Number of fds of the stdio
+_STDIO_FDS = 3
+
+
+def _supported():
+    return sys.version_info[0] == 3 and hasattr(socket, 'AF_UNIX')
+
+
+def _find_root_dir(working_dir):
+    blade_root = util.find_file_bottom_up('BLADE_ROOT', from_dir=working_dir)
+    return os.path.dirname(blade_root) if blade_root else ''
+
+
+def _server_dir_path():
+    base_dir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(base_dir, 'blade-server-%s' % os.getuid())
+
+
+def _server_dir(create):
+    """The private dir of the server files of the current user, or None if it is unavailable.
+
+    It is not in the workspace due to the length limit of the UNIX socket path. Other users must
+    not be able to access it, otherwise they could create the socket to capture the environment
+    variables and the terminal of the client.
+    """
+    path = _server_dir_path()
+    if create:
+        try:
+            os.mkdir(path, 0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                return None
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        return None
+    return path
+
+
+def _server_file(root_dir, suffix, create=False):
+    """Path of server files, such as the socket, or None if the server dir is unavailable."""
+    server_dir = _server_dir(create)
+    if server_dir is None:
+        return None
+    return os.path.join(server_dir, '%s%s' % (util.md5sum(root_dir)[:16], suffix))
+
+
+def socket_path(root_dir, create=False):
+    """Path of the socket of the server of the workspace."""
+    return _server_file(root_dir, '.sock', create)
+
+
+def _peer_uid(sock):
+    """The uid of the process on the other end of the socket, or None if it is unknown."""
+    if not hasattr(socket, 'SO_PEERCRED'):  # Not Linux
+        return None
+    creds = struct.Struct('3i')
+    _, uid, _ = creds.unpack(sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, creds.size))
+    return uid
+
+
+def _is_peer_trusted(sock):
+    uid = _peer_uid(sock)
+    return uid is None or uid == os.getuid()
+
+
+def _blade_stamp(blade_path):
+    """Stamp to identify changes of blade itself."""
+    try:
+        return os.stat(os.path.join(blade_path, 'blade') if os.path.isdir(blade_path) else blade_path).st_mtime
+    except OSError:
+        return None
+
+
+##############################################################################
+# Messages
+##############################################################################
+
+
+def _send_message(sock, message, fds=()):
+    """Send a json message, optionally with file descriptors."""
+    data = json.dumps(message).encode('utf-8')
+    data = _MESSAGE_HEADER.pack(len(data)) + data
+    if fds:
+        sent = sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))])
+        data = data[sent:]
+    if data:
+        sock.sendall(data)
+
+
+def _recv_exactly(sock, size, fds, max_fds):
+    """Receive exactly size bytes, the received file descriptors are appended into fds."""
+    result = b''
+    while len(result) < size:
+        if max_fds:
+            int_size = array.array('i').itemsize
+            data, ancdata, _, _ = sock.recvmsg(size - len(result), socket.CMSG_SPACE(max_fds * int_size))
+            for level, type, cmsg_data in ancdata:
+                if level == socket.SOL_SOCKET and type == socket.SCM_RIGHTS:
+                    received = array.array('i')
+                    received.frombytes(cmsg_data[:len(cmsg_data) - len(cmsg_data) % int_size])
+                    fds.extend(received)
+        else:
+            data = sock.recv(size - len(result))
+        if not data:
+            raise EOFError('Connection closed')
+        result += data
+    return result
+
+
+def _recv_message(sock, max_fds=0):
+    """Receive a json message and the file descriptors sent with it."""
+    fds = []
+    header = _recv_exactly(sock, _MESSAGE_HEADER.size, fds, max_fds)
+    size = _MESSAGE_HEADER.unpack(header)[0]
+    message = json.loads(_recv_exactly(sock, size, fds, max_fds).decode('utf-8'))
+    return message, fds
+
+
+def _close_fds(fds):
+    for fd in fds:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+##############################################################################
+# Client
+##############################################################################
+
+
+def _get_cwd():
+    """Return the logical current working dir, same as `util.get_cwd` but faster."""
+    cwd = os.getcwd()
+    pwd = os.environ.get('PWD')
+    if pwd and os.path.isdir(pwd) and os.path.samefile(pwd, cwd):
+        return pwd
+    return cwd
+
+
+def _connect(root_dir):
+    path = socket_path(root_dir)
+    if path is None:
+        return None
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        if not _is_peer_trusted(sock):
+            sock.close()
+            return None
+    except (IOError, OSError):
+        sock.close()
+        return None
+    return sock
+
+
+def run_client(argv):
+    """Run the command in the server if it is running.
+
+    Returns:
+        The exit code, or None if it is not served by the server.
+    """
+    if not _supported() or not argv or argv[0] not in _SERVED_COMMANDS:
+        return None
+    if os.environ.get('BLADE_NO_SERVER'):
+        return None
+    cwd = _get_cwd()
+    root_dir = _find_root_dir(cwd)
+    if not root_dir:
+        return None
+    sock = _connect(root_dir)
+    if sock is None:
+        return None
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        request = {'cwd': cwd, 'argv': argv, 'env': dict(os.environ)}
+        _send_message(sock, request, fds=list(range(_STDIO_FDS)))
+        while True:
+            try:
+                response = _recv_message(sock)[0]
+                break
+            except KeyboardInterrupt:
+                # Ask the server to interrupt the command, and wait for its exit.
+                sock.sendall(b'\0')
+    except (EOFError, IOError, OSError):
+        return None
+    finally:
+        sock.close()
+    if 'exit_code' not in response:
+        # Such as the server is outdated, run locally.
+        return None
+    return response['exit_code']
+
+
+##############################################################################
+# Server
+##############################################################################
+
+
+def _request_key(request):
+    env = sorted((k, v) for k, v in request['env'].items() if k not in _VOLATILE_ENVS)
+    return util.md5sum(json.dumps([request['cwd'], request['argv'], env]))
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+def _redirect_stdio(fds):
+    """Redirect the stdio to fds."""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    for i, fd in enumerate(fds):
+        os.dup2(fd, i)
+
+
+def _redirect_stdio_to_devnull():
+    devnull = os.open(os.devnull, os.O_RDWR)
+    _redirect_stdio([devnull] * _STDIO_FDS)
+    os.close(devnull)
+
+
+class _Session(object):
+    """The loaded and analyzed states of a request, holds by the warm process."""
+
+    def __init__(self, blade_path, request):
+        self.blade_path = blade_path
+        self.request = request
+        self.command = None
+        self.options = None
+        self.workspace = None
+        self.builder = None
+        self.start_time = time.time()
+        # Whether the states can be reused by later requests.
+        self.reusable = False
+        self.__config_stamps = {}
+
+    def prepare(self):
+        """Load and analyze the targets. Return the exit code if the command is finished."""
+        # pylint: disable=import-outside-toplevel
+        from blade import build_manager
+        from blade import config
+        from blade import main
+
+        os.chdir(self.request['cwd'])
+        os.environ.clear()
+        os.environ.update(self.request['env'])
+
+        initialized = main.initialize(self.request['argv'])
+        if initialized is None:
+            return 1
+        self.command, self.options, self.workspace, targets = initialized
+        self.__config_stamps = {path: _file_stamp(path) for path in config.input_files()}
+        if (self.options.profiling or self.options.trace or
+                self.options.stop_after in ('load', 'analyze') or
+                self.command == 'dump' and self.options.dump_config):
+            return main.run(self.blade_path, self.command, self.options, self.workspace, targets)
+
+        lock_id = self.workspace.lock()
+        try:
+            self.builder = build_manager.initialize(
+                self.blade_path, self.command, self.options, self.workspace, targets)
+            returncode = main.run_stages(self.builder, self.options, ['load', 'analyze'])
+            if returncode is not None:
+                return returncode
+        finally:
+            self.workspace.unlock(lock_id)
+        self.reusable = True
+        return None
+
+    def is_unchanged(self):
+        """Whether all inputs of the loaded states are unchanged."""
+        # pylint: disable=import-outside-toplevel
+        from blade import load_build_files
+        for path, stamp in self.__config_stamps.items():
+            if _file_stamp(path) != stamp:
+                return False
+        return load_build_files.build_files_unchanged()
+
+    def run(self, reused):
+        """Run the rest of the command in the served child."""
+        # pylint: disable=import-outside-toplevel
+        from blade import console
+        from blade import main
+        if self.options.color == 'auto':
+            console.enable_color(console.auto_color_enabled())
+        if reused:
+            self.workspace.switch_to_root_dir()
+            console.info('Reuse the loaded targets in the blade server')
+        lock_id = self.workspace.lock()
+        try:
+            returncode = main.run_stages(self.builder, self.options, ['generate'])
+            if returncode is not None:
+                return returncode
+            return main.run_command(self.builder, self.command)
+        finally:
+            self.workspace.unlock(lock_id)
+
+
+def _watch_interruption(conn):
+    """Interrupt the command if the client is interrupted or disconnected."""
+    def watch():
+        try:
+            conn.recv(1)
+        except (IOError, OSError):
+            pass
+        os.killpg(os.getpgid(0), signal.SIGINT)
+    thread = threading.Thread(target=watch)
+    thread.daemon = True
+    thread.start()
+
+
+def _serve(conn, session, reused):
+    """Run the command in the forked child for the client."""
+    # pylint: disable=import-outside-toplevel
+    from blade import console
+    from blade import main
+    os.setpgid(0, 0)
+    _watch_interruption(conn)
+    exit_code = main.run_main(lambda: session.run(reused), session.start_time)
+    console.flush()
+    try:
+        _send_message(conn, {'exit_code': exit_code})
+    except (IOError, OSError):
+        pass
+
+
+def _fork_serving_child(conn, fds, session, reused):
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        _redirect_stdio(fds)
+        try:
+            _serve(conn, session, reused)
+        finally:
+            os._exit(0)
+
+
+def _warm_main(channel, blade_path, request, conn, fds):
+    """Main loop of the warm process."""
+    # pylint: disable=import-outside-toplevel
+    from blade import console
+    from blade import main
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    _redirect_stdio(fds)
+    session = _Session(blade_path, request)
+    exit_code = main.run_main(session.prepare, session.start_time)
+    if exit_code is not None:
+        # Finished or failed in preparing.
+        console.flush()
+        _send_message(conn, {'exit_code': exit_code})
+        return
+    # Reap the serving children automatically.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    _fork_serving_child(conn, fds, session, reused=False)
+    conn.close()
+    _close_fds(fds)
+    _redirect_stdio_to_devnull()
+    if not session.reusable:
+        return
+
+    while True:
+        try:
+            request, fds = _recv_message(channel, max_fds=1 + _STDIO_FDS)
+        except EOFError:
+            return
+        conn = socket.socket(fileno=fds[0])
+        session.start_time = time.time()
+        unchanged = session.is_unchanged()
+        if unchanged:
+            _fork_serving_child(conn, fds[1:], session, reused=True)
+        _send_message(channel, {'status': 'ok' if unchanged else 'stale'})
+        conn.close()
+        _close_fds(fds[1:])
+        if not unchanged:
+            return
+
+
+class _WarmProcess(object):
+    """The handle of a warm process in the server."""
+
+    def __init__(self, pid, channel):
+        self.pid = pid
+        self.channel = channel
+
+    @staticmethod
+    def start(blade_path, request, conn, fds, inherited_sockets):
+        """Fork a warm process to prepare the states and serve the first request."""
+        parent_channel, child_channel = socket.socketpair()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                for sock in inherited_sockets + [parent_channel]:
+                    sock.close()
+                _warm_main(child_channel, blade_path, request, conn, fds)
+            finally:
+                os._exit(0)
+        child_channel.close()
+        return _WarmProcess(pid, parent_channel)
+
+    def serve(self, request, conn, fds):
+        """Send the request to the warm process, return whether it is served."""
+        try:
+            _send_message(self.channel, request, fds=[conn.fileno()] + fds)
+            response = _recv_message(self.channel)[0]
+        except (EOFError, IOError, OSError):
+            return False
+        return response.get('status') == 'ok'
+
+    def stop(self):
+        self.channel.close()
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+
+class _Server(object):
+    """The blade server."""
+
+    def __init__(self, blade_path, root_dir):
+        self.__blade_path = blade_path
+        self.__blade_stamp = _blade_stamp(blade_path)
+        self.__socket_path = socket_path(root_dir, create=True)
+        self.__socket = None
+        # The warm processes, in the least recently used order
+        self.__warm_processes = {}
+        self.__warm_keys = []
+        self.__requests = 0
+
+    def serve_forever(self):
+        # pylint: disable=import-outside-toplevel,unused-import
+        # Import the modules before forking warm processes.
+        from blade import build_manager, load_build_files, main
+        if os.path.exists(self.__socket_path):
+            os.remove(self.__socket_path)
+        old_umask = os.umask(0o077)
+        try:
+            self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.__socket.bind(self.__socket_path)
+        finally:
+            os.umask(old_umask)
+        self.__socket.listen(16)
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        print('Blade server is listening on %s' % self.__socket_path)
+        sys.stdout.flush()
+        try:
+            while True:
+                conn = self.__socket.accept()[0]
+                try:
+                    if not _is_peer_trusted(conn):
+                        print('Reject the request from another user')
+                        continue
+                    if not self._handle(conn):
+                        break
+                except (EOFError, IOError, OSError) as e:
+                    print('Error in handling request: %s' % e)
+                finally:
+                    conn.close()
+                sys.stdout.flush()
+        finally:
+            self._shutdown()
+
+    def _shutdown(self):
+        for warm in self.__warm_processes.values():
+            warm.stop()
+        self.__socket.close()
+        if os.path.exists(self.__socket_path):
+            os.remove(self.__socket_path)
+
+    def _handle(self, conn):
+        """Handle a request, return False to stop the server."""
+        request, fds = _recv_message(conn, max_fds=_STDIO_FDS)
+        try:
+            command = request.get('command')
+            if command == 'stop':
+                _send_message(conn, {'status': 'stopped'})
+                return False
+            if command == 'status':
+                _send_message(conn, {'pid': os.getpid(), 'requests': self.__requests,
+                                     'warm_processes': len(self.__warm_processes)})
+                return True
+            if _blade_stamp(self.__blade_path) != self.__blade_stamp:
+                print('Blade is changed, exit')
+                _send_message(conn, {'status': 'outdated'})
+                return False
+            self.__requests += 1
+            self._dispatch(request, conn, fds)
+        finally:
+            _close_fds(fds)
+        return True
+
+    def _dispatch(self, request, conn, fds):
+        key = _request_key(request)
+        warm = self.__warm_processes.pop(key, None)
+        if key in self.__warm_keys:
+            self.__warm_keys.remove(key)
+        if warm is not None:
+            if warm.serve(request, conn, fds):
+                print('Request %s is served by the warm process %s' % (self.__requests, warm.pid))
+                self._add_warm_process(key, warm)
+                return
+            warm.stop()
+        inherited_sockets = [self.__socket] + [w.channel for w in self.__warm_processes.values()]
+        warm = _WarmProcess.start(self.__blade_path, request, conn, fds, inherited_sockets)
+        print('Request %s is served by the new warm process %s' % (self.__requests, warm.pid))
+        self._add_warm_process(key, warm)
+
+    def _add_warm_process(self, key, warm):
+        self.__warm_processes[key] = warm
+        self.__warm_keys.append(key)
+        while len(self.__warm_keys) > _MAX_WARM_PROCESSES:
+            self.__warm_processes.pop(self.__warm_keys.pop(0)).stop()
+
+
+def _daemonize(log_file):
+    """Detach from the terminal and redirect the outputs to the log file."""
+    if os.fork() > 0:
+        return False
+    os.setsid()
+    if os.fork() > 0:
+        os._exit(0)
+    fd = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    _redirect_stdio([devnull, fd, fd])
+    os.close(fd)
+    os.close(devnull)
+    return True
+
+
+def _request_server(root_dir, command):
+    sock = _connect(root_dir)
+    if sock is None:
+        return None
+    try:
+        _send_message(sock, {'command': command})
+        return _recv_message(sock)[0]
+    except (EOFError, IOError, OSError):
+        return None
+    finally:
+        sock.close()
+
+
+def run_server(blade_path, options):
+    """Entry of the `blade server` command."""
+    # pylint: disable=import-outside-toplevel
+    from blade import console
+    if not _supported():
+        console.fatal('The blade server requires python 3')
+    root_dir = _find_root_dir(util.get_cwd())
+    if not root_dir:
+        console.fatal("Can't find the file 'BLADE_ROOT' in this or any upper directory.")
+
+    status = _request_server(root_dir, 'status')
+    if options.server_action == 'status':
+        if status is None:
+            console.output('Blade server is not running')
+            return 1
+        console.output('Blade server is running, pid %s, %s requests served, %s warm processes' % (
+            status['pid'], status['requests'], status['warm_processes']))
+        return 0
+    if options.server_action == 'stop':
+        if status is None:
+            console.warning('Blade server is not running')
+            return 0
+        _request_server(root_dir, 'stop')
+        console.info('Blade server is stopped')
+        return 0
+
+    if status is not None:
+        console.warning('Blade server is already running, pid %s' % status['pid'])
+        return 0
+    if socket_path(root_dir, create=True) is None:
+        console.fatal('The blade server dir "%s" is not private to the current user' %
+                      _server_dir_path())
+    os.chdir(root_dir)
+    server = _Server(blade_path, root_dir)
+    if options.foreground:
+        server.serve_forever()
+        return 0
+    log_file = _server_file(root_dir, '.log')
+    if _daemonize(log_file):
+        try:
+            server.serve_forever()
+        finally:
+            os._exit(0)
+    # Wait for the server to be ready.
+    for _ in range(50):
+        if _request_server(root_dir, 'status') is not None:
+            console.info('Blade server is started, log is in %s' % log_file)
+            return 0
+        time.sleep(0.1)
+    console.error('Failed to start the blade server, see %s for details' % log_file)
+    return 1
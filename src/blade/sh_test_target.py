@@ -39,6 +39,9 @@ class ShellTest(Target):
                  visibility,
                  tags,
                  testdata,
+                 cpu,
+                 memory,
+                 flaky,
                  kwargs):
         srcs = var_to_list(srcs)
         deps = var_to_list(deps)
@@ -56,6 +59,8 @@ class ShellTest(Target):
 
         self._add_tags('lang:sh', 'type:test')
         self._process_test_data(testdata)
+        self._set_test_resources(cpu, memory)
+        self.attr['flaky'] = flaky
 
     def _process_test_data(self, testdata):
         """
@@ -107,6 +112,9 @@ def sh_test(name=None,
             visibility=None,
             tags=[],
             testdata=[],
+            cpu=1,
+            memory=None,
+            flaky=False,
             **kwargs):
     build_manager.instance.register_target(ShellTest(
             name=name,
@@ -115,6 +123,9 @@ def sh_test(name=None,
             visibility=visibility,
             tags=[],
             testdata=testdata,
+            cpu=cpu,
+            memory=memory,
+            flaky=flaky,
             kwargs=kwargs))
 
 
@@ -0,0 +1,177 @@
+# Copyright (c) 2021 Tencent Inc.
+# All rights reserved.
+#
+# Author: chen3feng <chen3feng@gmail.com>
+# Date:   2021-07-03
+
+"""
+Sorted string tables file.
+
+A file contains several tables, each table maps string keys to string values. The entries of
+a table are sorted by key and indexed by an offsets array, so a key can be looked up by binary
+search on the memory mapped file, which only touches the few pages it needs, without loading
+and deserializing the whole file.
+
+File layout, all integers are little endian:
+
+    header:  magic(8s) version(I) table_count(I)
+    tables:  [table_offset(Q) entry_count(I)] * table_count
+    each table:
+        offsets: [entry_offset(Q)] * (entry_count + 1)
+        entries: [key '\\0' value] * entry_count
+
+The entry i spans [offsets[i], offsets[i + 1]) of the file.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import mmap
+import os
+import struct
+
+
+_MAGIC = b'BLADESST'
+
+# Increase this number if the format of the file is changed.
+_VERSION = 1
+
+_HEADER = struct.Struct('<8sII')
+_TABLE_HEADER = struct.Struct('<QI')
+_OFFSET = struct.Struct('<Q')
+
+
+def _encode(text):
+    if isinstance(text, bytes):
+        return text
+    return text.encode('utf-8')
+
+
+def dumps(tables):
+    """Serialize the tables into bytes.
+
+    Args:
+        tables: list of dict{str: str}, keys must not contain '\\0'.
+    """
+    sorted_tables = [sorted((_encode(k), _encode(v)) for k, v in table.items()) for table in tables]
+    table_offset = _HEADER.size + _TABLE_HEADER.size * len(tables)
+    headers = [_HEADER.pack(_MAGIC, _VERSION, len(tables))]
+    bodies = []
+    for entries in sorted_tables:
+        headers.append(_TABLE_HEADER.pack(table_offset, len(entries)))
+        offset = table_offset + _OFFSET.size * (len(entries) + 1)
+        offsets = []
+        for key, value in entries:
+            offsets.append(_OFFSET.pack(offset))
+            offset += len(key) + 1 + len(value)
+        offsets.append(_OFFSET.pack(offset))
+        bodies += offsets
+        for key, value in entries:
+            bodies += [key, b'\0', value]
+        table_offset = offset
+    return b''.join(headers + bodies)
+
+
+def write_file(path, tables):
+    """Write the tables into file, keep it untouched if the content is unchanged.
+
+    Returns:
+        bool, whether the file is written.
+    """
+    content = dumps(tables)
+    try:
+        if os.path.getsize(path) == len(content):
+            with open(path, 'rb') as f:
+                if f.read() == content:
+                    return False
+    except (IOError, OSError):
+        pass
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.rename(tmp_path, path)
+    return True
+
+
+class Table(object):
+    """A readonly string table in the memory mapped file."""
+
+    def __init__(self, data, offset, count):
+        self.__data = data
+        self.__offset = offset
+        self.__count = count
+
+    def __len__(self):
+        return self.__count
+
+    def __entry_range(self, index):
+        start = _OFFSET.unpack_from(self.__data, self.__offset + _OFFSET.size * index)[0]
+        end = _OFFSET.unpack_from(self.__data, self.__offset + _OFFSET.size * (index + 1))[0]
+        return start, end
+
+    def __key_end(self, start, end):
+        return self.__data.find(b'\0', start, end)
+
+    def get(self, key, default=None):
+        """Return the value of the key as str, or default if it doesn't exist.
+
+        Raise ValueError if the entry is corrupted.
+        """
+        key = _encode(key)
+        low, high = 0, self.__count
+        while low < high:
+            mid = (low + high) // 2
+            start, end = self.__entry_range(mid)
+            key_end = self.__key_end(start, end)
+            if key_end == -1:
+                raise ValueError('Corrupted string table entry at %d' % start)
+            mid_key = self.__data[start:key_end]
+            if mid_key == key:
+                return self.__data[key_end + 1:end].decode('utf-8')
+            if mid_key < key:
+                low = mid + 1
+            else:
+                high = mid
+        return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+
+class StringTableFile(object):
+    """Read the sorted string tables file by mmap."""
+
+    def __init__(self, path):
+        """Open the file, raise ValueError if it is not a valid string tables file."""
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < _HEADER.size:  # mmap fails on the empty file
+                raise ValueError('%s is not a valid string table file' % path)
+            self.__data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.__tables = self.__load_tables()
+        except (struct.error, ValueError):
+            self.close()
+            raise ValueError('%s is not a valid string table file' % path)
+
+    def __load_tables(self):
+        """Load and verify the table headers, the entries are verified lazily when accessed."""
+        size = len(self.__data)
+        magic, version, table_count = _HEADER.unpack_from(self.__data, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError('Bad magic or version')
+        tables = []
+        for i in range(table_count):
+            offset, count = _TABLE_HEADER.unpack_from(self.__data, _HEADER.size + _TABLE_HEADER.size * i)
+            # The last entry offset is the end of the table, which must be in the file
+            end = _OFFSET.unpack_from(self.__data, offset + _OFFSET.size * count)[0]
+            if end > size:
+                raise ValueError('Truncated table')
+            tables.append(Table(self.__data, offset, count))
+        return tables
+
+    def table(self, index):
+        return self.__tables[index]
+
+    def close(self):
+        self.__data.close()
@@ -17,9 +17,10 @@ import re
 
 from blade import config
 from blade import console
+from blade import dependency_analyzer
 from blade import target_pattern
 from blade import target_tags
-from blade.util import var_to_list, iteritems, source_location, md5sum
+from blade.util import var_to_list, iteritems, source_location, md5sum, parse_memory_size
 
 
 def _is_likely_concatenated_filenames(string, exts):
@@ -144,11 +145,11 @@ class Target(object):
         self.deps = []
 
         # Expanded dependencies, includes direct and indirect dependies.
-        self.expanded_deps = []    # Provide type info then make lints happy(not-an-iterable).
-        self.expanded_deps = None  # Set to None to indicate not constructed.
+        # They are filled by the dependency analyzer, or expanded lazily when they are accessed.
+        self.__expanded_deps = None
+        self.__expanded_dependents = None
 
         self.dependents = set()  # Target keys which depends on this
-        self.expanded_dependents = set()  # Expanded target keys which depends on this
         self._implicit_deps = set()
         self._visibility = set()
         self._visibility_is_default = True
@@ -197,6 +198,29 @@ class Target(object):
         target.update({k: v for k, v in self.attr.items() if not k.startswith('_')})
         return target
 
+    @property
+    def expanded_deps(self):
+        """Keys of all targets depended by this target directly and indirectly, in link order."""
+        if self.__expanded_deps is None:
+            self.__expanded_deps = dependency_analyzer.expand_target_deps(self.key, self.target_database)
+        return self.__expanded_deps
+
+    @expanded_deps.setter
+    def expanded_deps(self, value):
+        self.__expanded_deps = value
+
+    @property
+    def expanded_dependents(self):
+        """Keys of all targets which depend on this target directly and indirectly."""
+        if self.__expanded_dependents is None:
+            self.__expanded_dependents = dependency_analyzer.expand_target_dependents(
+                    self.key, self.target_database)
+        return self.__expanded_dependents
+
+    @expanded_dependents.setter
+    def expanded_dependents(self, value):
+        self.__expanded_dependents = value
+
     def _fingerprint_entropy(self):
         """
         Add more entropy to fingerprint.
@@ -273,6 +297,26 @@ class Target(object):
                 continue
             self.tags.add(tag)
 
+    def _set_test_resources(self, cpu, memory):
+        """Set the resources required to run the test, which are used in the test scheduling.
+
+        Args:
+            cpu: int, number of CPUs.
+            memory: int or str, in bytes or with a 'K', 'M', 'G' or 'T' suffix, such as '8G'.
+        """
+        if cpu != 1:
+            if not isinstance(cpu, int) or cpu < 1:
+                self.error('"cpu" must be a positive integer')
+            else:
+                self.attr['cpu'] = cpu
+        if memory is not None:
+            size = parse_memory_size(memory)
+            if size is None:
+                self.error('Invalid "memory" value "%s", it should be an integer in bytes or '
+                           'a string with a "K", "M", "G" or "T" suffix' % memory)
+            else:
+                self.attr['memory'] = size
+
     def match_tags(self, *tags):
         for tag in tags:
             if tag in self.tags:
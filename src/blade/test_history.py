@@ -0,0 +1,197 @@
+# Copyright (c) 2021 Tencent Inc.
+# All rights reserved.
+#
+# Author: chen3feng <chen3feng@gmail.com>
+# Date:   2021-07-10
+
+"""
+The persistent test history.
+
+The history is the key to implement incremental test, it is stored in a SQLite database
+in the build dir, so a test can be looked up by its key without loading the whole history,
+and only the changed tests are written back after testing.
+
+Besides the last run of each test, the recent runs are also recorded to provide the duration
+and flakiness statistics of the tests.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import sqlite3
+import time
+from collections import namedtuple
+
+from blade import console
+from blade.test_scheduler import TestRunResult
+
+
+_HISTORY_FILE = '.blade.test.history.db'
+
+# Increase this number if the schema of the database is changed.
+_VERSION = 2
+
+# Number of the recent runs to be kept for each test
+_MAX_RUNS_PER_TEST = 20
+
+# Tests not run in this period are dropped from the history, such as the removed ones
+_RETENTION_TIME = 30 * 86400
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS items (
+    key TEXT PRIMARY KEY,
+    job TEXT,
+    first_fail_time REAL,
+    fail_count INTEGER,
+    exit_code INTEGER,
+    start_time REAL,
+    cost_time REAL,
+    flaky INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS runs (
+    key TEXT,
+    start_time REAL,
+    cost_time REAL,
+    exit_code INTEGER,
+    flaky INTEGER DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS runs_key ON runs (key, start_time);
+'''
+
+# Statements to upgrade the database from the previous versions, dict{version: script}
+_UPGRADES = {
+    1: '''
+ALTER TABLE items ADD COLUMN flaky INTEGER DEFAULT 0;
+ALTER TABLE runs ADD COLUMN flaky INTEGER DEFAULT 0;
+''',
+}
+
+
+TestJob = namedtuple('TestJob',
+                     ['reason', 'binary_md5', 'testdata_md5', 'env_md5', 'args'])
+TestHistoryItem = namedtuple('TestHistoryItem', [
+    'job',  # TestJob
+    'first_fail_time',
+    'fail_count',
+    'result',  # TestRunResult
+    'flaky',  # bool, passed after failed and retried in the same run
+])
+
+
+class TestHistory(object):
+    """The test history stored in the build dir."""
+
+    def __init__(self, build_dir):
+        self.__path = os.path.join(build_dir, _HISTORY_FILE)
+        self.__db = None
+        # Cache of the looked up items, dict{key: TestHistoryItem or None}
+        self.__items = {}
+        # Keys of the updated items
+        self.__updated = set()
+        self.env = {}
+
+    def load(self):
+        """Open the database, the history will be empty if it is invalid."""
+        try:
+            self.__db = self._open()
+        except sqlite3.Error as e:
+            console.debug('Exception when loading test history: %s' % e)
+            console.warning('Error loading incremental test history, will run full test')
+            if os.path.exists(self.__path):
+                os.remove(self.__path)
+            self.__db = self._open()
+        row = self.__db.execute("SELECT value FROM meta WHERE name = 'env'").fetchone()
+        if row:
+            self.env = json.loads(row[0])
+
+    def _open(self):
+        db = sqlite3.connect(self.__path)
+        version = db.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, _VERSION) and version not in _UPGRADES:
+            db.close()
+            raise sqlite3.DatabaseError('Unknown test history version %s' % version)
+        if version in _UPGRADES:
+            db.executescript(_UPGRADES[version])
+        db.executescript(_SCHEMA)
+        db.execute('PRAGMA user_version = %d' % _VERSION)
+        return db
+
+    def get(self, key):
+        """Return the TestHistoryItem of the test, or None if it doesn't exist."""
+        if key in self.__items:
+            return self.__items[key]
+        row = self.__db.execute(
+                'SELECT job, first_fail_time, fail_count, exit_code, start_time, cost_time, flaky '
+                'FROM items WHERE key = ?', (key,)).fetchone()
+        item = None
+        if row:
+            job = json.loads(row[0])
+            item = TestHistoryItem(
+                    job=TestJob(**job),
+                    first_fail_time=row[1],
+                    fail_count=row[2],
+                    result=TestRunResult(exit_code=row[3], start_time=row[4], cost_time=row[5]),
+                    flaky=bool(row[6]))
+        self.__items[key] = item
+        return item
+
+    def __getitem__(self, key):
+        item = self.get(key)
+        if item is None:
+            raise KeyError(key)
+        return item
+
+    def __setitem__(self, key, item):
+        self.__items[key] = item
+        self.__updated.add(key)
+
+    def duration_stats(self, key):
+        """Return the (mean, p95) of the running time of the recent runs, or None if no run."""
+        costs = [row[0] for row in self.__db.execute(
+            'SELECT cost_time FROM runs WHERE key = ? ORDER BY cost_time', (key,))]
+        if not costs:
+            return None
+        p95 = costs[min(len(costs) - 1, int(len(costs) * 0.95))]
+        return sum(costs) / len(costs), p95
+
+    def flakiness(self, key):
+        """Return the ratio of the flaky runs in the recent runs, or None if no run."""
+        count, flaky_count = self.__db.execute(
+            'SELECT COUNT(*), SUM(flaky) FROM runs WHERE key = ?', (key,)).fetchone()
+        if not count:
+            return None
+        return flaky_count / count
+
+    def save(self):
+        """Write the updated items back and drop the outdated ones."""
+        with self.__db:
+            self.__db.execute("INSERT OR REPLACE INTO meta VALUES ('env', ?)", (json.dumps(self.env),))
+            for key in self.__updated:
+                item = self.__items[key]
+                result = item.result
+                self.__db.execute(
+                        'INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (key, json.dumps(item.job._asdict()), item.first_fail_time, item.fail_count,
+                         result.exit_code, result.start_time, result.cost_time, int(item.flaky)))
+                if item.job.reason != 'CACHED':  # The cached result is not a new run
+                    self.__db.execute('INSERT INTO runs VALUES (?, ?, ?, ?, ?)',
+                                      (key, result.start_time, result.cost_time, result.exit_code,
+                                       int(item.flaky)))
+                self.__db.execute(
+                        'DELETE FROM runs WHERE key = ? AND start_time < ('
+                        'SELECT start_time FROM runs WHERE key = ? '
+                        'ORDER BY start_time DESC LIMIT 1 OFFSET ?)',
+                        (key, key, _MAX_RUNS_PER_TEST - 1))
+            expire_time = time.time() - _RETENTION_TIME
+            self.__db.execute('DELETE FROM items WHERE start_time < ?', (expire_time,))
+            self.__db.execute('DELETE FROM runs WHERE start_time < ?', (expire_time,))
+        self.__updated.clear()
+
+    def close(self):
+        if self.__db:
+            self.__db.close()
+            self.__db = None
@@ -0,0 +1,143 @@
+# Copyright (c) 2021 Tencent Inc.
+# All rights reserved.
+#
+# Author: chen3feng <chen3feng@gmail.com>
+# Date:   2021-07-24
+
+"""
+Test impact analysis.
+
+Select the tests affected by the changed files, so a pre-merge check can build and run only
+them rather than all tests. The changed files are mapped to their owner targets by the srcs,
+the declared headers and include dirs, the testdata and the BUILD files, and the tests which are
+the owner targets or their dependents are affected.
+
+The config files, the extensions and the included files may affect any target, so all tests are
+affected by them. All tests are also affected if any changed file is owned by no target, such as
+an undeclared header, because the impact of it is unknown.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+
+from blade import cc_targets
+from blade import console
+from blade.util import path_under_dir, run_command
+
+
+def changed_files_since(revision):
+    """Return the files changed since the git revision, relative to the workspace root."""
+    # Both the committed and uncommitted changes are included
+    returncode, stdout, stderr = run_command(
+            ['git', 'diff', '--name-only', '--relative', revision])
+    if returncode != 0:
+        console.fatal('Failed to get the changed files since "%s": %s' % (revision, stderr.strip()))
+    return [line for line in stdout.splitlines() if line]
+
+
+def _testdata_paths(target):
+    """Return the source paths of the testdata of the test target."""
+    paths = []
+    for data in target.attr.get('testdata', []):
+        src = data[0] if isinstance(data, tuple) else data
+        if src.startswith('//'):
+            paths.append(os.path.normpath(src[2:]))
+        else:
+            paths.append(target._source_file_path(src))
+    return paths
+
+
+class TestImpactAnalyzer(object):
+    """Select the affected tests by the changed files."""
+
+    def __init__(self, build_targets, global_files):
+        """
+        Args:
+            global_files: the files which affect all targets, such as the config files.
+        """
+        self.__build_targets = build_targets
+        self.__global_files = set(os.path.normpath(f) for f in global_files)
+        self.__owners = None  # dict{file: set(target key)}
+        self.__testdata_owners = None  # list[(path, target key)], the path may be a dir
+        self.__inc_owners = None  # dict{include dir: set(target key)}
+
+    def _build_owners_map(self):
+        owners = {}
+        testdata_owners = []
+        for key, target in self.__build_targets.items():
+            for src in target.srcs:
+                owners.setdefault(target._source_file_path(src), set()).add(key)
+            owners.setdefault(os.path.join(target.path, 'BUILD'), set()).add(key)
+            if target.type.endswith('_test'):
+                testdata_owners += [(path, key) for path in _testdata_paths(target)]
+        # Reuse the headers to targets maps built for the inclusion check
+        declaration = cc_targets.inclusion_declaration()
+        for name in ('public_hdrs', 'private_hdrs'):
+            for hdr, keys in declaration[name].items():
+                owners.setdefault(hdr, set()).update(keys)
+        self.__owners = owners
+        self.__testdata_owners = testdata_owners
+        self.__inc_owners = dict((os.path.normpath(inc), keys)
+                                 for inc, keys in declaration['public_incs'].items())
+
+    def _owners_of(self, path):
+        """Return the keys of the loaded targets which own the file."""
+        result = set(k for k in self.__owners.get(path, ()) if k in self.__build_targets)
+        for data_path, key in self.__testdata_owners:
+            if path == data_path or path_under_dir(path, data_path):
+                result.add(key)
+        # The headers under the declared include dirs
+        inc = os.path.dirname(path)
+        while inc:
+            result.update(k for k in self.__inc_owners.get(inc, ()) if k in self.__build_targets)
+            inc = os.path.dirname(inc)
+        return result
+
+    def analyze(self, changed_files, tests):
+        """Select the affected ones of the tests.
+
+        Args:
+            changed_files: list of paths relative to the workspace root.
+            tests: the keys of the candidate tests.
+
+        Returns:
+            dict{
+                'changed_files': sorted list,
+                'unowned_files': the changed files owned by no loaded target,
+                'global_files': the changed files which affect all targets,
+                'selected': dict{test key: {'file': the changed file, 'target': its owner}},
+            }
+            All tests are selected with a None target if there are unowned or global files.
+        """
+        if self.__owners is None:
+            self._build_owners_map()
+        tests = set(tests)
+        changed_files = sorted(set(os.path.normpath(f) for f in changed_files))
+        unowned_files = []
+        global_files = []
+        selected = {}
+        for path in changed_files:
+            if path in self.__global_files:
+                global_files.append(path)
+                continue
+            owners = self._owners_of(path)
+            if not owners:
+                unowned_files.append(path)
+                continue
+            for owner in sorted(owners):
+                affected = set(self.__build_targets[owner].expanded_dependents)
+                affected.add(owner)
+                for key in affected & tests:
+                    selected.setdefault(key, {'file': path, 'target': owner})
+        if global_files or unowned_files:
+            path = (global_files + unowned_files)[0]
+            for key in tests - set(selected):
+                selected[key] = {'file': path, 'target': None}
+        return {
+            'changed_files': changed_files,
+            'unowned_files': unowned_files,
+            'global_files': global_files,
+            'selected': selected,
+        }
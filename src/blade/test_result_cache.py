@@ -0,0 +1,137 @@
+# Copyright (c) 2021 Tencent Inc.
+# All rights reserved.
+#
+# Author: chen3feng <chen3feng@gmail.com>
+# Date:   2021-07-17
+
+"""
+Content addressed local test result cache.
+
+The passed test results are stored in a local directory shared by all workspaces and build
+dirs on the same host, keyed by the hash of everything may affect the test result, such as
+the contents of the test binary, its shared libraries and test data, the arguments and the
+related environment variables. So a test needn't to run again after a clean build or in a
+fresh checkout if nothing changed.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import time
+
+from blade import console
+
+
+# Expired entries are pruned at most once in this interval, in seconds
+_PRUNE_INTERVAL = 3600
+
+
+def _update_file(md5, path):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            md5.update(chunk)
+
+
+def content_hash(files, dirs, extra):
+    """Return the hash of the contents of the files and dirs, and the extra string.
+
+    Args:
+        files: list of file paths.
+        dirs: list of dir paths, all files under them are hashed recursively.
+        extra: str, such as the arguments.
+    """
+    md5 = hashlib.md5()
+    for path in files:
+        md5.update(('file %s\n' % os.path.basename(path)).encode('utf-8'))
+        _update_file(md5, path)
+    for path in dirs:
+        md5.update(('dir %s\n' % os.path.basename(path)).encode('utf-8'))
+        for root, subdirs, names in os.walk(path):
+            subdirs.sort()
+            for name in sorted(names):
+                full_path = os.path.join(root, name)
+                md5.update(('file %s\n' % os.path.relpath(full_path, path)).encode('utf-8'))
+                if os.path.isfile(full_path):
+                    _update_file(md5, full_path)
+    md5.update(extra.encode('utf-8'))
+    return md5.hexdigest()
+
+
+class TestResultCache(object):
+    """The local test result cache."""
+
+    def __init__(self, cache_dir, expire_time):
+        """Init method.
+
+        Args:
+            expire_time: int, in seconds, the results older than it are not used.
+        """
+        self.__cache_dir = os.path.expanduser(cache_dir)
+        self.__expire_time = expire_time
+
+    def _path(self, key):
+        return os.path.join(self.__cache_dir, key[:2], key)
+
+    def lookup(self, key):
+        """Return the cached result as dict{'start_time', 'cost_time'}, or None if missing."""
+        try:
+            with open(self._path(key)) as f:
+                result = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if time.time() - result['start_time'] >= self.__expire_time:
+            return None
+        return result
+
+    def store(self, key, test_key, run_result):
+        """Store the passed result of the test."""
+        path = self._path(key)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass  # Already exists
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'test': test_key,
+                           'start_time': run_result.start_time,
+                           'cost_time': run_result.cost_time}, f)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            console.debug('Failed to store test result cache of %s: %s' % (test_key, e))
+
+    def prune(self):
+        """Remove the expired entries and the leftover temporary files."""
+        stamp = os.path.join(self.__cache_dir, '.last_prune')
+        now = time.time()
+        try:
+            if now - os.path.getmtime(stamp) < _PRUNE_INTERVAL:
+                return
+        except OSError:
+            pass  # Never pruned
+        try:
+            with open(stamp, 'w'):
+                pass
+        except (IOError, OSError):
+            return  # The cache dir doesn't exist
+        removed = 0
+        for root, _, names in os.walk(self.__cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                if path == stamp:
+                    continue
+                try:
+                    # The entries are never modified after stored, so mtime is their store time
+                    if now - os.path.getmtime(path) >= self.__expire_time:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass  # Removed by other blade processes
+        if removed:
+            console.debug('Pruned %d expired entries from the test result cache' % removed)
@@ -13,39 +13,31 @@ This module executes the test programs.
 """
 
 from __future__ import absolute_import
+from __future__ import division
 from __future__ import print_function
 
 import datetime
 import json
+import math
 import os
 import re
 import time
-from collections import namedtuple
 
 from blade import binary_runner
 from blade import config
 from blade import console
 from blade import coverage
 from blade import target_pattern
-from blade.test_scheduler import TestScheduler
-# pylint: disable=unused-import
-from blade.test_scheduler import TestRunResult  # Used by eval
+from blade import test_result_cache
+from blade.test_history import TestHistory, TestHistoryItem, TestJob
+from blade.test_scheduler import TestRunResult, TestScheduler
 from blade.util import md5sum, iteritems
 
 
-# Used by eval when loading test history
-_TEST_HISTORY_FILE = '.blade.test.stamp'
 _TEST_EXPIRE_TIME = 86400  # 1 day
 
-
-TestJob = namedtuple('TestJob',
-                     ['reason', 'binary_md5', 'testdata_md5', 'env_md5', 'args'])
-TestHistoryItem = namedtuple('TestHistoryItem', [
-    'job',  # TestJob
-    'first_fail_time',
-    'fail_count',
-    'result',  # TestRunResult
-])
+# Run reasons which allow the test to be skipped by a cached passed result
+_CACHEABLE_REASONS = frozenset(['NO_HISTORY', 'STALE', 'BINARY', 'TESTDATA', 'ENVIRONMENT', 'ARGUMENT'])
 
 
 def _filter_envs(names):
@@ -75,10 +67,12 @@ class TestRunner(binary_runner.BinaryRunner):
             command_targets,
             build_targets,
             exclude_tests,
-            test_jobs_num):
+            test_jobs_num,
+            test_impact=None):
         """Init method.
         Args:
             test_jobs_num:int, max number of concurrent test jobs
+            test_impact:dict, result of the test impact analysis, None if it is not enabled
         """
         # pylint: disable=too-many-locals, too-many-statements
         super(TestRunner, self).__init__(options, target_database, build_targets)
@@ -91,35 +85,30 @@ class TestRunner(binary_runner.BinaryRunner):
 
         self.exclude_tests = exclude_tests  # Tests to be excluded
         self.excluded_tests = []  # Tests been excluded
+        self.test_impact = test_impact
+        self.unaffected_tests = []  # Tests not affected by the changed files
         self.unchanged_tests = []
         self.unrepaired_tests = []
         self.repaired_tests = []
         self.new_failed_tests = []
+        self.cached_tests = {}  # dict{key: TestHistoryItem}, skipped by the test result cache
+
+        # Keys of the tests in the test result cache, dict{key: cache key}
+        self.__test_result_cache_keys = {}
+        cache_dir = config.get_item('global_config', 'test_result_cache_dir')
+        self.__test_result_cache = None
+        if cache_dir and not options.coverage:
+            self.__test_result_cache = test_result_cache.TestResultCache(cache_dir, _TEST_EXPIRE_TIME)
 
         # Test history is the key to implement incremental test.
         # It will be loaded from file before test, compared with test jobs,
         # and be updated and saved to file back after test.
-        self.test_history_file = os.path.join(self.build_dir, _TEST_HISTORY_FILE)
-        self.test_history = {}  # {key, dict{}}
-
-        self._load_test_history()
+        self.test_history = TestHistory(self.build_dir)
+        self.test_history.load()
         self._update_test_history()
 
-    def _load_test_history(self):
-        if os.path.exists(self.test_history_file):
-            with open(self.test_history_file) as f:
-                try:
-                    # pylint: disable=eval-used
-                    self.test_history = eval(f.read())
-                except (SyntaxError, NameError, TypeError) as e:
-                    console.debug('Exception when loading test history: %s' % e)
-                    console.warning('Error loading incremental test history, will run full test')
-
-        if 'items' not in self.test_history:
-            self.test_history['items'] = {}
-
     def _update_test_history(self):
-        old_env = self.test_history.get('env', {})
+        old_env = self.test_history.env
         env_keys = _filter_envs(os.environ.keys())
         new_env = dict((key, os.environ[key]) for key in env_keys)
         if old_env and new_env != old_env:
@@ -130,19 +119,19 @@ class TestRunner(binary_runner.BinaryRunner):
             if old:
                 console.notice('Old environments: %s' % old)
 
-        self.test_history['env'] = new_env
+        self.test_history.env = new_env
         self.env_md5 = md5sum(str(sorted(iteritems(new_env))))
 
-    def _save_test_history(self, passed_run_results, failed_run_results):
+    def _save_test_history(self, passed_run_results, failed_run_results, flaky_tests):
         """update test history and save it to file."""
-        self._merge_passed_run_results_to_history(passed_run_results)
+        self._merge_passed_run_results_to_history(passed_run_results, flaky_tests)
         self._merge_failed_run_results_to_history(failed_run_results)
-        with open(self.test_history_file, 'w') as f:
-            print(str(self.test_history), file=f)
+        self._merge_cached_tests_to_history()
+        self.test_history.save()
 
-    def _save_test_summary(self, passed_run_results, failed_run_results):
+    def _save_test_summary(self, passed_run_results, failed_run_results, flaky_tests, log_files):
         with open('blade-bin/.blade-test-summary.json', 'w') as f:
-            history_items = self.test_history['items']
+            history_items = self.test_history
 
             def expand(tests):
                 ret = {}
@@ -154,6 +143,7 @@ class TestRunner(binary_runner.BinaryRunner):
                     # flatten to upper level
                     history.pop('result')
                     history.update(result)
+                    history['log_files'] = log_files.get(key, [])
                     ret[key] = history
                 return ret
 
@@ -164,12 +154,19 @@ class TestRunner(binary_runner.BinaryRunner):
                 'unrepaired': expand(self.unrepaired_tests),
                 'repaired': self.repaired_tests,
                 'unchanged': self.unchanged_tests,
+                'cached': expand(self.cached_tests),
                 'excluded': self.excluded_tests,
+                'flaky': dict((key, {'failed_attempts': failed_attempts,
+                                     'flakiness': history_items.flakiness(key)})
+                              for key, failed_attempts in iteritems(flaky_tests)),
             }
+            if self.test_impact is not None:
+                summary['impact'] = self.test_impact
+                summary['unaffected'] = sorted(self.unaffected_tests)
             json.dump(summary, f, indent=4)
 
-    def _merge_passed_run_results_to_history(self, run_results):
-        history_items = self.test_history['items']
+    def _merge_passed_run_results_to_history(self, run_results, flaky_tests):
+        history_items = self.test_history
         for key, run_result in iteritems(run_results):
             old = history_items.get(key)
             if old and old.result.exit_code != 0:
@@ -178,10 +175,19 @@ class TestRunner(binary_runner.BinaryRunner):
                     self.test_jobs[key],
                     first_fail_time=0,
                     fail_count=0,
-                    result=run_result)
+                    result=run_result,
+                    flaky=key in flaky_tests)
+
+    def _merge_cached_tests_to_history(self):
+        history_items = self.test_history
+        for key, item in iteritems(self.cached_tests):
+            old = history_items.get(key)
+            if old and old.result.exit_code != 0:
+                self.repaired_tests.append(key)
+            history_items[key] = item
 
     def _merge_failed_run_results_to_history(self, run_results):
-        history_items = self.test_history['items']
+        history_items = self.test_history
         for key, run_result in iteritems(run_results):
             old = history_items.get(key)
             if old:
@@ -197,11 +203,15 @@ class TestRunner(binary_runner.BinaryRunner):
                     self.test_jobs[key],
                     first_fail_time=first_fail_time,
                     fail_count=fail_count,
-                    result=run_result)
+                    result=run_result,
+                    flaky=False)
 
-    def _get_test_target_md5sum(self, target):
-        """Get test target md5sum."""
-        # pylint: disable=too-many-locals
+    def _test_related_files(self, target):
+        """Return the existing files which may affect the test result.
+
+        Returns:
+            (binary files, test data files or dirs), both are sorted absolute paths.
+        """
         related_file_list = []
         related_file_data_list = []
         test_file_name = os.path.abspath(self._executable(target))
@@ -219,6 +229,11 @@ class TestRunner(binary_runner.BinaryRunner):
                     abs_lib_path = os.path.abspath(lib_path)
                     if os.path.exists(abs_lib_path):
                         related_file_list.append(abs_lib_path)
+        # The prebuilt shared libraries are loaded even if the test is not dynamic linked
+        for _, full_path in self._get_shared_libraries_with_soname(target):
+            abs_lib_path = os.path.abspath(full_path)
+            if os.path.exists(abs_lib_path) and abs_lib_path not in related_file_list:
+                related_file_list.append(abs_lib_path)
 
         for i in target.attr['testdata']:
             if isinstance(i, tuple):
@@ -238,7 +253,11 @@ class TestRunner(binary_runner.BinaryRunner):
 
         related_file_list.sort()
         related_file_data_list.sort()
+        return related_file_list, related_file_data_list
 
+    def _get_test_target_md5sum(self, target):
+        """Get test target md5sum."""
+        related_file_list, related_file_data_list = self._test_related_files(target)
         test_target = []
         test_target_data = []
         for f in related_file_list:
@@ -250,6 +269,26 @@ class TestRunner(binary_runner.BinaryRunner):
             test_target_data.append(str(os.path.getctime(f)))
         return md5sum(''.join(test_target)), md5sum(''.join(test_target_data))
 
+    def _test_result_cache_key(self, target):
+        """Return the key of the test in the test result cache, or None if it is not cacheable.
+
+        Only the results of cc_test are cached, the results of other tests may depend on the
+        files which are not the content of their outputs, such as the jars and scripts.
+        """
+        if target.type != 'cc_test':
+            return None
+        binary_files, data_files = self._test_related_files(target)
+        if not binary_files:
+            return None
+        data_dirs = [f for f in data_files if os.path.isdir(f)]
+        data_files = [f for f in data_files if not os.path.isdir(f)]
+        extra = json.dumps([target.key, target.attr['testdata'], self.options.args, self.env_md5])
+        try:
+            return test_result_cache.content_hash(binary_files + data_files, data_dirs, extra)
+        except (IOError, OSError) as e:
+            console.debug('Failed to compute test result cache key of %s: %s' % (target.key, e))
+            return None
+
     def _exclude_test(self, target):
         """Whether exclude this test"""
         if not self.exclude_tests:
@@ -304,25 +343,95 @@ class TestRunner(binary_runner.BinaryRunner):
                 target.info('is skipped due to --exclude-test')
                 self.excluded_tests.append(target.key)
                 continue
+            if self.test_impact is not None and target.key not in self.test_impact['selected']:
+                self.unaffected_tests.append(target.key)
+                continue
 
             binary_md5, testdata_md5 = self._get_test_target_md5sum(target)
-            history = self.test_history['items'].get(target.key)
+            history = self.test_history.get(target.key)
             reason = self._run_reason(target, history, binary_md5, testdata_md5)
             if reason:
-                self.test_jobs[target.key] = TestJob(
+                job = TestJob(
                         reason=reason,
                         binary_md5=binary_md5,
                         testdata_md5=testdata_md5,
                         env_md5=self.env_md5,
                         args=self.options.args)
+                if reason in _CACHEABLE_REASONS and self._lookup_test_result_cache(target, job):
+                    continue
+                self.test_jobs[target.key] = job
             else:
                 if history.result.exit_code == 0:
                     self.unchanged_tests.append(target.key)
                 else:
                     self.unrepaired_tests.append(target.key)
-        self.unrepaired_tests.sort(key=lambda x: self.test_history['items'][x].first_fail_time,
+        self.unrepaired_tests.sort(key=lambda x: self.test_history[x].first_fail_time,
                                    reverse=True)
 
+    def _lookup_test_result_cache(self, target, job):
+        """Lookup the passed result of the test in the test result cache.
+
+        Returns:
+            bool, whether the test is skipped by the cached result.
+        """
+        if not self.__test_result_cache:
+            return False
+        cache_key = self._test_result_cache_key(target)
+        if not cache_key:
+            return False
+        self.__test_result_cache_keys[target.key] = cache_key
+        result = self.__test_result_cache.lookup(cache_key)
+        if not result:
+            return False
+        self.cached_tests[target.key] = TestHistoryItem(
+                job._replace(reason='CACHED'),
+                first_fail_time=0,
+                fail_count=0,
+                result=TestRunResult(exit_code=0,
+                                     start_time=result['start_time'],
+                                     cost_time=result['cost_time']),
+                flaky=False)
+        return True
+
+    def _store_test_result_cache(self, passed_run_results, flaky_tests):
+        """Store the passed results into the test result cache, except the flaky ones."""
+        if not self.__test_result_cache:
+            return
+        for key, run_result in iteritems(passed_run_results):
+            if key in flaky_tests:
+                continue
+            cache_key = self.__test_result_cache_keys.get(key)
+            if cache_key:
+                self.__test_result_cache.store(cache_key, key, run_result)
+        self.__test_result_cache.prune()
+
+    def _test_retries(self):
+        """Return the max times to run each failed test again, dict{key: int}."""
+        retries = {}
+        for key in self.test_jobs:
+            count = self.options.retry_failed
+            if self.target_database[key].attr.get('flaky'):
+                count = max(count, config.get_item('global_config', 'flaky_test_retries'))
+            if count > 0:
+                retries[key] = count
+        return retries
+
+    def _expected_test_costs(self):
+        """Return the expected running time of the tests to be run, the mean of the recent runs.
+
+        The tests without history are treated as long as the longest known test, so they start
+        early and their unknown running time has less chance to prolong the total time.
+        """
+        costs = {}
+        for key in self.test_jobs:
+            stats = self.test_history.duration_stats(key)
+            if stats:
+                costs[key] = stats[0]  # The mean
+        default_cost = max(costs.values()) if costs else 0.0
+        for key in self.test_jobs:
+            costs.setdefault(key, default_cost)
+        return costs
+
     def _generate_coverage_report(self):
         reporter = coverage.JacocoReporter(self.build_dir,
                                            self.target_database,
@@ -361,7 +470,7 @@ class TestRunner(binary_runner.BinaryRunner):
         """Show the unrepaired tests"""
         if not self.unrepaired_tests:
             return
-        items = self.test_history['items']
+        items = self.test_history
         console.error('Skipped %d still unrepaired tests:' % len(self.unrepaired_tests))
         for key in self.unrepaired_tests:
             test = items[key]
@@ -384,7 +493,27 @@ class TestRunner(binary_runner.BinaryRunner):
             for cost_time, key in sorted(slow_tests):
                 console.warning('  %.4gs\t//%s' % (cost_time, key), prefix=False)
 
-    def _show_tests_summary(self, passed_run_results, failed_run_results):
+    def _show_flaky_tests(self, flaky_tests):
+        if not flaky_tests:
+            return
+        console.warning('There are %d flaky tests:' % len(flaky_tests))
+        for key in sorted(flaky_tests):
+            console.warning('  //%s: passed after failed %d times, flakiness %.0f%% in the recent runs' % (
+                key, flaky_tests[key], self.test_history.flakiness(key) * 100), prefix=False)
+
+    def _show_critical_path(self, scheduler, passed_run_results, failed_run_results):
+        """Show the predicted and actual time of the critical path of the tests running."""
+        run_results = dict(passed_run_results)
+        run_results.update(failed_run_results)
+        if not run_results:
+            return
+        longest = max(run_results, key=lambda key: run_results[key].cost_time)
+        console.info('Critical path: predicted %.2fs, actual %.2fs, '
+                     'the longest test //%s cost %.2fs' % (
+                         scheduler.predicted_time, scheduler.actual_time,
+                         longest, run_results[longest].cost_time))
+
+    def _show_tests_summary(self, scheduler, passed_run_results, failed_run_results):
         """Show tests summary."""
         self._show_banner('Testing Summary')
         console.info('%d tests scheduled to run by scheduler.' % (len(self.test_jobs)))
@@ -392,17 +521,28 @@ class TestRunner(binary_runner.BinaryRunner):
             console.info('Skip %d unchanged tests when doing incremental test.' %
                          len(self.unchanged_tests))
             console.info('You can specify --full-test to run all tests.')
+        if self.cached_tests:
+            console.info('Skip %d tests with cached passed results.' % len(self.cached_tests))
+        if self.unaffected_tests:
+            console.info('Skip %d tests not affected by the changed files.' %
+                         len(self.unaffected_tests))
 
         run_tests = len(passed_run_results) + len(failed_run_results)
 
-        total = len(self.test_jobs) + len(self.unrepaired_tests) + len(self.unchanged_tests)
+        total = (len(self.test_jobs) + len(self.unrepaired_tests) + len(self.unchanged_tests) +
+                 len(self.cached_tests))
         msg = ['Total %d tests' % total]
         if self.test_jobs:
             msg.append('%d scheduled' % len(self.test_jobs))
         if self.unchanged_tests:
             msg.append('%d unchanged' % len(self.unchanged_tests))
+        if self.cached_tests:
+            msg.append('%d cached' % len(self.cached_tests))
         if passed_run_results:
             msg.append('%d passed' % len(passed_run_results))
+        flaky_tests = scheduler.get_flaky_tests()
+        if flaky_tests:
+            msg.append('%d flaky' % len(flaky_tests))
         if failed_run_results:
             msg.append('%d failed' % len(failed_run_results))
         cancelled_tests = len(self.test_jobs) - run_tests
@@ -419,14 +559,16 @@ class TestRunner(binary_runner.BinaryRunner):
             msg.append('%d new failed' % len(self.new_failed_tests))
         if msg:
             console.notice('Trend: ' + ', '.join(msg) + '.')
+        self._show_critical_path(scheduler, passed_run_results, failed_run_results)
         if self._is_full_success(passed_run_results):
             console.notice('All %d tests passed!' % total)
 
-    def _show_tests_result(self, passed_run_results, failed_run_results):
+    def _show_tests_result(self, scheduler, passed_run_results, failed_run_results):
         """Show test details and summary according to the options."""
         if self.options.show_details:
             self._show_banner('Testing Details')
             self._show_tests_list(self.unchanged_tests, 'unchanged')
+            self._show_tests_list(self.cached_tests, 'cached')
             if passed_run_results:
                 console.info('Passed tests:')
                 self._show_run_results(passed_run_results)
@@ -437,9 +579,52 @@ class TestRunner(binary_runner.BinaryRunner):
             self._show_run_results(failed_run_results, is_error=True)
         self._show_tests_list(self.repaired_tests, 'repaired')
         self._show_tests_list(self.new_failed_tests, 'new failed', 'error')
+        self._show_flaky_tests(scheduler.get_flaky_tests())
         self._show_unrepaired_results()
 
-        self._show_tests_summary(passed_run_results, failed_run_results)
+        self._show_tests_summary(scheduler, passed_run_results, failed_run_results)
+
+    def _test_shard_count(self, target):
+        """Return the number of shards to run the test in parallel."""
+        shard_count = target.attr.get('shard_count', 1)
+        if shard_count != 'auto':
+            return shard_count
+        # Split the test into shards which cost about `auto_shard_time` each in the last run
+        history = self.test_history.get(target.key)
+        shard_time = config.get_item('cc_test_config', 'auto_shard_time')
+        if not history or shard_time <= 0:
+            return 1
+        shard_count = int(math.ceil(history.result.cost_time / shard_time))
+        return max(1, min(shard_count, self.__test_jobs_num))
+
+    def _prepare_test_run(self, target, shard):
+        """Prepare the environment and return the job of the scheduler to run the test."""
+        shard_index = None if shard is None else shard[0]
+        test_env = self._prepare_env(target, shard_index)
+        cmd = [os.path.abspath(self._executable(target))]
+        cmd += self.options.args
+        if console.color_enabled():
+            test_env['GTEST_COLOR'] = 'yes'
+        else:
+            test_env['GTEST_COLOR'] = 'no'
+        test_env['GTEST_OUTPUT'] = 'xml'
+        test_env['HEAPCHECK'] = target.attr.get('heap_check', '')
+        pprof_path = config.get_item('cc_test_config', 'pprof_path')
+        if pprof_path:
+            test_env['PPROF_PATH'] = os.path.abspath(pprof_path)
+        if self.options.coverage:
+            test_env['BLADE_COVERAGE'] = 'true'
+        if shard is not None:
+            test_env['GTEST_SHARD_INDEX'] = str(shard_index)
+            test_env['GTEST_TOTAL_SHARDS'] = str(shard[1])
+        return (target, self._runfiles_dir(target, shard_index), test_env, cmd, shard,
+                self._test_log_file(target, shard_index))
+
+    def _test_log_file(self, target, shard_index):
+        """Returns the file path to write the test output to."""
+        if shard_index is not None:
+            return '%s.shard%d.log' % (self._executable(target), shard_index)
+        return '%s.log' % self._executable(target)
 
     def run(self):
         """Run all the test target programs."""
@@ -447,25 +632,17 @@ class TestRunner(binary_runner.BinaryRunner):
         tests_run_list = []
         for target_key in self.test_jobs:
             target = self.target_database[target_key]
-            test_env = self._prepare_env(target)
-            cmd = [os.path.abspath(self._executable(target))]
-            cmd += self.options.args
-            if console.color_enabled():
-                test_env['GTEST_COLOR'] = 'yes'
+            shard_count = self._test_shard_count(target)
+            if shard_count == 1:
+                tests_run_list.append(self._prepare_test_run(target, None))
             else:
-                test_env['GTEST_COLOR'] = 'no'
-            test_env['GTEST_OUTPUT'] = 'xml'
-            test_env['HEAPCHECK'] = target.attr.get('heap_check', '')
-            pprof_path = config.get_item('cc_test_config', 'pprof_path')
-            if pprof_path:
-                test_env['PPROF_PATH'] = os.path.abspath(pprof_path)
-            if self.options.coverage:
-                test_env['BLADE_COVERAGE'] = 'true'
-            tests_run_list.append((target, self._runfiles_dir(target), test_env, cmd))
-
-        console.notice('%d tests to run' % len(tests_run_list))
+                for shard_index in range(shard_count):
+                    tests_run_list.append(self._prepare_test_run(target, (shard_index, shard_count)))
+
+        console.notice('%d tests to run' % len(self.test_jobs))
         console.flush()
-        scheduler = TestScheduler(tests_run_list, self.__test_jobs_num)
+        scheduler = TestScheduler(tests_run_list, self.__test_jobs_num, self._expected_test_costs(),
+                                  self._test_retries())
         try:
             scheduler.schedule_jobs()
         except KeyboardInterrupt:
@@ -474,9 +651,13 @@ class TestRunner(binary_runner.BinaryRunner):
             console.flush()
 
         passed_run_results, failed_run_results = scheduler.get_results()
-        self._save_test_history(passed_run_results, failed_run_results)
-        self._save_test_summary(passed_run_results, failed_run_results)
-        self._show_tests_result(passed_run_results, failed_run_results)
+        flaky_tests = scheduler.get_flaky_tests()
+        self._store_test_result_cache(passed_run_results, flaky_tests)
+        self._save_test_history(passed_run_results, failed_run_results, flaky_tests)
+        self._save_test_summary(passed_run_results, failed_run_results, flaky_tests,
+                                scheduler.get_log_files())
+        self._show_tests_result(scheduler, passed_run_results, failed_run_results)
+        self.test_history.close()
 
         if self.options.coverage:
             self._clean_for_coverage()
@@ -6,29 +6,43 @@
 
 
 """
-This module use threads to run tests concurrently.
+This module runs tests concurrently.
+
+All test processes are managed by a single event loop, which is woken up by `SIGCHLD`
+when any test process exits, or by the nearest deadline of the running tests, so the
+finished tests are reaped and the next ones are started without delay.
 """
 
 from __future__ import absolute_import
+from __future__ import division
 from __future__ import print_function
 
+import errno
+import fcntl
+import heapq
+import os
+import select
 import signal
 import subprocess
-import threading
 import time
-import traceback
 from collections import namedtuple
 
-try:
-    import queue
-except ImportError:
-    import Queue as queue
-
-from blade import config
 from blade import console
+from blade import trace
+from blade.util import physical_memory
 
 TestRunResult = namedtuple('TestRunResult', ['exit_code', 'start_time', 'cost_time'])
 
+# Max size of the tail of the test output to be displayed, the full output is in the log file.
+_OUTPUT_TAIL_SIZE = 64 * 1024
+
+# Time to wait for the terminated timeout test to exit before killing it, in seconds
+_KILL_GRACE_TIME = 5
+
+# Max waiting time of the event loop if the SIGCHLD can't be handled,
+# for example, when it is not run in the main thread.
+_POLL_INTERVAL = 0.1
+
 
 def _signal_map():
     result = dict()
@@ -47,103 +61,116 @@ def _signal_map():
 _SIGNAL_MAP = _signal_map()
 
 
-class WorkerThread(threading.Thread):
-    def __init__(self, index, job_queue, job_handler, redirect):
-        """Init methods for this thread."""
-        super(WorkerThread, self).__init__()
-        self.index = index
-        self.running = True
-        self.job_queue = job_queue
-        self.job_handler = job_handler
-        self.redirect = redirect
-        self.job_start_time, self.job_timeout = 0, 0
-        self.job_process = None
-        self.job_name = ''
-        self.job_is_timeout = False
-        self.job_lock = threading.Lock()
-        console.debug('Test worker %d starts to work' % self.index)
-
-    def terminate(self):
-        """Terminate the worker."""
-        self.running = False
-        if self.job_process:
+class _ChildExitNotifier(object):
+    """Make a readable pipe when a child process exits, by the SIGCHLD wakeup fd.
+
+    The pipe is written by the C level signal handler of the interpreter, rather than a python
+    handler, because the signal may be delivered to another thread, such as the one watching
+    the client in the blade server, then the select in the main thread is not interrupted and
+    the python handler has no chance to run.
+    """
+
+    def __init__(self):
+        self.__read_fd, self.__write_fd = os.pipe()
+        for fd in (self.__read_fd, self.__write_fd):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.__old_handler = None
+        self.__old_wakeup_fd = -1
+        self.__installed = False
+
+    def install(self):
+        try:
+            self.__old_handler = signal.signal(signal.SIGCHLD, self.__handler)
+            self.__old_wakeup_fd = signal.set_wakeup_fd(self.__write_fd)
+            self.__installed = True
+        except ValueError:
+            # Signal handlers can only be set in the main thread
+            console.debug('Failed to handle SIGCHLD, fallback to polling')
+
+    def uninstall(self):
+        if self.__installed:
+            signal.set_wakeup_fd(self.__old_wakeup_fd)
+            signal.signal(signal.SIGCHLD, self.__old_handler)
+            self.__installed = False
+        os.close(self.__read_fd)
+        os.close(self.__write_fd)
+
+    def __handler(self, signum, frame):  # pylint: disable=unused-argument
+        pass  # The pipe is written by the wakeup fd
+
+    def wait(self, timeout):
+        """Wait until any child process may have exited, or the timeout expired."""
+        if not self.__installed:
+            timeout = _POLL_INTERVAL if timeout is None else min(timeout, _POLL_INTERVAL)
+        try:
+            readable = select.select([self.__read_fd], [], [], timeout)[0]
+        except (OSError, select.error) as e:
+            # Python 2 doesn't retry on EINTR
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        if readable:
             try:
-                self.job_process.terminate()
+                while os.read(self.__read_fd, 4096):
+                    pass
             except OSError:
                 pass
 
-    def cleanup_job(self):
-        """Clean up job data."""
-        self.job_start_time, self.job_timeout = 0, 0
-        self.job_process = None
-        self.job_name = ''
-        self.job_is_timeout = False
-
-    def set_job_data(self, p, name, timeout):
-        """Set the popen object and name if the job is run in a subprocess."""
-        self.job_process, self.job_name, self.job_timeout = p, name, timeout
 
-    def check_job_timeout(self, now):
-        """Check whether the job is timeout or not.
+class _RunningTest(object):
+    """A running test process."""
 
-        This method simply checks job timeout and returns immediately.
-        The caller should invoke this method repeatedly so that a job
-        which takes a very long time would be timeout sooner or later.
-        """
-        try:
-            self.job_lock.acquire()
-            if (not self.job_is_timeout and self.job_start_time and
-                    self.job_timeout is not None and
-                    self.job_name and self.job_process is not None):
-                if self.job_start_time + self.job_timeout < now:
-                    self.job_is_timeout = True
-                    console.error('//%s: TIMEOUT\n' % self.job_name)
-                    self.job_process.terminate()
-        finally:
-            self.job_lock.release()
-
-    def run(self):
-        """executes and runs here."""
-        try:
-            job_queue = self.job_queue
-            while not job_queue.empty() and self.running:
-                try:
-                    job = job_queue.get_nowait()
-                except queue.Empty:
-                    continue
-                self.job_start_time = time.time()
-                self.job_handler(job, self.redirect, self)
-                try:
-                    self.job_lock.acquire()
-                    self.cleanup_job()
-                finally:
-                    self.job_lock.release()
-        except:  # pylint: disable=bare-except
-            traceback.print_exc()
+    def __init__(self, job, process, start_time, timeout):
+        self.job = job
+        self.process = process
+        self.start_time = start_time
+        self.deadline = start_time + timeout if timeout else None
+        self.is_timeout = False
+        self.redirect = False
+        self.log_file = None
+        self.cpu, self.memory = 0, 0
 
 
 class TestScheduler(object):
-    """Schedule specified tests to be ran in multiple test threads"""
+    """Schedule specified tests to be ran concurrently within the CPU and memory budgets"""
 
-    def __init__(self, tests_list, num_jobs):
-        """init method."""
-        self.tests_list = tests_list
-        self.num_jobs = num_jobs
+    def __init__(self, tests_list, num_jobs, expected_costs=None, retries=None):
+        """init method.
 
-        self.job_queue = queue.Queue(0)
-        self.exclusive_job_queue = queue.Queue(0)
+        Args:
+            num_jobs: int, the number of CPUs can be used to run tests.
+            expected_costs: dict{key: seconds}, the expected running time of the tests,
+                the longer tests are started earlier to shorten the total time.
+            retries: dict{key: int}, max times to run the failed tests again in this run.
+        """
+        self.tests_list = tests_list
+        self.retries = retries or {}
+        # Tests are run concurrently as long as their required resources fit in the budgets
+        self.cpu_budget = num_jobs
+        self.memory_budget = physical_memory()
+        self.expected_costs = expected_costs or {}
 
-        self.run_result_lock = threading.Lock()
         # dict{key, {}}
         self.passed_run_results = {}
         self.failed_run_results = {}
+        # dict{key, [TestRunResult]}, results of the finished shards of the sharded tests
+        self.shard_run_results = {}
+        # dict{key, [log file]}, the files which the redirected outputs of the tests are written
+        # to, in the order of the runs, including the ones of the retried attempts
+        self.log_files = {}
+        # dict{(key, shard), int}, times of the failed runs of the retried jobs
+        self.failed_attempts = {}
+        # dict{key, int}, tests passed after being retried, with the times of their failed runs
+        self.flaky_tests = {}
+        # list[(name, category, start_time, end_time, args)], the runs of all jobs for the trace
+        self.job_spans = []
 
         self.num_of_finished_tests = 0
         self.num_of_running_tests = 0
 
-    def _get_workers_num(self):
-        """get the number of thread workers."""
-        return min(self.job_queue.qsize(), self.num_jobs)
+        # The predicted and actual total time of running all tests
+        self.predicted_time = 0.0
+        self.actual_time = 0.0
 
     def _get_result(self, returncode):
         """translate result from returncode."""
@@ -162,155 +189,330 @@ class TestScheduler(object):
         if console.verbosity_le('quiet'):
             console.show_progress_bar(self.num_of_finished_tests, len(self.tests_list))
 
-    def _run_job_redirect(self, job, job_thread):
-        """run job and redirect the output."""
-        target, run_dir, test_env, cmd = job
-        test_name = target.key
+    def _job_name(self, job):
+        """Return the name of the job to be displayed."""
+        target, shard = job[0], job[4]
+        if shard is None:
+            return target.key
+        return '%s(shard %d/%d)' % (target.key, shard[0] + 1, shard[1])
+
+    @staticmethod
+    def _read_output_tail(log_file):
+        """Read the tail of the test output from the log file."""
+        with open(log_file, 'rb') as f:
+            f.seek(0, 2)
+            size = f.tell()
+            if size <= _OUTPUT_TAIL_SIZE:
+                f.seek(0)
+                return f.read().decode('utf-8', 'replace')
+            f.seek(size - _OUTPUT_TAIL_SIZE)
+            tail = f.read()
+        # Drop the partial first line
+        tail = tail[tail.find(b'\n') + 1:]
+        return '... (%d bytes omitted, see the full output in %s)\n%s' % (
+            size - len(tail), log_file, tail.decode('utf-8', 'replace'))
+
+    @staticmethod
+    def _attempt_log_file(log_file, attempt):
+        """Return the log file of the retried attempt, so the outputs of the failed ones are kept."""
+        if not attempt:
+            return log_file
+        root, ext = os.path.splitext(log_file)
+        return '%s.attempt%d%s' % (root, attempt, ext)
+
+    def _start_job(self, job, redirect):
+        """Start the test process, return the `_RunningTest` or None if failed.
+
+        Each test is a tuple (target, run_dir, env, cmd, shard, log_file), the shard is None
+        or a tuple (shard_index, shard_count) for the sharded test, the log_file is where the
+        output is written to if it is redirected, the retried attempts write to their own ones.
+        """
+        target, run_dir, test_env, cmd, shard, log_file = job
+        log_file = self._attempt_log_file(log_file, self.failed_attempts.get((target.key, shard), 0))
         shell = target.attr.get('run_in_shell', False)
         if shell:
             cmd = subprocess.list2cmdline(cmd)
-        timeout = target.attr.get('test_timeout')
+        self.num_of_running_tests += 1
         self._show_progress(cmd)
-        p = subprocess.Popen(cmd,
-                             env=test_env,
-                             cwd=run_dir,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.STDOUT,
-                             close_fds=True,
-                             shell=shell,
-                             universal_newlines=True)
-        job_thread.set_job_data(p, test_name, timeout)
-        stdout = p.communicate()[0]
-        result = self._get_result(p.returncode)
+        start_time = time.time()
+        try:
+            if redirect:
+                self.log_files.setdefault(target.key, []).append(log_file)
+                # The output is written into the log file by the test directly, rather than
+                # held in memory, because some tests may output a lot.
+                with open(log_file, 'wb') as output:
+                    p = subprocess.Popen(cmd, env=test_env, cwd=run_dir, stdout=output,
+                                         stderr=subprocess.STDOUT, close_fds=True, shell=shell)
+            else:
+                p = subprocess.Popen(cmd, env=test_env, cwd=run_dir, close_fds=True, shell=shell)
+        except OSError as e:
+            target.error('Create test process error: %s' % str(e))
+            self._finish_job(job, 255, start_time)
+            return None
+        test = _RunningTest(job, p, start_time, target.attr.get('test_timeout'))
+        test.log_file = log_file
+        return test
+
+    def _show_job_result(self, test, result, retry):
+        test_name = self._job_name(test.job)
+        if not test.redirect:
+            console.info('%s Test //%s finished : %s\n' % (self._progress(done=1), test_name, result))
+            return
         msg = 'Output of //%s:\n%s%s Test //%s finished: %s\n' % (
-            test_name, stdout, self._progress(done=1), test_name, result)
-        if console.verbosity_le('quiet') and p.returncode != 0:
+            test_name, self._read_output_tail(test.log_file), self._progress(done=1), test_name,
+            result)
+        # The output of the failed attempt to be retried is kept in its log file
+        if console.verbosity_le('quiet') and result != 'SUCCESS' and not retry:
             console.error(msg, prefix=False)
         else:
             console.info(msg)
             console.flush()
 
-        return p.returncode
-
-    def _run_job(self, job, job_thread):
-        """run job, do not redirect the output."""
-        target, run_dir, test_env, cmd = job
-        test_name = target.key
-        shell = target.attr.get('run_in_shell', False)
-        if shell:
-            cmd = subprocess.list2cmdline(cmd)
-        timeout = target.attr.get('test_timeout')
-        self._show_progress(cmd)
-        p = subprocess.Popen(cmd, env=test_env, cwd=run_dir, close_fds=True, shell=shell)
-        job_thread.set_job_data(p, test_name, timeout)
-        p.wait()
-        result = self._get_result(p.returncode)
-        console.info('%s Test //%s finished : %s\n' % (self._progress(done=1), test_name, result))
-
-        return p.returncode
-
-    def _process_job(self, job, redirect, job_thread):
-        """process routine.
+    def _finish_job(self, job, returncode, start_time):
+        """Record the result of the finished job."""
+        target = job[0]
+        run_result = TestRunResult(exit_code=returncode,
+                                   start_time=start_time, cost_time=time.time() - start_time)
+        if job[4] is not None:
+            run_result = self._merge_shard_result(target.key, job[4], run_result)
+        if run_result is None:
+            pass  # Some shards are still running
+        elif run_result.exit_code == 0:
+            self.passed_run_results[target.key] = run_result
+            failed_attempts = sum(count for (key, _), count in self.failed_attempts.items()
+                                  if key == target.key)
+            if failed_attempts:
+                self.flaky_tests[target.key] = failed_attempts
+        elif run_result.exit_code != -signal.SIGINT:  # Treat Ctrl-C ended as cancelled
+            self.failed_run_results[target.key] = run_result
+        self.num_of_running_tests -= 1
+        self.num_of_finished_tests += 1
+
+    def _merge_shard_result(self, key, shard, run_result):
+        """Merge the results of all shards of a test into one, or return None if not finished.
+
+        The exit code is the first failed one, and the cost time is the sum of all shards,
+        which is the cost of running the test without sharding.
+        """
+        shard_index, shard_count = shard
+        results = self.shard_run_results.setdefault(key, [None] * shard_count)
+        results[shard_index] = run_result
+        if any(result is None for result in results):
+            return None
+        exit_code = 0
+        for result in results:
+            if result.exit_code != 0:
+                exit_code = result.exit_code
+                break
+        return TestRunResult(exit_code=exit_code,
+                             start_time=min(result.start_time for result in results),
+                             cost_time=sum(result.cost_time for result in results))
+
+    def _should_retry(self, job, returncode):
+        """Return whether to run the failed job again."""
+        if returncode == 0 or returncode == -signal.SIGINT:
+            return False
+        return self.failed_attempts.get((job[0].key, job[4]), 0) < self.retries.get(job[0].key, 0)
+
+    def _retry_job(self, job):
+        """Record the failed attempt of the job to be run again."""
+        key = (job[0].key, job[4])
+        attempts = self.failed_attempts.get(key, 0) + 1
+        self.failed_attempts[key] = attempts
+        console.warning('//%s failed, retry %d/%d' % (self._job_name(job), attempts,
+                                                       self.retries[job[0].key]))
+        self.num_of_running_tests -= 1
+
+    def _check_timeout(self, deadlines, now):
+        """Terminate the tests which exceeded their deadlines, return the nearest deadline."""
+        while deadlines:
+            deadline, _, test = deadlines[0]
+            if test.process.returncode is None and deadline > now:
+                return deadline
+            heapq.heappop(deadlines)
+            if test.process.returncode is None:
+                try:
+                    if test.is_timeout:
+                        # Still running after being terminated
+                        test.process.kill()
+                        continue
+                    test.is_timeout = True
+                    console.error('//%s: TIMEOUT\n' % self._job_name(test.job))
+                    test.process.terminate()
+                except OSError:
+                    continue
+                heapq.heappush(deadlines, (now + _KILL_GRACE_TIME, id(test), test))
+        return None
 
-        Each test is a tuple (target, run_dir, env, cmd)
+    def _job_resources(self, job):
+        """Return the (cpu, memory) required by the job, limited by the budgets.
 
+        An exclusive test requires the whole machine.
         """
         target = job[0]
-        start_time = time.time()
-
-        with self.run_result_lock:
-            self.num_of_running_tests += 1
-
-        try:
-            if redirect:
-                returncode = self._run_job_redirect(job, job_thread)
+        if target.attr.get('exclusive'):
+            return self.cpu_budget, self.memory_budget
+        cpu = min(target.attr.get('cpu', 1), self.cpu_budget)
+        memory = min(target.attr.get('memory', 0), self.memory_budget)
+        return cpu, memory
+
+    def _pick_jobs(self, pending, free_cpu, free_memory, running, now):
+        """Pick the jobs to be started now from the pending jobs in order.
+
+        The jobs are started in order as long as they fit in the free resources. When the first
+        one doesn't fit, the resources are reserved for it from the time when enough of them
+        are expected to be freed, and the later jobs can only be started before it if they are
+        expected to finish before that time, otherwise the tests which need a lot of resources,
+        such as the exclusive ones, would be delayed by the small ones again and again.
+
+        Args:
+            running: list[(end_time, cpu, memory)], the expected end time and the resources of
+                the running jobs.
+        """
+        picked, remained = [], []
+        running = list(running)
+        shadow_time = None  # The time when the resources are reserved for the blocked job
+        for job in pending:
+            cpu, memory = self._job_resources(job)
+            fits = cpu <= free_cpu and memory <= free_memory
+            if shadow_time is None and not fits:
+                shadow_time = self._reserve_time(job, free_cpu, free_memory, running)
+            if fits and (shadow_time is None or
+                         now < shadow_time and now + self._expected_cost(job) <= shadow_time):
+                picked.append(job)
+                free_cpu -= cpu
+                free_memory -= memory
+                running.append((now + self._expected_cost(job), cpu, memory))
             else:
-                returncode = self._run_job(job, job_thread)
-        except OSError as e:
-            target.error('Create test process error: %s' % str(e))
-            returncode = 255
-
-        cost_time = time.time() - start_time
-
-        run_result = TestRunResult(exit_code=returncode,
-                                   start_time=start_time, cost_time=cost_time)
-
-        with self.run_result_lock:
-            if returncode == 0:
-                self.passed_run_results[target.key] = run_result
-            elif returncode != -signal.SIGINT:  # Treat Ctrl-C ended as cancelled
-                self.failed_run_results[target.key] = run_result
-            self.num_of_running_tests -= 1
-            self.num_of_finished_tests += 1
-
-    def _join_thread(self, t):
-        """Join thread and keep signal awareable"""
-        # The Thread.join without timeout will block signals, which makes
-        # blade can't be terminated by Ctrl-C
-        while t.is_alive():
-            t.join(1)
-
-    def _wait_worker_threads(self, threads):
-        """Wait for worker threads to complete."""
-        test_timeout = config.get_item('global_config', 'test_timeout')
+                remained.append(job)
+        pending[:] = remained
+        return picked
+
+    def _reserve_time(self, job, free_cpu, free_memory, running):
+        """Return the time when enough resources are expected to be freed to start the job."""
+        cpu, memory = self._job_resources(job)
+        for end_time, used_cpu, used_memory in sorted(running):
+            free_cpu += used_cpu
+            free_memory += used_memory
+            if cpu <= free_cpu and memory <= free_memory:
+                return end_time
+        return float('inf')
+
+    def _run_jobs(self, jobs, notifier):
+        """Run the jobs in order, as many as the resource budgets allow at the same time."""
+        quiet = console.verbosity_le('quiet')
+        pending = list(jobs)
+        running = []
+        deadlines = []  # Heap of (deadline, sequence, _RunningTest)
+        free_cpu, free_memory = self.cpu_budget, self.memory_budget
         try:
-            while threads:
-                time.sleep(1)  # Check every second
+            while pending or running:
+                now = time.time()
+                # The overrunning tests are expected to end at any time
+                running_ends = [(max(test.start_time + self._expected_cost(test.job), now),
+                                 test.cpu, test.memory) for test in running]
+                for job in self._pick_jobs(pending, free_cpu, free_memory, running_ends, now):
+                    cpu, memory = self._job_resources(job)
+                    # Redirect the output if the test may run with others
+                    redirect = quiet or (len(jobs) > 1 and cpu < self.cpu_budget)
+                    test = self._start_job(job, redirect)
+                    if test is None:
+                        continue
+                    test.redirect, test.cpu, test.memory = redirect, cpu, memory
+                    free_cpu -= cpu
+                    free_memory -= memory
+                    running.append(test)
+                    if test.deadline is not None:
+                        heapq.heappush(deadlines, (test.deadline, id(test), test))
+                if not running:
+                    continue
                 now = time.time()
-                dead_threads = []
-                for t in threads:
-                    if t.is_alive():
-                        if test_timeout is not None:
-                            t.check_job_timeout(now)
+                deadline = self._check_timeout(deadlines, now)
+                notifier.wait(None if deadline is None else max(deadline - now, 0))
+                still_running = []
+                for test in running:
+                    returncode = test.process.poll()
+                    if returncode is None:
+                        still_running.append(test)
+                        continue
+                    result = 'TIMEOUT' if test.is_timeout else self._get_result(returncode)
+                    self.job_spans.append((self._job_name(test.job), 'test', test.start_time,
+                                           time.time(), {'result': result}))
+                    retry = self._should_retry(test.job, returncode)
+                    self._show_job_result(test, result, retry)
+                    if retry:
+                        self._retry_job(test.job)
+                        # Run it again as soon as possible, on the freed resources
+                        pending.insert(0, test.job)
                     else:
-                        dead_threads.append(t)
-
-                for dt in dead_threads:
-                    threads.remove(dt)
+                        self._finish_job(test.job, returncode, test.start_time)
+                    free_cpu += test.cpu
+                    free_memory += test.memory
+                running = still_running
         except KeyboardInterrupt:
-            console.debug('KeyboardInterrupt: Terminate workers...')
-            for t in threads:
-                t.terminate()
-            for t in threads:
-                t.join()
+            console.debug('KeyboardInterrupt: Terminate running tests...')
+            for test in running:
+                try:
+                    test.process.terminate()
+                except OSError:
+                    pass
+            for test in running:
+                test.process.wait()
             raise
 
+    def _expected_cost(self, job):
+        cost = self.expected_costs.get(job[0].key, 0.0)
+        shard = job[4]
+        if shard is not None:
+            cost /= shard[1]
+        return cost
+
+    def _predict_time(self, jobs):
+        """Predict the total time of running the jobs by simulating the scheduling."""
+        pending = list(jobs)
+        running = []  # Heap of (end_time, sequence, cpu, memory)
+        now = 0.0
+        free_cpu, free_memory = self.cpu_budget, self.memory_budget
+        while pending or running:
+            running_ends = [(end_time, cpu, memory) for end_time, _, cpu, memory in running]
+            for job in self._pick_jobs(pending, free_cpu, free_memory, running_ends, now):
+                cpu, memory = self._job_resources(job)
+                free_cpu -= cpu
+                free_memory -= memory
+                heapq.heappush(running, (now + self._expected_cost(job), len(pending) + len(running),
+                                         cpu, memory))
+            now, _, cpu, memory = heapq.heappop(running)
+            free_cpu += cpu
+            free_memory += memory
+        return now
+
     def schedule_jobs(self):
         """scheduler."""
         if not self.tests_list:
             return
 
-        for i in self.tests_list:
-            target = i[0]
-            if target.attr.get('exclusive'):
-                self.exclusive_job_queue.put(i)
-            else:
-                self.job_queue.put(i)
-
-        quiet = console.verbosity_le('quiet')
-
-        num_of_workers = self._get_workers_num()
-        if not self.job_queue.empty():
-            console.info('Spawn %d worker thread(s) to run concurrent tests' % num_of_workers)
-
-            redirect = num_of_workers > 1 or quiet
-            threads = []
-            try:
-                for i in range(num_of_workers):
-                    t = WorkerThread(i, self.job_queue, self._process_job, redirect)
-                    t.start()
-                    threads.append(t)
-            finally:
-                self._wait_worker_threads(threads)
-
-        if not self.exclusive_job_queue.empty():
-            console.info('Spawn 1 worker thread to run exclusive tests')
-            last_t = WorkerThread(num_of_workers, self.exclusive_job_queue,
-                                  self._process_job, quiet)
-            try:
-                last_t.start()
-            finally:
-                self._wait_worker_threads([last_t])
+        start_time = time.time()
+        # Longest first, so that long tests don't start at the end and dominate the total time
+        jobs = sorted(self.tests_list,
+                      key=lambda job: (-self._expected_cost(job), job[0].key, job[4]))
+        self.predicted_time = self._predict_time(jobs)
+        console.info('Run %d tests with the budget of %d CPUs and %s memory' % (
+            len(jobs), self.cpu_budget,
+            '%.1fG' % (self.memory_budget / (1 << 30)) if self.memory_budget else 'unlimited'))
+        notifier = _ChildExitNotifier()
+        notifier.install()
+        try:
+            self._run_jobs(jobs, notifier)
+        finally:
+            notifier.uninstall()
+            self.actual_time = time.time() - start_time
+            trace.add_lane_events('tests', self.job_spans)
 
     def get_results(self):
         return self.passed_run_results, self.failed_run_results
+
+    def get_log_files(self):
+        return self.log_files
+
+    def get_flaky_tests(self):
+        return self.flaky_tests
@@ -17,11 +17,41 @@ import re
 import tempfile
 
 from blade import console
-from blade.util import var_to_list, iteritems, run_command
+from blade import trace
+from blade.util import var_to_list, iteritems, pickle, run_command
 
 # example: Cuda compilation tools, release 11.0, V11.0.194
 _nvcc_version_re = re.compile(r'V(\d+\.\d+\.\d+)')
 
+# Cache file of the toolchain probing results in the build dir
+_PROBES_CACHE_FILE = '.toolchain_probes.data'
+
+# Increase this number if the format of the cache file is changed.
+_PROBES_CACHE_VERSION = 1
+
+
+def _find_executable(name):
+    """Find the path of an executable file, like the `which` command, but without spawning it."""
+    if os.sep in name:
+        return name if os.path.isfile(name) else None
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(path, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def _command_stamp(command):
+    """Stamp of the executable files in a command, such as 'ccache gcc', to identify changes."""
+    stamp = []
+    for word in command.split():
+        path = _find_executable(word)
+        if path:
+            st = os.stat(path)
+            stamp.append((path, st.st_mtime, st.st_size))
+    return tuple(stamp)
+
+
 class BuildArchitecture(object):
     """
     The BuildArchitecture class manages architecture/bits configuration
@@ -107,13 +137,62 @@ class BuildArchitecture(object):
 class ToolChain(object):
     """The build platform handles and gets the platform information."""
 
-    def __init__(self):
+    def __init__(self, build_dir=None):
+        """Init method.
+
+        Args:
+            build_dir: str, the dir to cache the probing results of the toolchain, such as
+                the version and the supported flags, to avoid spawning the compiler every time.
+        """
         self.cc = self._get_cc_command('CC', 'gcc')
         self.cxx = self._get_cc_command('CXX', 'g++')
         self.ld = self._get_cc_command('LD', 'g++')
+        self.__probes_cache_file = os.path.join(build_dir, _PROBES_CACHE_FILE) if build_dir else None
+        self.__cc_stamp = _command_stamp(self.cc)
+        self.__probes = self._load_probes()
         self.cc_version = self._get_cc_version()
         self.ar = self._get_cc_command('AR', 'ar')
 
+    def _load_probes(self):
+        """Load the cached probing results of current cc."""
+        if not self.__probes_cache_file:
+            return {}
+        try:
+            with open(self.__probes_cache_file, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('version') == _PROBES_CACHE_VERSION and data.get('stamp') == self.__cc_stamp:
+                return data['probes']
+        except Exception:  # pylint: disable=broad-except
+            pass
+        return {}
+
+    def _save_probes(self):
+        if not self.__probes_cache_file:
+            return
+        data = {
+            'version': _PROBES_CACHE_VERSION,
+            'stamp': self.__cc_stamp,
+            'probes': self.__probes,
+        }
+        try:
+            with open(self.__probes_cache_file + '.tmp', 'wb') as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(self.__probes_cache_file + '.tmp', self.__probes_cache_file)
+        except (IOError, OSError) as e:
+            console.debug('Failed to save toolchain probing results: %s' % e)
+
+    def _probe(self, key, function):
+        """Return the cached result of the probing function, or call it and cache the result."""
+        key = (self.cc,) + key
+        if key in self.__probes:
+            return self.__probes[key]
+        with trace.span('probe %s' % key[1], 'toolchain', key=repr(key)):
+            result = function()
+        if result is not None:
+            self.__probes[key] = result
+            self._save_probes()
+        return result
+
     @staticmethod
     def _get_cc_command(env, default):
         """Get a cc command.
@@ -121,10 +200,12 @@ class ToolChain(object):
         return os.path.join(os.environ.get('TOOLCHAIN_DIR', ''), os.environ.get(env, default))
 
     def _get_cc_version(self):
-        version = ''
-        returncode, stdout, stderr = run_command(self.cc + ' -dumpversion', shell=True)
-        if returncode == 0:
-            version = stdout.strip()
+        def probe():
+            returncode, stdout, stderr = run_command(self.cc + ' -dumpversion', shell=True)
+            if returncode == 0:
+                return stdout.strip() or None
+            return None
+        version = self._probe(('version',), probe)
         if not version:
             console.fatal('Failed to obtain cc toolchain.')
         return version
@@ -157,6 +238,16 @@ class ToolChain(object):
     def filter_cc_flags(self, flag_list, language='c'):
         """Filter out the unrecognized compilation flags."""
         flag_list = var_to_list(flag_list)
+        valid_flags, unrecognized_flags = self._probe(
+            ('flags', language, tuple(flag_list)),
+            lambda: self._filter_cc_flags(flag_list, language))
+        if unrecognized_flags:
+            console.warning('config: Unrecognized %s flags: %s' % (
+                    language, ', '.join(unrecognized_flags)))
+        return valid_flags
+
+    def _filter_cc_flags(self, flag_list, language):
+        """Return the recognized and unrecognized compilation flags by trying to compile."""
         valid_flags, unrecognized_flags = [], []
 
         # Put compilation output into test.o instead of /dev/null
@@ -177,7 +268,7 @@ class ToolChain(object):
         os.close(fd)
 
         if returncode == 0:
-            return flag_list
+            return list(flag_list), []
         for flag in flag_list:
             # Example error messages:
             #   clang: warning: unknown warning option '-Wzzz' [-Wunknown-warning-option]
@@ -187,8 +278,4 @@ class ToolChain(object):
             else:
                 valid_flags.append(flag)
 
-        if unrecognized_flags:
-            console.warning('config: Unrecognized %s flags: %s' % (
-                    language, ', '.join(unrecognized_flags)))
-
-        return valid_flags
+        return valid_flags, unrecognized_flags
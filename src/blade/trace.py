@@ -0,0 +1,133 @@
+# Copyright (c) 2021 Tencent Inc.
+# All rights reserved.
+#
+# Author: chen3feng <chen3feng@gmail.com>
+# Date:   2021-08-07
+
+"""
+Trace of a blade run.
+
+Record the time spans of the phases of blade, the ninja actions and the test executions, and
+write them as a Chrome trace event file, which can be viewed in `chrome://tracing` or
+https://ui.perfetto.dev.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import contextlib
+import json
+import os
+import time
+
+from blade import console
+
+
+# The process ids of the lanes in the viewer
+_BLADE_PID = 1
+
+_path = None
+_start_time = 0.0
+_events = []
+_processes = {}  # dict{name: pid}
+
+
+def start(path):
+    """Start tracing, the trace will be written into the path when saving."""
+    global _path, _start_time
+    _path = os.path.abspath(path)
+    _start_time = time.time()
+    del _events[:]
+    _processes.clear()
+    _processes['blade'] = _BLADE_PID
+
+
+def enabled():
+    return _path is not None
+
+
+def _timestamp(t):
+    """Convert a wall time into microseconds since the start of tracing."""
+    return int((t - _start_time) * 1000000)
+
+
+def add_event(name, category, start_time, end_time, pid=_BLADE_PID, tid=0, args=None):
+    """Add a complete event with the wall times."""
+    if not enabled():
+        return
+    event = {
+        'name': name,
+        'cat': category,
+        'ph': 'X',
+        'ts': _timestamp(start_time),
+        'dur': max(int((end_time - start_time) * 1000000), 0),
+        'pid': pid,
+        'tid': tid,
+    }
+    if args:
+        event['args'] = args
+    _events.append(event)
+
+
+@contextlib.contextmanager
+def span(name, category, **args):
+    """Record the time span of the code in the `with` block."""
+    if not enabled():
+        yield
+        return
+    start_time = time.time()
+    try:
+        yield
+    finally:
+        add_event(name, category, start_time, time.time(), args=args)
+
+
+def add_lane_events(process_name, events):
+    """Add the events of a group of concurrent jobs, such as the ninja actions.
+
+    Each event is assigned to the first free lane, so the events in a lane don't overlap.
+
+    Args:
+        events: list of (name, category, start_time, end_time, args).
+    """
+    if not enabled() or not events:
+        return
+    pid = _processes.setdefault(process_name, len(_processes) + 1)
+    lanes = []  # The end time of the last event in each lane
+    for name, category, start_time, end_time, args in sorted(events, key=lambda e: e[2]):
+        for tid, lane_end in enumerate(lanes):
+            if lane_end <= start_time:
+                lanes[tid] = end_time
+                break
+        else:
+            tid = len(lanes)
+            lanes.append(end_time)
+        add_event(name, category, start_time, end_time, pid=pid, tid=tid, args=args)
+
+
+def _metadata_events():
+    events = []
+    for name, pid in sorted(_processes.items(), key=lambda item: item[1]):
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                       'args': {'name': name}})
+        events.append({'name': 'process_sort_index', 'ph': 'M', 'pid': pid, 'tid': 0,
+                       'args': {'sort_index': pid}})
+    return events
+
+
+def save():
+    """Write the trace file and stop tracing."""
+    global _path
+    if not enabled():
+        return
+    trace = {
+        'traceEvents': _metadata_events() + _events,
+        'displayTimeUnit': 'ms',
+    }
+    try:
+        with open(_path, 'w') as f:
+            json.dump(trace, f)
+        console.info('Trace of %d events is written into "%s"' % (len(_events), _path))
+    except (IOError, OSError) as e:
+        console.warning('Failed to write trace file "%s": %s' % (_path, e))
+    _path = None
@@ -247,6 +247,67 @@ def cpu_count():
         return int(os.sysconf('SC_NPROCESSORS_ONLN'))
 
 
+def physical_memory():
+    """Return the size of the physical memory in bytes, or 0 if it is unknown."""
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+
+def available_memory():
+    """Return the size of the memory available for starting new processes in bytes.
+
+    The `MemAvailable` in `/proc/meminfo` is used if possible, which includes the reclaimable
+    caches, otherwise fallback to the size of the physical memory.
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return physical_memory()
+
+
+def running_processes():
+    """Return the number of the other processes which are running or runnable now.
+
+    The instantaneous number in `/proc/loadavg` is used if possible, because the load averages
+    decay slowly, they are still high just after the previous build. Fallback to the 1-minute
+    load average.
+    """
+    try:
+        with open('/proc/loadavg') as f:
+            running = int(f.read().split()[3].split('/')[0])
+        return max(running - 1, 0)  # Exclude this process
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    try:
+        return int(os.getloadavg()[0])
+    except (AttributeError, OSError):
+        return 0
+
+
+_MEMORY_SIZE_UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def parse_memory_size(size):
+    """Parse memory size such as 1024 or '8G' into bytes, return None if it is invalid."""
+    if isinstance(size, int):
+        return size if size >= 0 else None
+    if not isinstance(size, str) or not size:
+        return None
+    unit = _MEMORY_SIZE_UNITS.get(size[-1].upper(), 1)
+    number = size[:-1] if unit > 1 else size
+    try:
+        size = int(float(number) * unit)
+    except (ValueError, OverflowError):  # Such as 'inf'
+        return None
+    return size if size >= 0 else None
+
+
 _TRANS_TABLE = (str if _IN_PY3 else string).maketrans(',-/:.+*', '_______')
 
 
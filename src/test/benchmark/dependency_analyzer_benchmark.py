@@ -0,0 +1,154 @@
+# Copyright (c) 2021 Tencent Inc.
+# All rights reserved.
+#
+# Author: chen3feng <chen3feng@gmail.com>
+# Date:   2021-06-19
+
+
+"""
+Benchmark of the eager and lazy dependency expansion of the dependency analyzer.
+
+A synthetic dependency graph is generated, each target depends on some nearby targets
+and some common base libraries, like a typical large repository.
+
+Usage:
+    PYTHONPATH=../.. python dependency_analyzer_benchmark.py [--targets=100000] [--used=0.3]
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import random
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from blade import dependency_analyzer
+
+
+class _Target(object):
+    """Mimic the dependency related members of the `blade.target.Target`."""
+
+    def __init__(self, key, deps, targets):
+        self.key = key
+        self.deps = deps
+        self.dependents = set()
+        self.__targets = targets
+        self.__expanded_deps = None
+        self.__expanded_dependents = None
+
+    @property
+    def expanded_deps(self):
+        if self.__expanded_deps is None:
+            self.__expanded_deps = dependency_analyzer.expand_target_deps(self.key, self.__targets)
+        return self.__expanded_deps
+
+    @expanded_deps.setter
+    def expanded_deps(self, value):
+        self.__expanded_deps = value
+
+    @property
+    def expanded_dependents(self):
+        if self.__expanded_dependents is None:
+            self.__expanded_dependents = dependency_analyzer.expand_target_dependents(
+                    self.key, self.__targets)
+        return self.__expanded_dependents
+
+    @expanded_dependents.setter
+    def expanded_dependents(self, value):
+        self.__expanded_dependents = value
+
+    def _expand_deps_generation(self):
+        pass
+
+
+def _make_graph(options):
+    """Make a random DAG, targets only depend on the former ones.
+
+    The first `base` targets are the common base libraries, they depend on each other.
+    Other targets are grouped into modules, each target depends on some former targets
+    in the same module and maybe a base library.
+    """
+    rand = random.Random(options.seed)
+    targets = {}
+    keys = []
+    for i in range(options.targets):
+        if i < options.base:
+            begin = 0
+        else:
+            begin = max(options.base, i - i % options.module_size)
+        deps = set()
+        if i > begin:
+            for _ in range(rand.randint(0, options.deps)):
+                deps.add(keys[rand.randint(begin, i - 1)])
+        if i >= options.base and rand.random() < 0.5:
+            deps.add(keys[rand.randint(0, options.base - 1)])
+        key = 'module%d:target%d' % (i // options.module_size, i)
+        targets[key] = _Target(key, sorted(deps), targets)
+        keys.append(key)
+    return targets, keys
+
+
+def _eager(targets, used_keys):
+    dependency_analyzer._expand_deps(targets)
+    dependency_analyzer._expand_dependents(targets)
+    return dependency_analyzer._topological_sort(targets)
+
+
+def _lazy(targets, used_keys):
+    dependency_analyzer._build_dependents(targets)
+    result = dependency_analyzer._topological_sort(targets)
+    for key in used_keys:
+        targets[key].expanded_deps  # pylint: disable=pointless-statement
+    return result
+
+
+def _measure(name, function, options):
+    targets, keys = _make_graph(options)
+    used_keys = random.Random(options.seed).sample(keys, int(len(keys) * options.used))
+    gc.collect()
+    if tracemalloc:
+        tracemalloc.start()
+    start_time = time.time()
+    function(targets, used_keys)
+    cost_time = time.time() - start_time
+    if tracemalloc:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('%-6s %8.2fs %10.1fMB' % (name, cost_time, peak / 1024.0 / 1024.0))
+    else:
+        print('%-6s %8.2fs' % (name, cost_time))
+    return targets
+
+
+def _verify(eager_targets, lazy_targets, options):
+    """Verify the lazily expanded deps are exactly the same as the eager ones."""
+    rand = random.Random(options.seed)
+    for key in rand.sample(sorted(eager_targets), min(1000, len(eager_targets))):
+        assert lazy_targets[key].expanded_deps == eager_targets[key].expanded_deps, key
+        assert lazy_targets[key].expanded_dependents == eager_targets[key].expanded_dependents, key
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--targets', type=int, default=100000, help='Number of targets')
+    parser.add_argument('--deps', type=int, default=5, help='Max number of direct deps of each target')
+    parser.add_argument('--module-size', type=int, default=100, help='Number of targets in each module')
+    parser.add_argument('--base', type=int, default=1000, help='Number of the common base libraries')
+    parser.add_argument('--used', type=float, default=0.3,
+                        help='Ratio of targets whose expanded deps are accessed in lazy expansion')
+    parser.add_argument('--seed', type=int, default=1)
+    options = parser.parse_args()
+
+    print('%-6s %9s %12s' % ('engine', 'time', 'peak memory'))
+    eager_targets = _measure('eager', _eager, options)
+    lazy_targets = _measure('lazy', _lazy, options)
+    _verify(eager_targets, lazy_targets, options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+# Copyright (c) 2021 Tencent Inc.
+# All rights reserved.
+#
+# Author: chen3feng <chen3feng@gmail.com>
+# Date:   2021-08-14
+
+
+"""
+Benchmark of the handling of the ninja output in the quiet mode.
+
+A child process writes a synthetic ninja output of many actions, line by line like ninja,
+with some warnings in it. The output is processed by the pipe based streaming reader, and
+by the former reader which polls the output file, for comparison.
+
+Usage:
+    PYTHONPATH=../.. python ninja_output_benchmark.py [--actions=200000] [--rate=0]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+from blade import ninja_runner
+
+
+# Mimic ninja, which flushes the output after each line
+_WRITER = r'''
+import sys, time
+actions, warning_every, rate = int(sys.argv[1]), int(sys.argv[2]), float(sys.argv[3])
+start = time.time()
+for i in range(1, actions + 1):
+    sys.stdout.write('[%d/%d] CXX build64_release/module%d/source%d.cpp.o\n' % (
+        i, actions, i // 100, i))
+    if warning_every and i % warning_every == 0:
+        sys.stdout.write('module%d/source%d.cpp:10:5: warning: unused variable "x"\n' % (
+            i // 100, i))
+    sys.stdout.flush()
+    if rate:
+        delay = start + i / rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+'''
+
+
+class _Counter(object):
+    """Count the calls of the progress and line showing functions."""
+
+    def __init__(self):
+        self.progresses = 0
+        self.lines = 0
+        self.last_progress = None
+
+    def show_progress(self, current, total):
+        self.progresses += 1
+        self.last_progress = (current, total)
+
+    def show_line(self, line):  # pylint: disable=unused-argument
+        self.lines += 1
+
+
+def _writer_cmd(options):
+    return [sys.executable, '-c', _WRITER, str(options.actions), str(options.warning_every),
+            str(options.rate)]
+
+
+def _cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def _streaming(options, counter, output_path):
+    p = subprocess.Popen(_writer_cmd(options), stdout=subprocess.PIPE)
+    with open(output_path, 'wb', 0) as output_file:
+        ninja_runner._stream_output(p.stdout.fileno(), output_file, counter.show_progress,
+                                    counter.show_line, options.refresh_interval)
+    p.stdout.close()
+    p.wait()
+
+
+def _polling(options, counter, output_path):
+    """The former implementation, which reads the output file and sleeps when it is empty."""
+    progress_re = re.compile(r'^\[(\d+)/(\d+)\]\s+')
+    with open(output_path, 'w', buffering=1) as wf, open(output_path, 'r', buffering=1) as rf:
+        p = subprocess.Popen(_writer_cmd(options), stdout=wf)
+        last_refresh_time = 0
+        while True:
+            p.poll()
+            line = rf.readline().strip()
+            if line:
+                m = progress_re.match(line)
+                if m:
+                    # The refresh interval was checked in the `console.show_progress_bar`
+                    now = time.time()
+                    if now - last_refresh_time >= options.refresh_interval:
+                        counter.show_progress(int(m.group(1)), int(m.group(2)))
+                        last_refresh_time = now
+                else:
+                    counter.show_line(line)
+            elif p.returncode is not None:
+                break
+            else:
+                time.sleep(0.1)
+
+
+def _measure(name, function, options):
+    counter = _Counter()
+    fd, output_path = tempfile.mkstemp(prefix='ninja_output_')
+    os.close(fd)
+    try:
+        start_time = time.time()
+        start_cpu_time = _cpu_time()
+        function(options, counter, output_path)
+        cost_time = time.time() - start_time
+        cpu_time = _cpu_time() - start_cpu_time
+        output_size = os.path.getsize(output_path)
+    finally:
+        os.remove(output_path)
+    print('%-9s %8.2fs %8.2fs %10d %8d %10.1fMB' % (
+        name, cost_time, cpu_time, counter.progresses, counter.lines,
+        output_size / 1024.0 / 1024.0))
+    return counter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--actions', type=int, default=200000, help='Number of actions')
+    parser.add_argument('--warning-every', type=int, default=1000,
+                        help='Output a warning every this number of actions, 0 for none')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Max number of actions per second, 0 for unlimited')
+    parser.add_argument('--refresh-interval', type=float, default=1,
+                        help='Min interval in seconds between the progress refreshes')
+    options = parser.parse_args()
+
+    # The CPU time is of the reader only, the writer runs in the child process
+    print('%-9s %9s %9s %10s %8s %12s' % ('reader', 'time', 'cpu time', 'refreshes', 'lines',
+                                          'output'))
+    streaming = _measure('streaming', _streaming, options)
+    polling = _measure('polling', _polling, options)
+    assert streaming.lines == polling.lines, (streaming.lines, polling.lines)
+    assert streaming.last_progress == (options.actions, options.actions), streaming.last_progress
+
+
+if __name__ == '__main__':
+    main()
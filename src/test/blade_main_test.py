@@ -29,12 +29,16 @@ from proto_library_test import TestProtoLibrary
 from prebuild_cc_library_test import TestPrebuildCcLibrary
 from query_target_test import TestQuery
 from resource_library_test import TestResourceLibrary
+from server_test import TestServer
+from string_table_test import StringTableTest
 from swig_library_test import TestSwigLibrary
 from target_dependency_test import TestDepsAnalyzing
 from target_pattern_test import TargetPatternTest
 from linker_scripts_test import LinkerScriptsTest
+from toolchain_test import ToolChainTest
 
 from html_test_runner import HTMLTestRunner
+from test_scheduler_test import TestSchedulerTest
 from test_target_test import TestTestRunner
 
 
@@ -56,12 +60,16 @@ def _main():
         unittest.defaultTestLoader.loadTestsFromTestCase(TestLoadBuilds),
         unittest.defaultTestLoader.loadTestsFromTestCase(TestProtoLibrary),
         unittest.defaultTestLoader.loadTestsFromTestCase(TestResourceLibrary),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestServer),
+        unittest.defaultTestLoader.loadTestsFromTestCase(StringTableTest),
         unittest.defaultTestLoader.loadTestsFromTestCase(TestSwigLibrary),
         unittest.defaultTestLoader.loadTestsFromTestCase(TestDepsAnalyzing),
         unittest.defaultTestLoader.loadTestsFromTestCase(TestQuery),
         unittest.defaultTestLoader.loadTestsFromTestCase(TestTestRunner),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestSchedulerTest),
         unittest.defaultTestLoader.loadTestsFromTestCase(TestPrebuildCcLibrary),
         unittest.defaultTestLoader.loadTestsFromTestCase(LinkerScriptsTest),
+        unittest.defaultTestLoader.loadTestsFromTestCase(ToolChainTest),
         ])
 
     generate_html = len(sys.argv) > 1 and sys.argv[1].startswith('html')
@@ -10,6 +10,11 @@
 
 """
 
+import json
+import os
+import socket
+import subprocess
+import time
 
 import blade_test
 
@@ -39,6 +44,105 @@ class TestCcLibrary(blade_test.TargetTest):
 
         self.assertDynamicLinkFlags(string_depends_libs)
 
+    def testIncrementalGeneration(self):
+        """Test the unchanged build script is not rewritten."""
+        self.assertTrue(self.dryRun())
+        build_script = os.path.join(self.current_building_path, 'build.ninja')
+        mtime = os.path.getmtime(build_script)
+        self.assertTrue(self.dryRun())
+        self.assertTrue(self.inBuildOutput('Using cached %s' % build_script))
+        self.assertEqual(mtime, os.path.getmtime(build_script))
+
+    def testRemovedTargetNinjaFile(self):
+        """Test the removed per-target ninja file is generated again."""
+        self.assertTrue(self.dryRun())
+        target_ninja = os.path.join(self.current_building_path, 'cc', 'uppercase.build.ninja')
+        os.remove(target_ninja)
+        self.assertTrue(self.dryRun())
+        self.assertTrue(self.inBuildOutput('Generating %s' % target_ninja))
+        self.assertTrue(os.path.isfile(target_ninja))
+
+    def testBuildCommandTargetsOnly(self):
+        """Test only the command targets are passed to ninja to build."""
+        self.targets = 'cc:uppercase'
+        self.assertTrue(self.runBlade())
+        self.assertTrue(self.findCommand('libuppercase.a'))
+        with open(os.path.join(self.current_building_path, 'build.ninja')) as f:
+            build_script = f.read()
+        self.assertIn('build __ALL_COMMAND_TARGETS__: phony build64_release/cc/uppercase.__outputs__\n',
+                      build_script)
+
+    def testBuiltinToolsWorker(self):
+        """Test the builtin tools are run in the worker."""
+        self.assertTrue(self.runBlade())
+        self.assertTrue(self.inBuildOutput('Builtin tools requests:'))
+        self.assertTrue(self.inBuildOutput(['cc_inclusion_check', 'requests, avg']))
+
+    def testBuiltinToolsWorkerFailure(self):
+        """Test the failure of the forked child is responded to the client."""
+        from blade import builtin_tools_server
+        os.makedirs('build64_release')
+        worker = builtin_tools_server.BuiltinToolsWorker(os.path.abspath('../..'), 'build64_release')
+        worker.start()
+        try:
+            socket_path = builtin_tools_server.socket_path('build64_release')
+            for _ in range(100):
+                if os.path.exists(socket_path):
+                    break
+                time.sleep(0.1)
+            # The forked child fails to change to the missing dir before running the tool
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(socket_path)
+                request = {'cwd': os.path.abspath('build64_release/missing'), 'env': {},
+                           'tool': 'cc_inclusion_check', 'argv': []}
+                sock.sendall(json.dumps(request).encode('utf-8'))
+                sock.shutdown(socket.SHUT_WR)
+                exit_code, output = builtin_tools_server._recv_all(sock).split(b'\n', 1)
+            finally:
+                sock.close()
+            self.assertEqual(b'1', exit_code)
+            self.assertIn(b'Builtin tools worker failed to run cc_inclusion_check', output)
+        finally:
+            worker.stop()
+
+    def testHeavyCompilePool(self):
+        """Test the compiles known to use much memory are run in the heavy_cc_pool."""
+        self.targets = 'cc:uppercase'
+        with open('BLADE_ROOT.local', 'w') as f:
+            f.write('cc_config(compile_memory_profiling=True, heavy_compile_memory="1K")\n')
+        try:
+            self.assertTrue(self.runBlade())
+            self.assertTrue(self.findCommand(['peak_rss.py', 'puppercase.cpp.o']))
+            self.assertTrue(self.runBlade())
+            self.assertTrue(self.inBuildOutput('Adjust parallel heavy compile jobs number'))
+            with open(os.path.join(self.current_building_path, 'cc', 'uppercase.build.ninja')) as f:
+                self.assertIn('pool = heavy_cc_pool', f.read())
+            # The depth of the pool is stable, so the build.ninja is not rewritten
+            build_ninja = os.path.join(self.current_building_path, 'build.ninja')
+            mtime = os.path.getmtime(build_ninja)
+            self.assertTrue(self.runBlade())
+            self.assertEqual(mtime, os.path.getmtime(build_ninja))
+        finally:
+            os.remove('BLADE_ROOT.local')
+
+    def testCcache(self):
+        """Test the compiles are run with ccache if it is enabled."""
+        self.targets = 'cc:uppercase'
+        with open('BLADE_ROOT.local', 'w') as f:
+            f.write('cc_config(ccache=True, ccache_dir="build64_release/.ccache")\n')
+        try:
+            self.assertTrue(self.runBlade())
+            if subprocess.call('ccache --version > /dev/null 2>&1', shell=True) != 0:
+                self.assertTrue(self.inBuildError('ccache is not found'))
+                return
+            self.assertTrue(self.findCommand(['ccache', '-c', 'puppercase.cpp.o']))
+            self.assertTrue(self.runBlade('clean'))
+            self.assertTrue(self.runBlade())
+            self.assertTrue(self.inBuildOutput('ccache: 1 hits'))
+        finally:
+            os.remove('BLADE_ROOT.local')
+
 
 if __name__ == '__main__':
     blade_test.run(TestCcLibrary)
@@ -22,6 +22,8 @@ class TestDump(blade_test.TargetTest):
         self.removeFile('blade-bin/dump.config')
         self.removeFile('blade-bin/compdb.json')
         self.removeFile('blade-bin/targets.json')
+        self.removeFile('blade-bin/build_times.json')
+        self.removeFile('blade-bin/critical_path.json')
 
     def testDumpConfig(self):
         self.assertTrue(self.runBlade('dump', '--config'))
@@ -39,5 +41,25 @@ class TestDump(blade_test.TargetTest):
         self.assertTrue(self.runBlade('dump', '--targets  --to-file=blade-bin/targets.json'))
         json.load(open('blade-bin/targets.json'))
 
+    def testDumpBuildTimes(self):
+        self.assertTrue(self.runBlade('build', '--show-builds-slower-than=0'))
+        self.assertTrue(self.inBuildOutput('Slow build targets:'))
+        self.assertTrue(self.runBlade('dump', '--build-times --to-file=blade-bin/build_times.json'))
+        build_times = json.load(open('blade-bin/build_times.json'))
+        self.assertTrue(build_times)
+        for item in build_times:
+            self.assertTrue(item['target'].startswith('cc:'))
+            self.assertEqual(item['last'], item['durations'][-1])
+
+    def testDumpCriticalPath(self):
+        self.assertTrue(self.runBlade('build', '--critical-path'))
+        self.assertTrue(self.inBuildOutput('Critical path:'))
+        self.assertTrue(self.runBlade('dump', '--critical-path --to-file=blade-bin/critical_path.json'))
+        result = json.load(open('blade-bin/critical_path.json'))
+        self.assertTrue(result['steps'])
+        self.assertLessEqual(result['length'], result['total_time'])
+        self.assertIn(result['steps'][-1]['rule'], ('ar', 'link', 'solink'))
+        self.assertTrue(result['steps'][-1]['target'].startswith('cc:'))
+
 if __name__ == '__main__':
     blade_test.run(TestDump)
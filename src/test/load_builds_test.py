@@ -37,6 +37,36 @@ class TestLoadBuilds(blade_test.TargetTest):
         java_jar = (self.target_path, 'poppy_java_client')
         cc_binary = (self.target_path, 'echoserver')
 
+    def testBuildFileCache(self):
+        """Test that the unchanged BUILD files are replayed from the cache."""
+        self.targets = 'cc/...'
+        self.assertTrue(self.dryRun())
+        self.assertTrue(self.inBuildOutput('BUILD files cache: 0 hits, 2 misses'))
+        self.assertTrue(self.runBlade())
+        self.assertTrue(self.inBuildOutput('BUILD files cache: 2 hits, 0 misses'))
+        # Diagnostics reported by the replayed rules should keep the source locations
+        self.assertTrue(self.inBuildError('cc/BUILD:42: warning'))
+        com_string_line = self.findCommand(['-c', 'blade_string.cpp.o'])
+        self.assertIn('-DBLADE_STR_DEF', com_string_line)
+        self.assertIn('-w', com_string_line)
+
+    def testParallelLoading(self):
+        """Test loading BUILD files in worker processes."""
+        self.targets = 'cc/... gen_rule/... proto/...'
+        self.assertTrue(self.dryRun(extra_args='--load-jobs=4'))
+        self.assertTrue(self.inBuildOutput('Loading BUILD files with 4 worker processes'))
+        self.assertTrue(self.inBuildError('cc/BUILD:42: warning'))
+        com_string_line = self.findCommand(['-c', 'blade_string.cpp.o'])
+        self.assertIn('-DBLADE_STR_DEF', com_string_line)
+    def testConsoleMessageLocation(self):
+        """Test the messages reported by the BUILD files have the right source locations."""
+        self.targets = 'test_loadbuilds/...'
+        for _ in range(2):  # Not cached and then not replayed
+            self.assertTrue(self.dryRun())
+            self.assertTrue(self.inBuildError(
+                ['test_loadbuilds/BUILD:3: warning', 'Message from the BUILD file']))
+            self.assertTrue(self.inBuildOutput('BUILD files cache: 0 hits, 1 misses'))
+
 
 if __name__ == '__main__':
     blade_test.run(TestLoadBuilds)
@@ -0,0 +1,65 @@
+# Copyright (c) 2021 Tencent Inc.
+# All rights reserved.
+#
+# Author: chen3feng <chen3feng@gmail.com>
+# Date:   2021-06-12
+
+
+"""
+This is the test module to test the blade server.
+"""
+
+import os
+import stat
+import subprocess
+import sys
+import time
+import unittest
+
+import blade_test
+from blade import server
+
+
+@unittest.skipIf(sys.version_info[0] < 3, 'The blade server requires python 3')
+class TestServer(blade_test.TargetTest):
+    """Test blade server."""
+    def setUp(self):
+        """setup method."""
+        self.doSetUp('cc', target='...')
+        self.server = subprocess.Popen(
+            '../../../blade server --foreground > server_output.txt 2>&1', shell=True)
+        self.assertTrue(self._wait_server(lambda status: status == 0))
+
+    def doTearDown(self):
+        subprocess.call('../../../blade server --stop > /dev/null 2>&1', shell=True)
+        self.server.wait()
+        if os.path.exists('server_output.txt'):
+            os.remove('server_output.txt')
+
+    def _wait_server(self, predicate):
+        for _ in range(100):
+            status = subprocess.call('../../../blade server --status > /dev/null 2>&1', shell=True)
+            if predicate(status):
+                return True
+            time.sleep(0.1)
+        return False
+
+    def testReuseLoadedTargets(self):
+        """Test the loaded targets are reused by the same command."""
+        self.assertTrue(self.dryRun())
+        self.assertTrue(self.dryRun())
+        self.assertTrue(self.inBuildOutput('Reuse the loaded targets in the blade server'))
+
+        os.utime('cc/BUILD', None)
+        self.assertTrue(self.dryRun())
+        self.assertTrue(self.inBuildOutput('Reuse the loaded targets in the blade server'))
+
+    def testPrivateSocket(self):
+        """Test the socket is in a dir which is private to the current user."""
+        path = server.socket_path(os.getcwd())
+        self.assertTrue(stat.S_ISSOCK(os.stat(path).st_mode))
+        self.assertEqual(0o700, stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode))
+
+
+if __name__ == '__main__':
+    blade_test.run(TestServer)
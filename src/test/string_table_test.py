@@ -0,0 +1,84 @@
+# Copyright (c) 2021 Tencent Inc.
+# All rights reserved.
+#
+# Author: chen3feng <chen3feng@gmail.com>
+# Date:   2021-07-03
+
+"""
+This is the test module for the sorted string tables file.
+"""
+
+import os
+
+import blade_test
+
+from blade import string_table
+
+
+class StringTableTest(blade_test.TargetTest):
+    def setUp(self):
+        self.doSetUp('cc')
+        os.makedirs('build64_release')
+        self.path = 'build64_release/string_table'
+
+    def _write(self, content):
+        with open(self.path, 'wb') as f:
+            f.write(content)
+
+    def testRoundTrip(self):
+        tables = [
+            {'a.h': '//a:a', 'b/c.h': '//b:c,//b:d', 'z.h': ''},
+            {},
+            {u'\u4e2d.h': u'\u6587'},
+        ]
+        self.assertTrue(string_table.write_file(self.path, tables))
+        self.assertFalse(string_table.write_file(self.path, tables))  # Unchanged
+        f = string_table.StringTableFile(self.path)
+        try:
+            for index, table in enumerate(tables):
+                self.assertEqual(len(table), len(f.table(index)))
+                for key, value in table.items():
+                    self.assertEqual(value, f.table(index).get(key))
+        finally:
+            f.close()
+
+    def testLookup(self):
+        keys = ['k%03d' % i for i in range(100)]
+        string_table.write_file(self.path, [dict((k, k.upper()) for k in keys)])
+        f = string_table.StringTableFile(self.path)
+        try:
+            table = f.table(0)
+            for key in keys:
+                self.assertEqual(key.upper(), table.get(key))
+                self.assertIn(key, table)
+            for key in ['', 'k', 'k0000', 'k100', 'zzz']:
+                self.assertNotIn(key, table)
+                self.assertEqual('default', table.get(key, 'default'))
+        finally:
+            f.close()
+
+    def testInvalidFile(self):
+        self._write(b'')
+        self.assertRaises(ValueError, string_table.StringTableFile, self.path)
+        self._write(b'NOTBLADE' + b'\0' * 100)
+        self.assertRaises(ValueError, string_table.StringTableFile, self.path)
+
+    def testTruncatedFile(self):
+        content = string_table.dumps([{'a.h': '//a:a', 'b.h': '//b:b'}, {'c.h': '//c:c'}])
+        for size in range(len(content)):
+            self._write(content[:size])
+            self.assertRaises(ValueError, string_table.StringTableFile, self.path)
+
+    def testCorruptedEntry(self):
+        content = string_table.dumps([{'a.h': '//a:a'}])
+        # Remove the separator between the key and the value
+        self._write(content.replace(b'a.h\0', b'a.hx'))
+        f = string_table.StringTableFile(self.path)
+        try:
+            self.assertRaises(ValueError, f.table(0).get, 'a.h')
+        finally:
+            f.close()
+
+
+if __name__ == '__main__':
+    blade_test.run(StringTableTest)
@@ -0,0 +1,90 @@
+# Copyright (c) 2021 Tencent Inc.
+# All rights reserved.
+#
+# Author: chen3feng <chen3feng@gmail.com>
+# Date:   2021-08-07
+
+"""
+This is the test module for the resource aware scheduling of the test scheduler.
+"""
+
+import unittest
+
+import blade_test
+
+from blade.test_scheduler import TestScheduler
+
+_G = 1 << 30
+
+
+class _FakeTarget(object):
+    def __init__(self, name, **attr):
+        self.key = 'test_scheduler:%s' % name
+        self.attr = attr
+
+
+def _job(name, **attr):
+    return (_FakeTarget(name, **attr), '.', {}, ['true'], None, '%s.log' % name)
+
+
+class TestSchedulerTest(unittest.TestCase):
+    def _scheduler(self, jobs, costs, cpu, memory):
+        scheduler = TestScheduler(jobs, cpu, {job[0].key: costs[i] for i, job in enumerate(jobs)})
+        scheduler.memory_budget = memory
+        return scheduler
+
+    @staticmethod
+    def _names(jobs):
+        return [job[0].key.split(':')[1] for job in jobs]
+
+    def testPackCpuAndMemory(self):
+        jobs = [_job('big_memory', memory=3 * _G), _job('more_memory', memory=2 * _G),
+                _job('small_1'), _job('small_2'), _job('two_cpu', cpu=2)]
+        scheduler = self._scheduler(jobs, [10, 10, 10, 10, 10], cpu=4, memory=4 * _G)
+        pending = list(jobs)
+        picked = scheduler._pick_jobs(pending, 4, 4 * _G, [], 0)
+        # The small ones which finish before the reserved time are run along
+        self.assertEqual(['big_memory', 'small_1', 'small_2'], self._names(picked))
+        self.assertEqual(['more_memory', 'two_cpu'], self._names(pending))
+        self.assertEqual(20, scheduler._predict_time(jobs))
+
+    def testWholeMachineJobStarts(self):
+        jobs = [_job('exclusive', exclusive=True), _job('short'), _job('long', cpu=2)]
+        scheduler = self._scheduler(jobs, [10, 3, 20], cpu=4, memory=4 * _G)
+        running = [(5, 1, 0), (10, 1, 0)]
+
+        # Only the jobs finish before the running ones are run before the exclusive one
+        pending = list(jobs)
+        picked = scheduler._pick_jobs(pending, 2, 4 * _G, running, 0)
+        self.assertEqual(['short'], self._names(picked))
+        self.assertEqual(['exclusive', 'long'], self._names(pending))
+
+        # Nothing is started when the running jobs are expected to finish now
+        picked = scheduler._pick_jobs(pending, 2, 4 * _G, [(10, 1, 0), (10, 1, 0)], 10)
+        self.assertEqual([], picked)
+
+        # Started as soon as the machine is free, the later job waits for it
+        picked = scheduler._pick_jobs(pending, 4, 4 * _G, [], 10)
+        self.assertEqual(['exclusive'], self._names(picked))
+        self.assertEqual(['long'], self._names(pending))
+
+    def testWholeMachineJobNotStarved(self):
+        jobs = [_job('exclusive', exclusive=True)] + [_job('small_%d' % i) for i in range(8)]
+        scheduler = self._scheduler(jobs, [10] + [5] * 8, cpu=4, memory=0)
+        pending = list(jobs)
+        # The 4 CPUs are freed one by one, every 2 seconds
+        running = [(2, 1, 0), (4, 1, 0), (6, 1, 0), (8, 1, 0)]
+        started = []
+        for now in (2, 4, 6, 8):
+            running = [item for item in running if item[0] > now]
+            free_cpu = 4 - len(running)
+            picked = scheduler._pick_jobs(pending, free_cpu, 0, running, now)
+            started += [(now, name) for name in self._names(picked)]
+            running += [(now + 5, 1, 0)] * len(picked)
+            running.sort()
+        # Only the small job which finishes before the reserved time 8 is started before it
+        self.assertEqual([(2, 'small_0'), (8, 'exclusive')], started)
+
+
+if __name__ == '__main__':
+    blade_test.run(TestSchedulerTest)
@@ -11,6 +11,11 @@
 """
 
 
+import json
+import os
+import sqlite3
+import time
+
 import blade_test
 
 
@@ -36,6 +41,188 @@ class TestTestRunner(blade_test.TargetTest):
         self.assertLinkFlags(string_main_depends_libs)
         self.assertNotIn('liblowercase.a', string_main_depends_libs)
 
+    def testLongestTestFirst(self):
+        """Test the tests are scheduled by their costs in the history."""
+        self.targets = 'test_test_runner/...'
+        self.assertTrue(self.runBlade('test', '--full-test'))
+        # Seed the history with the known costs, string_test_main has no history
+        db = sqlite3.connect('build64_release/.blade.test.history.db')
+        with db:
+            db.execute('DELETE FROM runs')
+            db.executemany('INSERT INTO runs (key, start_time, cost_time, exit_code) '
+                           'VALUES (?, ?, ?, 0)',
+                           [('test_test_runner:sharded_test', time.time(), 100.0),
+                            ('test_test_runner:string_test_main_2', time.time(), 30.0)])
+        db.close()
+        self.assertTrue(self.runBlade('test', '--full-test --test-jobs 1'))
+        # The test without history costs as the longest known one, the sharded test costs
+        # 50s for each shard.
+        self.assertTrue(self.inBuildOutput('Critical path: predicted 230.00s'))
+        started = [self.findBuildOutput(['Start', name])[1] for name in (
+            "string_test_main'", 'sharded_test', "string_test_main_2'")]
+        self.assertEqual(sorted(started), started)
+
+    def testShardedTest(self):
+        """Test the sharded test is run in multiple shards."""
+        self.targets = 'test_test_runner:sharded_test'
+        self.assertTrue(self.runBlade('test', '--full-test --test-jobs 2'))
+        self.assertTrue(self.inBuildOutput('sharded_test(shard 1/2) finished'))
+        self.assertTrue(self.inBuildOutput('sharded_test(shard 2/2) finished'))
+        self.assertTrue(os.path.isdir('build64_release/test_test_runner/sharded_test.shard1.runfiles'))
+        # The outputs are redirected into the log files when running concurrently
+        with open('blade-bin/.blade-test-summary.json') as f:
+            summary = json.load(f)
+        log_files = summary['passed']['test_test_runner:sharded_test']['log_files']
+        self.assertEqual(['build64_release/test_test_runner/sharded_test.shard0.log',
+                          'build64_release/test_test_runner/sharded_test.shard1.log'], log_files)
+        self.assertTrue(all(os.path.isfile(log_file) for log_file in log_files))
+
+    def testTestResultCache(self):
+        """Test the passed results are reused from the test result cache."""
+        # The results are not looked up for the explicitly specified tests
+        self.targets = 'test_test_runner/...'
+        self.assertTrue(self.runBlade('test'))
+        os.remove('build64_release/.blade.test.history.db')
+        self.assertTrue(self.runBlade('test'))
+        self.assertTrue(self.inBuildOutput('3 cached'))
+        with open('blade-bin/.blade-test-summary.json') as f:
+            summary = json.load(f)
+        self.assertIn('test_test_runner:string_test_main', summary['cached'])
+        # The cached results are not recorded as new runs in the history
+        self.assertTrue(self.runBlade('test'))
+        db = sqlite3.connect('build64_release/.blade.test.history.db')
+        count = db.execute('SELECT COUNT(*) FROM runs WHERE key = ?',
+                           ('test_test_runner:string_test_main',)).fetchone()[0]
+        db.close()
+        self.assertEqual(0, count)
+
+    def testTestResultCachePrune(self):
+        """Test the expired entries are removed from the test result cache."""
+        cache_dir = 'build64_release/.test_result_cache'
+        expired_entry = os.path.join(cache_dir, '00', '00expired')
+        if not os.path.isdir(os.path.dirname(expired_entry)):
+            os.makedirs(os.path.dirname(expired_entry))
+        with open(expired_entry, 'w') as f:
+            f.write('{}')
+        two_days_ago = time.time() - 2 * 86400
+        os.utime(expired_entry, (two_days_ago, two_days_ago))
+        if os.path.exists(os.path.join(cache_dir, '.last_prune')):
+            os.remove(os.path.join(cache_dir, '.last_prune'))
+        self.targets = 'test_test_runner/...'
+        self.assertTrue(self.runBlade('test'))
+        self.assertFalse(os.path.exists(expired_entry))
+        self.assertTrue(os.path.exists(os.path.join(cache_dir, '.last_prune')))
+
+    def testTestTimeout(self):
+        """Test the tests exceeded the timeout are killed without blocking others."""
+        self.targets = 'test_timeout/...'
+        with open('BLADE_ROOT.local', 'w') as f:
+            f.write('global_config(test_timeout=1)\n')
+        try:
+            start_time = time.time()
+            self.assertFalse(self.runBlade('test', '--test-jobs=3', print_error=False))
+            # Both sleep 60s, the stubborn one is killed after ignoring the SIGTERM
+            self.assertLess(time.time() - start_time, 30)
+        finally:
+            os.remove('BLADE_ROOT.local')
+        self.assertTrue(self.inBuildError('//test_timeout:sleep_test: TIMEOUT'))
+        self.assertTrue(self.inBuildError('//test_timeout:stubborn_sleep_test: TIMEOUT'))
+        # The quick test is finished while the others are running
+        quick_lineno = self.findBuildOutput(['//test_timeout:quick_test finished', 'SUCCESS'])[1]
+        sleep_lineno = self.findBuildOutput(['//test_timeout:sleep_test finished', 'TIMEOUT'])[1]
+        self.assertLess(quick_lineno, sleep_lineno)
+        with open('blade-bin/.blade-test-summary.json') as f:
+            summary = json.load(f)
+        self.assertIn('test_timeout:quick_test', summary['passed'])
+        self.assertIn('test_timeout:sleep_test', summary['failed'])
+        self.assertIn('test_timeout:stubborn_sleep_test', summary['failed'])
+
+    def testTestImpactAnalysis(self):
+        """Test only the tests affected by the changed files are run."""
+        self.targets = 'test_test_runner/...'
+        self.assertTrue(self.runBlade('test', '--changed-files=test_test_runner/string_test_2.cpp'))
+        self.assertTrue(self.inBuildOutput('1 changed files, 2 of 3 tests are affected'))
+        with open('blade-bin/.blade-test-summary.json') as f:
+            summary = json.load(f)
+        self.assertEqual(['test_test_runner:string_test_main'], summary['unaffected'])
+        self.assertEqual({'file': 'test_test_runner/string_test_2.cpp',
+                          'target': 'test_test_runner:sharded_test'},
+                         summary['impact']['selected']['test_test_runner:sharded_test'])
+
+    def testTestImpactAnalysisFallback(self):
+        """Test all tests are affected by the changed config files and the unowned files."""
+        self.targets = 'test_test_runner/...'
+        self.assertTrue(self.runBlade('test', '--changed-files=BLADE_ROOT'))
+        self.assertTrue(self.inBuildOutput('1 changed files, 3 of 3 tests are affected'))
+        self.assertTrue(self.runBlade('test', '--changed-files=test_test_runner/unowned.txt'))
+        self.assertTrue(self.inBuildError('1 changed files are not owned by any target'))
+        self.assertTrue(self.inBuildOutput('1 changed files, 3 of 3 tests are affected'))
+        with open('blade-bin/.blade-test-summary.json') as f:
+            summary = json.load(f)
+        self.assertEqual(['test_test_runner/unowned.txt'], summary['impact']['unowned_files'])
+
+    def testIncrementalRunfiles(self):
+        """Test the runfiles dir is kept and only the changed entries are updated."""
+        self.targets = 'test_test_runner:string_test_main_2'
+        self.assertTrue(self.runBlade('test', '--full-test'))
+        runfiles_dir = 'build64_release/test_test_runner/string_test_main_2.runfiles'
+        data_file = os.path.join(runfiles_dir, 'data/a.txt')
+        self.assertTrue(os.path.isfile(data_file))
+        inode = os.stat(data_file).st_ino
+        garbage_file = os.path.join(runfiles_dir, 'garbage.txt')
+        with open(garbage_file, 'w') as f:
+            f.write('garbage')
+        self.assertTrue(self.runBlade('test', '--full-test'))
+        self.assertEqual(inode, os.stat(data_file).st_ino)
+        self.assertFalse(os.path.exists(garbage_file))
+
+    def testRunfilesSymlinkedDir(self):
+        """Test the symbolic links to dirs in the testdata dir are followed except the loops."""
+        self.targets = 'test_test_runner:string_test_main_2'
+        self.assertTrue(self.runBlade('test', '--full-test'))
+        runfiles_dir = 'build64_release/test_test_runner/string_test_main_2.runfiles'
+        self.assertTrue(os.path.isfile(os.path.join(runfiles_dir, 'data/linked/b.txt')))
+        self.assertFalse(os.path.exists(os.path.join(runfiles_dir, 'data/linked/loop')))
+        self.assertTrue(self.inBuildError('Symbolic link loop'))
+
+    def testFlakyTestRetry(self):
+        """Test the flaky test is retried and reported."""
+        self.targets = 'test_retry:flaky_test'
+        self.assertTrue(self.runBlade('test'))
+        self.assertTrue(self.inBuildError('failed, retry 1/2'))
+        self.assertTrue(self.inBuildOutput('1 passed, 1 flaky'))
+        with open('blade-bin/.blade-test-summary.json') as f:
+            summary = json.load(f)
+        self.assertEqual(1, summary['flaky']['test_retry:flaky_test']['failed_attempts'])
+        self.assertTrue(summary['passed']['test_retry:flaky_test']['flaky'])
+
+    def testFlakyTestAttemptLogs(self):
+        """Test the output of each attempt of the retried test is kept in its own log file."""
+        self.targets = 'test_retry:flaky_test'
+        # The output is redirected in the quiet mode
+        self.assertTrue(self.runBlade('test', '--quiet'))
+        with open('blade-bin/.blade-test-summary.json') as f:
+            summary = json.load(f)
+        log_files = summary['passed']['test_retry:flaky_test']['log_files']
+        self.assertEqual(['build64_release/test_retry/flaky_test.log',
+                          'build64_release/test_retry/flaky_test.attempt1.log'], log_files)
+        with open(log_files[0]) as f:
+            self.assertIn('Failed on the first attempt', f.read())
+        with open(log_files[1]) as f:
+            self.assertIn('Passed on the retry', f.read())
+
+    def testTrace(self):
+        """Test the trace of the stages, the build actions and the tests is written."""
+        trace_file = 'build64_release/blade_trace.json'
+        self.assertTrue(self.runBlade('test', '--full-test --trace=%s' % trace_file))
+        with open(trace_file) as f:
+            events = json.load(f)['traceEvents']
+        categories = set(event.get('cat') for event in events if event['ph'] == 'X')
+        for category in ('stage', 'load', 'generate', 'ninja', 'test'):
+            self.assertIn(category, categories)
+        self.assertIn({'name': 'test_test_runner:string_test_main', 'cat': 'test'},
+                      [{'name': e['name'], 'cat': e.get('cat')} for e in events])
+
 
 if __name__ == '__main__':
     blade_test.run(TestTestRunner)
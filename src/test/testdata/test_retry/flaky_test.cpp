@@ -0,0 +1,19 @@
+// Fails on the first attempt and passes on the retry, the mark file is kept in the runfiles
+// dir during the same test run.
+
+#include <stdio.h>
+
+int main() {
+    FILE* fp = fopen("attempted", "r");
+    if (fp != NULL) {
+        fclose(fp);
+        printf("Passed on the retry\n");
+        return 0;
+    }
+    fp = fopen("attempted", "w");
+    if (fp != NULL) {
+        fclose(fp);
+    }
+    printf("Failed on the first attempt\n");
+    return 1;
+}
@@ -0,0 +1,7 @@
+#include <unistd.h>
+
+// Sleep past the test timeout
+int main() {
+    sleep(60);
+    return 0;
+}
@@ -0,0 +1,9 @@
+#include <signal.h>
+#include <unistd.h>
+
+// Ignore the SIGTERM and sleep past the test timeout
+int main() {
+    signal(SIGTERM, SIG_IGN);
+    sleep(60);
+    return 0;
+}
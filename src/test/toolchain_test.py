@@ -0,0 +1,71 @@
+# Copyright (c) 2021 Tencent Inc.
+# All rights reserved.
+#
+# Author: chen3feng <chen3feng@gmail.com>
+# Date:   2021-06-20
+
+"""
+This is the test module for the toolchain probing.
+"""
+
+import os
+
+import blade_test
+
+from blade import toolchain
+
+
+class ToolChainTest(blade_test.TargetTest):
+    def setUp(self):
+        self.doSetUp('cc')
+        os.makedirs('build64_release')
+        self.build_dir = os.path.abspath('build64_release')
+        self.probe_log = os.path.join(self.build_dir, 'probe.log')
+        self.saved_cc = os.environ.get('CC')
+
+    def doTearDown(self):
+        if self.saved_cc is None:
+            os.environ.pop('CC', None)
+        else:
+            os.environ['CC'] = self.saved_cc
+
+    def _write_cc(self, name, version):
+        """Write a fake compiler which records each run."""
+        path = os.path.join(self.build_dir, name)
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\necho "$0 $*" >> %s\necho %s\n' % (self.probe_log, version))
+        os.chmod(path, 0o755)
+        return path
+
+    def _probe_count(self):
+        if not os.path.exists(self.probe_log):
+            return 0
+        with open(self.probe_log) as f:
+            return len(f.readlines())
+
+    def _cc_version(self, cc):
+        os.environ['CC'] = cc
+        return toolchain.ToolChain(self.build_dir).get_cc_version()
+
+    def testProbeCache(self):
+        cc1 = self._write_cc('cc1', '1.0')
+        cc2 = self._write_cc('cc2', '2.0')
+        self.assertEqual('1.0', self._cc_version(cc1))
+        self.assertEqual(1, self._probe_count())
+
+        # Cached
+        self.assertEqual('1.0', self._cc_version(cc1))
+        self.assertEqual(1, self._probe_count())
+
+        # The configured compiler is changed
+        self.assertEqual('2.0', self._cc_version(cc2))
+        self.assertEqual(2, self._probe_count())
+
+        # The compiler is upgraded in place
+        self._write_cc('cc1', '1.0.1')
+        self.assertEqual('1.0.1', self._cc_version(cc1))
+        self.assertEqual(3, self._probe_count())
+
+
+if __name__ == '__main__':
+    blade_test.run(ToolChainTest)